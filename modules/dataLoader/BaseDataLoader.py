@@ -24,6 +24,12 @@ class BaseDataLoader(
         self.train_device = train_device
         self.temp_device = temp_device
 
+        # pipeline modules that expose a get_metrics() function
+        self._metric_modules = []
+
+        # pipeline modules that load data in the background and expose pause() and resume() functions
+        self._streaming_modules = []
+
     @abstractmethod
     def get_data_set(self) -> MGDS:
         pass
@@ -32,6 +38,20 @@ class BaseDataLoader(
     def get_data_loader(self) -> TrainDataLoader:
         pass
 
+    def get_metrics(self) -> dict[str, float]:
+        metrics = {}
+        for module in self._metric_modules:
+            metrics.update(module.get_metrics())
+        return metrics
+
+    def pause_streaming(self):
+        for module in self._streaming_modules:
+            module.pause()
+
+    def resume_streaming(self):
+        for module in self._streaming_modules:
+            module.resume()
+
     @abstractmethod
     def setup_cache_device(
             self,
@@ -1,4 +1,5 @@
 import json
+from functools import partial
 
 from mgds.DebugDataLoaderModules import DecodeVAE, SaveImage, SaveText, DecodeTokens
 from mgds.DiffusersDataLoaderModules import *
@@ -7,8 +8,19 @@ from mgds.MGDS import TrainDataLoader, OutputPipelineModule, MGDS
 from mgds.TransformersDataLoaderModules import *
 
 from modules.dataLoader.BaseDataLoader import BaseDataLoader
+from modules.dataLoader.cache.BoundedRamCache import BoundedRamCache
+from modules.dataLoader.cache.ConvertMemoryFormat import ConvertMemoryFormat
+from modules.dataLoader.cache.SharedDiskCache import SharedDiskCache
+from modules.dataLoader.cache.StreamingAspectBatchSorting import StreamingAspectBatchSorting
+from modules.dataLoader.augmentation.BatchedImageAugmentation import BatchedImageAugmentation
+from modules.dataLoader.augmentation.OversizeCropResolution import OversizeCropResolution
+from modules.dataLoader.augmentation.RandomLatentFlipCrop import RandomLatentFlipCrop
+from modules.dataLoader.augmentation.SelectTextVariant import SelectTextVariant
+from modules.dataLoader.augmentation.ShuffleTagVariants import ShuffleTagVariants
+from modules.dataLoader.text.EncodeClipTextVariants import EncodeClipTextVariants
+from modules.dataLoader.text.TokenizeVariants import TokenizeVariants
 from modules.model.StableDiffusionModel import StableDiffusionModel
-from modules.util import path_util
+from modules.util import path_util, cache_util
 from modules.util.TrainProgress import TrainProgress
 from modules.util.args.TrainArgs import TrainArgs
 from modules.util.enum.TrainingMethod import TrainingMethod
@@ -62,16 +74,24 @@ class StablDiffusionBaseDataLoader(BaseDataLoader):
             args: TrainArgs,
     ):
         cache_epoch = train_progress.epoch % args.latent_caching_epochs
+        image_cache_epoch = 0 if args.latent_augmentation else cache_epoch
+        text_cache_epoch = 0 if args.tag_shuffling_variants > 1 else cache_epoch
 
-        image_cache_dir = os.path.join(args.cache_dir, "image", "epoch-" + str(cache_epoch))
-        text_cache_dir = os.path.join(args.cache_dir, "text", "epoch-" + str(cache_epoch))
+        image_cache_dir = os.path.join(args.cache_dir, "image", "epoch-" + str(image_cache_epoch))
+        text_cache_dir = os.path.join(args.cache_dir, "text", "epoch-" + str(text_cache_epoch))
 
         if args.latent_caching:
-            if not os.path.exists(image_cache_dir):
+            if cache_util.uses_shared_disk_cache(args):
+                if not SharedDiskCache.is_complete(cache_util.disk_cache_dir(args, "image"), image_cache_epoch):
+                    return True
+            elif not os.path.exists(image_cache_dir):
                 return True
 
         if not args.train_text_encoder and args.latent_caching and args.training_method != TrainingMethod.EMBEDDING:
-            if not os.path.exists(text_cache_dir):
+            if cache_util.uses_shared_disk_cache(args):
+                if not SharedDiskCache.is_complete(cache_util.disk_cache_dir(args, "text"), text_cache_epoch):
+                    return True
+            elif not os.path.exists(text_cache_dir):
                 return True
 
         return args.debug_mode
@@ -174,11 +194,26 @@ class StablDiffusionBaseDataLoader(BaseDataLoader):
         return modules
 
     def _crop_modules(self, args: TrainArgs):
-        scale_crop_image = ScaleCropImage(image_in_name='image', scale_resolution_in_name='scale_resolution', crop_resolution_in_name='crop_resolution', enable_crop_jitter_in_name='concept.enable_crop_jitter', image_out_name='image', crop_offset_out_name='crop_offset')
-        scale_crop_mask = ScaleCropImage(image_in_name='mask', scale_resolution_in_name='scale_resolution', crop_resolution_in_name='crop_resolution', enable_crop_jitter_in_name='concept.enable_crop_jitter', image_out_name='mask', crop_offset_out_name='crop_offset')
-        scale_crop_depth = ScaleCropImage(image_in_name='depth', scale_resolution_in_name='scale_resolution', crop_resolution_in_name='crop_resolution', enable_crop_jitter_in_name='concept.enable_crop_jitter', image_out_name='depth', crop_offset_out_name='crop_offset')
+        oversize_crop_resolution = OversizeCropResolution(scale_resolution_in_name='scale_resolution', crop_resolution_in_name='crop_resolution', enable_crop_jitter_in_name='concept.enable_crop_jitter', crop_resolution_out_name='cache_crop_resolution', margin=args.latent_augmentation_crop_margin, quantization=8)
 
-        modules = [scale_crop_image]
+        if args.latent_augmentation:
+            # cache an oversized crop, crop jitter is applied to the cached latents
+            crop_resolution_in_name = 'cache_crop_resolution'
+            enable_crop_jitter_in_name = 'settings.enable_image_crop_jitter'
+        else:
+            crop_resolution_in_name = 'crop_resolution'
+            enable_crop_jitter_in_name = 'concept.enable_crop_jitter'
+
+        scale_crop_image = ScaleCropImage(image_in_name='image', scale_resolution_in_name='scale_resolution', crop_resolution_in_name=crop_resolution_in_name, enable_crop_jitter_in_name=enable_crop_jitter_in_name, image_out_name='image', crop_offset_out_name='crop_offset')
+        scale_crop_mask = ScaleCropImage(image_in_name='mask', scale_resolution_in_name='scale_resolution', crop_resolution_in_name=crop_resolution_in_name, enable_crop_jitter_in_name=enable_crop_jitter_in_name, image_out_name='mask', crop_offset_out_name='crop_offset')
+        scale_crop_depth = ScaleCropImage(image_in_name='depth', scale_resolution_in_name='scale_resolution', crop_resolution_in_name=crop_resolution_in_name, enable_crop_jitter_in_name=enable_crop_jitter_in_name, image_out_name='depth', crop_offset_out_name='crop_offset')
+
+        modules = []
+
+        if args.latent_augmentation:
+            modules.append(oversize_crop_resolution)
+
+        modules.append(scale_crop_image)
 
         if args.masked_training or args.model_type.has_mask_input():
             modules.append(scale_crop_mask)
@@ -203,17 +238,37 @@ class StablDiffusionBaseDataLoader(BaseDataLoader):
         random_contrast = RandomContrast(names=['image'], enabled_in_name='concept.enable_random_contrast', max_strength_in_name='concept.random_contrast_max_strength')
         random_saturation = RandomSaturation(names=['image'], enabled_in_name='concept.enable_random_saturation', max_strength_in_name='concept.random_saturation_max_strength')
         random_hue = RandomHue(names=['image'], enabled_in_name='concept.enable_random_hue', max_strength_in_name='concept.random_hue_max_strength')
+        batched_augmentation = BatchedImageAugmentation(
+            names=inputs, color_names=['image'], chunk_size=args.batched_augmentation_chunk_size,
+            flip_enabled_in_name=None if args.latent_augmentation else 'concept.enable_random_flip',
+            rotate_enabled_in_name='concept.enable_random_rotate', rotate_max_angle_in_name='concept.random_rotate_max_angle',
+            brightness_enabled_in_name='concept.enable_random_brightness', brightness_max_strength_in_name='concept.random_brightness_max_strength',
+            contrast_enabled_in_name='concept.enable_random_contrast', contrast_max_strength_in_name='concept.random_contrast_max_strength',
+            saturation_enabled_in_name='concept.enable_random_saturation', saturation_max_strength_in_name='concept.random_saturation_max_strength',
+            hue_enabled_in_name='concept.enable_random_hue', hue_max_strength_in_name='concept.random_hue_max_strength',
+        )
         shuffle_tags = ShuffleTags(text_in_name='prompt', enabled_in_name='concept.enable_tag_shuffling', delimiter_in_name='concept.tag_delimiter', keep_tags_count_in_name='concept.keep_tags_count', text_out_name='prompt')
+        shuffle_tag_variants = ShuffleTagVariants(text_in_name='prompt', enabled_in_name='concept.enable_tag_shuffling', delimiter_in_name='concept.tag_delimiter', keep_tags_count_in_name='concept.keep_tags_count', texts_out_name='prompt_variants', variant_count=args.tag_shuffling_variants)
 
-        modules = [
-            random_flip,
-            random_rotate,
-            random_brightness,
-            random_contrast,
-            random_saturation,
-            random_hue,
-            shuffle_tags,
-        ]
+        tag_shuffling = shuffle_tag_variants if args.tag_shuffling_variants > 1 else shuffle_tags
+
+        if args.batched_augmentation:
+            modules = [
+                batched_augmentation,
+                tag_shuffling,
+            ]
+        else:
+            modules = [
+                random_rotate,
+                random_brightness,
+                random_contrast,
+                random_saturation,
+                random_hue,
+                tag_shuffling,
+            ]
+
+            if not args.latent_augmentation:
+                modules.insert(0, random_flip)
 
         return modules
 
@@ -237,6 +292,12 @@ class StablDiffusionBaseDataLoader(BaseDataLoader):
         downscale_depth = ScaleImage(in_name='depth', out_name='latent_depth', factor=0.125)
         tokenize_prompt = Tokenize(in_name='prompt', tokens_out_name='tokens', mask_out_name='tokens_mask', tokenizer=model.tokenizer, max_token_length=model.tokenizer.model_max_length)
         encode_prompt = EncodeClipText(in_name='tokens', hidden_state_out_name='text_encoder_hidden_state', pooled_out_name=None, add_layer_norm=True, text_encoder=model.text_encoder, hidden_state_output_index=-(1+args.text_encoder_layer_skip))
+        tokenize_prompt_variants = TokenizeVariants(texts_in_name='prompt_variants', tokens_out_name='tokens_variants', tokenizer=model.tokenizer, max_token_length=model.tokenizer.model_max_length)
+        encode_prompt_variants = EncodeClipTextVariants(tokens_in_name='tokens_variants', hidden_state_out_name='text_encoder_hidden_state_variants', pooled_out_name=None, add_layer_norm=True, text_encoder=model.text_encoder, hidden_state_output_index=-(1+args.text_encoder_layer_skip))
+
+        if args.tag_shuffling_variants > 1:
+            tokenize_prompt = tokenize_prompt_variants
+            encode_prompt = encode_prompt_variants
 
         modules = [rescale_image, encode_image, tokenize_prompt]
 
@@ -270,20 +331,38 @@ class StablDiffusionBaseDataLoader(BaseDataLoader):
 
         image_aggregate_names = ['crop_resolution', 'image_path']
 
-        text_split_names = ['tokens', 'text_encoder_hidden_state']
+        if args.tag_shuffling_variants > 1:
+            text_split_names = ['tokens_variants', 'text_encoder_hidden_state_variants']
+        else:
+            text_split_names = ['tokens', 'text_encoder_hidden_state']
 
-        image_cache_dir = os.path.join(args.cache_dir, "image")
-        text_cache_dir = os.path.join(args.cache_dir, "text")
+        image_cache_dir = cache_util.disk_cache_dir(args, "image")
+        text_cache_dir = cache_util.disk_cache_dir(args, "text")
 
-        image_disk_cache = DiskCache(cache_dir=image_cache_dir, split_names=image_split_names, aggregate_names=image_aggregate_names, cached_epochs=args.latent_caching_epochs)
+        if cache_util.uses_shared_disk_cache(args):
+            # in streaming mode, items are cached on their first access during training
+            disk_cache = partial(SharedDiskCache, fill_on_start=not args.streaming_caching_enabled())
+        else:
+            disk_cache = DiskCache
+
+        image_disk_cache = disk_cache(cache_dir=image_cache_dir, split_names=image_split_names, aggregate_names=image_aggregate_names, cached_epochs=1 if args.latent_augmentation else args.latent_caching_epochs)
         image_ram_cache = RamCache(names=image_split_names + image_aggregate_names)
+        image_bounded_ram_cache = BoundedRamCache(
+            names=image_split_names + image_aggregate_names,
+            max_bytes=int(args.ram_cache_max_size * 1024 ** 3),
+            spill_dir=os.path.join(args.cache_dir, "ram-spill", "image") if args.ram_cache_spill else None,
+            metrics_prefix='image_ram_cache',
+        )
 
-        text_disk_cache = DiskCache(cache_dir=text_cache_dir, split_names=text_split_names, aggregate_names=[], cached_epochs=args.latent_caching_epochs)
+        text_disk_cache = disk_cache(cache_dir=text_cache_dir, split_names=text_split_names, aggregate_names=[], cached_epochs=1 if args.tag_shuffling_variants > 1 else args.latent_caching_epochs)
 
         modules = []
 
         if args.latent_caching:
             modules.append(image_disk_cache)
+        elif args.ram_cache_max_size > 0:
+            modules.append(image_bounded_ram_cache)
+            self._metric_modules.append(image_bounded_ram_cache)
         else:
             modules.append(image_ram_cache)
 
@@ -308,24 +387,58 @@ class StablDiffusionBaseDataLoader(BaseDataLoader):
         if not args.train_text_encoder and args.training_method != TrainingMethod.EMBEDDING:
             output_names.append('text_encoder_hidden_state')
 
+        latent_names = ['latent_image']
+
+        if args.masked_training or args.model_type.has_mask_input():
+            latent_names.append('latent_mask')
+
+        if args.model_type.has_conditioning_image_input():
+            latent_names.append('latent_conditioning_image')
+
+        if args.model_type.has_depth_input():
+            latent_names.append('latent_depth')
+
+        variant_in_names = ['tokens_variants']
+        variant_out_names = ['tokens']
+
+        if not args.train_text_encoder and args.training_method != TrainingMethod.EMBEDDING:
+            variant_in_names.append('text_encoder_hidden_state_variants')
+            variant_out_names.append('text_encoder_hidden_state')
+
+        select_text_variant = SelectTextVariant(texts_in_name='prompt_variants', text_out_name='prompt', in_names=variant_in_names, out_names=variant_out_names)
         image_sample = SampleVAEDistribution(in_name='latent_image_distribution', out_name='latent_image', mode='mean')
         conditioning_image_sample = SampleVAEDistribution(in_name='latent_conditioning_image_distribution', out_name='latent_conditioning_image', mode='mean')
+        latent_flip_crop = RandomLatentFlipCrop(names=latent_names, crop_resolution_in_name='crop_resolution', enable_flip_in_name='concept.enable_random_flip', enable_crop_jitter_in_name='concept.enable_crop_jitter', downscale_factor=8)
         mask_remove = RandomLatentMaskRemove(
             latent_mask_name='latent_mask', latent_conditioning_image_name='latent_conditioning_image',
             replace_probability=args.unmasked_probability, vae=model.vae, possible_resolutions_in_name='possible_resolutions'
         )
         batch_sorting = AspectBatchSorting(resolution_in_name='crop_resolution', names=output_names, batch_size=args.batch_size, sort_resolutions_for_each_epoch=True)
+        streaming_batch_sorting = StreamingAspectBatchSorting(resolution_in_name='crop_resolution', names=output_names, batch_size=args.batch_size, lookahead=args.streaming_caching_lookahead)
+        channels_last = ConvertMemoryFormat(names=latent_names, memory_format=torch.channels_last)
         output = OutputPipelineModule(names=output_names)
 
         modules = [image_sample]
 
+        if args.tag_shuffling_variants > 1:
+            modules.append(select_text_variant)
+
         if args.model_type.has_conditioning_image_input():
             modules.append(conditioning_image_sample)
 
+        if args.latent_augmentation:
+            modules.append(latent_flip_crop)
+
         if args.model_type.has_mask_input():
             modules.append(mask_remove)
 
-        if args.aspect_ratio_bucketing:
+        if args.unet_channels_last:
+            modules.append(channels_last)
+
+        if args.streaming_caching_enabled():
+            modules.append(streaming_batch_sorting)
+            self._streaming_modules.append(streaming_batch_sorting)
+        elif args.aspect_ratio_bucketing:
             modules.append(batch_sorting)
 
         modules.append(output)
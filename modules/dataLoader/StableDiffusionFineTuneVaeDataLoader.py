@@ -6,6 +6,8 @@ from mgds.GenericDataLoaderModules import *
 from mgds.MGDS import MGDS, TrainDataLoader, OutputPipelineModule
 
 from modules.dataLoader.BaseDataLoader import BaseDataLoader
+from modules.dataLoader.cache.BoundedRamCache import BoundedRamCache
+from modules.dataLoader.cache.ConvertMemoryFormat import ConvertMemoryFormat
 from modules.model.StableDiffusionModel import StableDiffusionModel
 from modules.util import path_util
 from modules.util.TrainProgress import TrainProgress
@@ -168,11 +170,20 @@ class StableDiffusionFineTuneVaeDataLoader(BaseDataLoader):
         disk_cache = DiskCache(cache_dir=args.cache_dir, split_names=split_names, aggregate_names=aggregate_names,
                                cached_epochs=args.latent_caching_epochs)
         ram_cache = RamCache(names=split_names + aggregate_names)
+        bounded_ram_cache = BoundedRamCache(
+            names=split_names + aggregate_names,
+            max_bytes=int(args.ram_cache_max_size * 1024 ** 3),
+            spill_dir=os.path.join(args.cache_dir, "ram-spill") if args.ram_cache_spill else None,
+            metrics_prefix='ram_cache',
+        )
 
         modules = []
 
         if args.latent_caching:
             modules.append(disk_cache)
+        elif args.ram_cache_max_size > 0:
+            modules.append(bounded_ram_cache)
+            self._metric_modules.append(bounded_ram_cache)
         else:
             modules.append(ram_cache)
 
@@ -188,10 +199,14 @@ class StableDiffusionFineTuneVaeDataLoader(BaseDataLoader):
         image_sample = SampleVAEDistribution(in_name='latent_image_distribution', out_name='latent_image', mode='mean')
         batch_sorting = AspectBatchSorting(resolution_in_name='crop_resolution', names=output_names,
                                            batch_size=args.batch_size, sort_resolutions_for_each_epoch=True)
+        channels_last = ConvertMemoryFormat(names=['image', 'latent_image'], memory_format=torch.channels_last)
         output = OutputPipelineModule(names=output_names)
 
         modules = [image_sample]
 
+        if args.vae_channels_last:
+            modules.append(channels_last)
+
         if args.aspect_ratio_bucketing:
             modules.append(batch_sorting)
 
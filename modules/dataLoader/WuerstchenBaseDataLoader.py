@@ -1,4 +1,5 @@
 import json
+from functools import partial
 
 from mgds.DebugDataLoaderModules import SaveImage, SaveText, DecodeTokens
 from mgds.DiffusersDataLoaderModules import *
@@ -7,10 +8,14 @@ from mgds.MGDS import TrainDataLoader, OutputPipelineModule, MGDS
 from mgds.TransformersDataLoaderModules import *
 
 from modules.dataLoader.BaseDataLoader import BaseDataLoader
+from modules.dataLoader.cache.BoundedRamCache import BoundedRamCache
+from modules.dataLoader.cache.SharedDiskCache import SharedDiskCache
+from modules.dataLoader.cache.StreamingAspectBatchSorting import StreamingAspectBatchSorting
+from modules.dataLoader.augmentation.BatchedImageAugmentation import BatchedImageAugmentation
 from modules.dataLoader.wuerstchen.EncodeWuerstchenEffnet import EncodeWuerstchenEffnet
 from modules.dataLoader.wuerstchen.NormalizeImageChannels import NormalizeImageChannels
 from modules.model.WuerstchenModel import WuerstchenModel
-from modules.util import path_util
+from modules.util import path_util, cache_util
 from modules.util.TrainProgress import TrainProgress
 from modules.util.args.TrainArgs import TrainArgs
 from modules.util.enum.TrainingMethod import TrainingMethod
@@ -69,11 +74,17 @@ class WuerstchenBaseDataLoader(BaseDataLoader):
         text_cache_dir = os.path.join(args.cache_dir, "text", "epoch-" + str(cache_epoch))
 
         if args.latent_caching:
-            if not os.path.exists(image_cache_dir):
+            if cache_util.uses_shared_disk_cache(args):
+                if not SharedDiskCache.is_complete(cache_util.disk_cache_dir(args, "image"), cache_epoch):
+                    return True
+            elif not os.path.exists(image_cache_dir):
                 return True
 
         if not args.train_text_encoder and args.latent_caching and args.training_method != TrainingMethod.EMBEDDING:
-            if not os.path.exists(text_cache_dir):
+            if cache_util.uses_shared_disk_cache(args):
+                if not SharedDiskCache.is_complete(cache_util.disk_cache_dir(args, "text"), cache_epoch):
+                    return True
+            elif not os.path.exists(text_cache_dir):
                 return True
 
         return args.debug_mode
@@ -195,15 +206,29 @@ class WuerstchenBaseDataLoader(BaseDataLoader):
         random_contrast = RandomContrast(names=['image'], enabled_in_name='concept.enable_random_contrast', max_strength_in_name='concept.random_contrast_max_strength')
         random_saturation = RandomSaturation(names=['image'], enabled_in_name='concept.enable_random_saturation', max_strength_in_name='concept.random_saturation_max_strength')
         random_hue = RandomHue(names=['image'], enabled_in_name='concept.enable_random_hue', max_strength_in_name='concept.random_hue_max_strength')
+        batched_augmentation = BatchedImageAugmentation(
+            names=inputs, color_names=['image'], chunk_size=args.batched_augmentation_chunk_size,
+            flip_enabled_in_name='concept.enable_random_flip',
+            rotate_enabled_in_name='concept.enable_random_rotate', rotate_max_angle_in_name='concept.random_rotate_max_angle',
+            brightness_enabled_in_name='concept.enable_random_brightness', brightness_max_strength_in_name='concept.random_brightness_max_strength',
+            contrast_enabled_in_name='concept.enable_random_contrast', contrast_max_strength_in_name='concept.random_contrast_max_strength',
+            saturation_enabled_in_name='concept.enable_random_saturation', saturation_max_strength_in_name='concept.random_saturation_max_strength',
+            hue_enabled_in_name='concept.enable_random_hue', hue_max_strength_in_name='concept.random_hue_max_strength',
+        )
 
-        modules = [
-            random_flip,
-            random_rotate,
-            random_brightness,
-            random_contrast,
-            random_saturation,
-            random_hue,
-        ]
+        if args.batched_augmentation:
+            modules = [
+                batched_augmentation,
+            ]
+        else:
+            modules = [
+                random_flip,
+                random_rotate,
+                random_brightness,
+                random_contrast,
+                random_saturation,
+                random_hue,
+            ]
 
         return modules
 
@@ -247,21 +272,36 @@ class WuerstchenBaseDataLoader(BaseDataLoader):
             text_split_names.append('tokens')
             text_split_names.append('text_encoder_hidden_state')
 
-        image_cache_dir = os.path.join(args.cache_dir, "image")
-        text_cache_dir = os.path.join(args.cache_dir, "text")
+        image_cache_dir = cache_util.disk_cache_dir(args, "image")
+        text_cache_dir = cache_util.disk_cache_dir(args, "text")
 
-        image_disk_cache = DiskCache(cache_dir=image_cache_dir, split_names=image_split_names, aggregate_names=image_aggregate_names, cached_epochs=args.latent_caching_epochs)
+        if cache_util.uses_shared_disk_cache(args):
+            # in streaming mode, items are cached on their first access during training
+            disk_cache = partial(SharedDiskCache, fill_on_start=not args.streaming_caching_enabled())
+        else:
+            disk_cache = DiskCache
+
+        image_disk_cache = disk_cache(cache_dir=image_cache_dir, split_names=image_split_names, aggregate_names=image_aggregate_names, cached_epochs=args.latent_caching_epochs)
         image_ram_cache = RamCache(names=image_split_names + image_aggregate_names)
+        image_bounded_ram_cache = BoundedRamCache(
+            names=image_split_names + image_aggregate_names,
+            max_bytes=int(args.ram_cache_max_size * 1024 ** 3),
+            spill_dir=os.path.join(args.cache_dir, "ram-spill", "image") if args.ram_cache_spill else None,
+            metrics_prefix='image_ram_cache',
+        )
 
         modules = []
 
         if args.latent_caching:
             modules.append(image_disk_cache)
+        elif args.ram_cache_max_size > 0:
+            modules.append(image_bounded_ram_cache)
+            self._metric_modules.append(image_bounded_ram_cache)
         else:
             modules.append(image_ram_cache)
 
         if not args.train_text_encoder and args.latent_caching and args.training_method != TrainingMethod.EMBEDDING:
-            text_disk_cache = DiskCache(cache_dir=text_cache_dir, split_names=text_split_names, aggregate_names=[], cached_epochs=args.latent_caching_epochs)
+            text_disk_cache = disk_cache(cache_dir=text_cache_dir, split_names=text_split_names, aggregate_names=[], cached_epochs=args.latent_caching_epochs)
             modules.append(text_disk_cache)
 
         return modules
@@ -285,6 +325,7 @@ class WuerstchenBaseDataLoader(BaseDataLoader):
             replace_probability=args.unmasked_probability, vae=None, possible_resolutions_in_name='possible_resolutions'
         )
         batch_sorting = AspectBatchSorting(resolution_in_name='crop_resolution', names=output_names, batch_size=args.batch_size, sort_resolutions_for_each_epoch=True)
+        streaming_batch_sorting = StreamingAspectBatchSorting(resolution_in_name='crop_resolution', names=output_names, batch_size=args.batch_size, lookahead=args.streaming_caching_lookahead)
         output = OutputPipelineModule(names=output_names)
 
         modules = []
@@ -292,7 +333,10 @@ class WuerstchenBaseDataLoader(BaseDataLoader):
         if args.model_type.has_mask_input():
             modules.append(mask_remove)
 
-        if args.aspect_ratio_bucketing:
+        if args.streaming_caching_enabled():
+            modules.append(streaming_batch_sorting)
+            self._streaming_modules.append(streaming_batch_sorting)
+        elif args.aspect_ratio_bucketing:
             modules.append(batch_sorting)
 
         modules.append(output)
@@ -0,0 +1,235 @@
+import math
+
+import torch
+from mgds.MGDS import PipelineModule
+from torch import Tensor
+from torch.nn import functional
+
+
+class BatchedImageAugmentation(PipelineModule):
+    """
+    Applies the per-concept flip, rotate, brightness, contrast, saturation and hue augmentations on the device of the
+    pipeline. Instead of augmenting each sample on its own, items are loaded in aligned chunks of up to chunk_size
+    samples, grouped by their shape and augmented together. Chunks are only used while the items are requested in
+    order, items that are requested in a random order are augmented one by one. The random parameters of each item
+    only depend on its index and the current variation, so the result is the same for any chunk size.
+    """
+
+    def __init__(
+            self,
+            names: list[str],
+            color_names: list[str],
+            chunk_size: int,
+            flip_enabled_in_name: str | None,
+            rotate_enabled_in_name: str,
+            rotate_max_angle_in_name: str,
+            brightness_enabled_in_name: str,
+            brightness_max_strength_in_name: str,
+            contrast_enabled_in_name: str,
+            contrast_max_strength_in_name: str,
+            saturation_enabled_in_name: str,
+            saturation_max_strength_in_name: str,
+            hue_enabled_in_name: str,
+            hue_max_strength_in_name: str,
+    ):
+        super(BatchedImageAugmentation, self).__init__()
+        self.names = names
+        self.color_names = color_names
+        self.chunk_size = max(1, chunk_size)
+
+        self.flip_enabled_in_name = flip_enabled_in_name
+        self.rotate_enabled_in_name = rotate_enabled_in_name
+        self.rotate_max_angle_in_name = rotate_max_angle_in_name
+        self.brightness_enabled_in_name = brightness_enabled_in_name
+        self.brightness_max_strength_in_name = brightness_max_strength_in_name
+        self.contrast_enabled_in_name = contrast_enabled_in_name
+        self.contrast_max_strength_in_name = contrast_max_strength_in_name
+        self.saturation_enabled_in_name = saturation_enabled_in_name
+        self.saturation_max_strength_in_name = saturation_max_strength_in_name
+        self.hue_enabled_in_name = hue_enabled_in_name
+        self.hue_max_strength_in_name = hue_max_strength_in_name
+
+        self.__variation = 0
+        self.__last_index = -1
+        self.__buffer = {}
+
+    def length(self) -> int:
+        return self.get_previous_length(self.names[0])
+
+    def get_inputs(self) -> list[str]:
+        inputs = self.names + [
+            self.rotate_enabled_in_name, self.rotate_max_angle_in_name,
+            self.brightness_enabled_in_name, self.brightness_max_strength_in_name,
+            self.contrast_enabled_in_name, self.contrast_max_strength_in_name,
+            self.saturation_enabled_in_name, self.saturation_max_strength_in_name,
+            self.hue_enabled_in_name, self.hue_max_strength_in_name,
+        ]
+        if self.flip_enabled_in_name is not None:
+            inputs.append(self.flip_enabled_in_name)
+        return inputs
+
+    def get_outputs(self) -> list[str]:
+        return self.names
+
+    def start(self, variation: int):
+        self.__variation = variation
+        self.__last_index = -1
+        self.__buffer = {}
+
+    def __draw_parameters(self, index: int) -> dict:
+        rand = self._get_rand(index)
+
+        def strength(enabled_in_name: str, max_strength_in_name: str) -> float:
+            # always draw a value, so enabling one augmentation doesn't change the values drawn for the others
+            value = rand.uniform(-1.0, 1.0)
+            if self.get_previous_item(enabled_in_name, index):
+                return value * float(self.get_previous_item(max_strength_in_name, index))
+            return 0.0
+
+        flip = rand.random() < 0.5 \
+               and self.flip_enabled_in_name is not None \
+               and bool(self.get_previous_item(self.flip_enabled_in_name, index))
+        angle = strength(self.rotate_enabled_in_name, self.rotate_max_angle_in_name)
+        brightness = strength(self.brightness_enabled_in_name, self.brightness_max_strength_in_name)
+        contrast = strength(self.contrast_enabled_in_name, self.contrast_max_strength_in_name)
+        saturation = strength(self.saturation_enabled_in_name, self.saturation_max_strength_in_name)
+        hue = strength(self.hue_enabled_in_name, self.hue_max_strength_in_name)
+
+        return {
+            'flip': flip,
+            'angle': angle,
+            'brightness': 1.0 + brightness,
+            'contrast': 1.0 + contrast,
+            'saturation': 1.0 + saturation,
+            'hue': max(-0.5, min(0.5, hue)),
+        }
+
+    @staticmethod
+    def __blend(image: Tensor, other: Tensor, factor: Tensor) -> Tensor:
+        return (factor * image + (1.0 - factor) * other).clamp(0.0, 1.0)
+
+    @staticmethod
+    def __grayscale(image: Tensor) -> Tensor:
+        r, g, b = image.unbind(dim=1)
+        return (0.2989 * r + 0.587 * g + 0.114 * b).unsqueeze(1)
+
+    @staticmethod
+    def __shift_hue(image: Tensor, hue: Tensor) -> Tensor:
+        r, g, b = image.unbind(dim=1)
+
+        max_c = image.amax(dim=1)
+        min_c = image.amin(dim=1)
+        delta = max_c - min_c
+        safe_delta = torch.where(delta == 0, torch.ones_like(delta), delta)
+
+        h = torch.where(
+            max_c == r, (g - b) / safe_delta,
+            torch.where(max_c == g, (b - r) / safe_delta + 2.0, (r - g) / safe_delta + 4.0)
+        )
+        h = torch.where(delta == 0, torch.zeros_like(h), h)
+        h = ((h / 6.0) + hue.view(-1, 1, 1)) % 1.0
+
+        s = torch.where(max_c == 0, torch.zeros_like(delta), delta / torch.where(max_c == 0, torch.ones_like(max_c), max_c))
+        v = max_c
+
+        # hsv to rgb, see https://en.wikipedia.org/wiki/HSL_and_HSV#HSV_to_RGB_alternative
+        def channel(n: float) -> Tensor:
+            k = (n + h * 6.0) % 6.0
+            return v - v * s * torch.clamp(torch.minimum(k, 4.0 - k), 0.0, 1.0)
+
+        return torch.stack([channel(5.0), channel(3.0), channel(1.0)], dim=1)
+
+    @staticmethod
+    def __rotate(image: Tensor, angles: Tensor) -> Tensor:
+        radians = angles * (math.pi / 180.0)
+        cos = torch.cos(radians)
+        sin = torch.sin(radians)
+        zeros = torch.zeros_like(cos)
+
+        height, width = image.shape[-2:]
+        aspect = height / width
+
+        # rotation around the image center, corrected for non-square images in normalized coordinates
+        theta = torch.stack([
+            torch.stack([cos, -sin * aspect, zeros], dim=1),
+            torch.stack([sin / aspect, cos, zeros], dim=1),
+        ], dim=1)
+
+        grid = functional.affine_grid(theta, list(image.shape), align_corners=False)
+        return functional.grid_sample(image, grid, mode='bilinear', padding_mode='zeros', align_corners=False)
+
+    def __augment_group(self, tensors: dict[str, Tensor], parameters: list[dict]) -> dict[str, Tensor]:
+        device = next(iter(tensors.values())).device
+
+        flip = torch.tensor([p['flip'] for p in parameters], device=device).view(-1, 1, 1, 1)
+        angle = torch.tensor([p['angle'] for p in parameters], device=device, dtype=torch.float32)
+
+        for name in self.names:
+            if flip.any():
+                tensors[name] = torch.where(flip, tensors[name].flip(-1), tensors[name])
+            if angle.any():
+                tensors[name] = self.__rotate(tensors[name], angle.to(dtype=tensors[name].dtype))
+
+        for name in self.color_names:
+            image = tensors[name]
+            dtype = image.dtype
+
+            def factor(key: str) -> Tensor:
+                return torch.tensor([p[key] for p in parameters], device=device, dtype=dtype).view(-1, 1, 1, 1)
+
+            brightness = factor('brightness')
+            if (brightness != 1.0).any():
+                image = (image * brightness).clamp(0.0, 1.0)
+
+            contrast = factor('contrast')
+            if (contrast != 1.0).any():
+                mean = self.__grayscale(image).mean(dim=(-3, -2, -1), keepdim=True)
+                image = self.__blend(image, mean, contrast)
+
+            saturation = factor('saturation')
+            if (saturation != 1.0).any():
+                image = self.__blend(image, self.__grayscale(image), saturation)
+
+            hue = factor('hue').view(-1)
+            if (hue != 0.0).any():
+                image = self.__shift_hue(image, hue)
+
+            tensors[name] = image
+
+        return tensors
+
+    def __fill_buffer(self, indices: list[int]):
+        self.__buffer = {}
+
+        groups = {}
+        for index in indices:
+            items = {name: self.get_previous_item(name, index) for name in self.names}
+            shape = tuple(tuple(item.shape) for item in items.values())
+            groups.setdefault(shape, []).append((index, items))
+
+        with torch.no_grad():
+            for group in groups.values():
+                group_indices = [index for (index, _) in group]
+                parameters = [self.__draw_parameters(index) for index in group_indices]
+
+                tensors = {
+                    name: torch.stack([items[name] for (_, items) in group]).to(device=self.pipeline.device)
+                    for name in self.names
+                }
+                tensors = self.__augment_group(tensors, parameters)
+
+                for i, index in enumerate(group_indices):
+                    self.__buffer[(self.__variation, index)] = {name: tensors[name][i] for name in self.names}
+
+    def get_item(self, index: int, requested_name: str = None) -> dict:
+        key = (self.__variation, index)
+        if key not in self.__buffer:
+            if index == self.__last_index + 1 or index % self.chunk_size == 0:
+                start_index = index // self.chunk_size * self.chunk_size
+                self.__fill_buffer(list(range(start_index, min(start_index + self.chunk_size, self.length()))))
+            else:
+                # a chunk would mostly contain items that are not requested next
+                self.__fill_buffer([index])
+        self.__last_index = index
+
+        return dict(self.__buffer[key])
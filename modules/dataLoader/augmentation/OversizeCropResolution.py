@@ -0,0 +1,54 @@
+from mgds.MGDS import PipelineModule
+
+
+class OversizeCropResolution(PipelineModule):
+    """
+    Calculates a crop resolution that is up to margin pixels bigger than the target crop resolution, without exceeding
+    the scale resolution. Caching this bigger crop leaves room to apply crop jitter later in latent space.
+    """
+
+    def __init__(
+            self,
+            scale_resolution_in_name: str,
+            crop_resolution_in_name: str,
+            enable_crop_jitter_in_name: str,
+            crop_resolution_out_name: str,
+            margin: int,
+            quantization: int = 8,
+    ):
+        super(OversizeCropResolution, self).__init__()
+        self.scale_resolution_in_name = scale_resolution_in_name
+        self.crop_resolution_in_name = crop_resolution_in_name
+        self.enable_crop_jitter_in_name = enable_crop_jitter_in_name
+        self.crop_resolution_out_name = crop_resolution_out_name
+        self.margin = margin
+        self.quantization = quantization
+
+    def length(self) -> int:
+        return self.get_previous_length(self.crop_resolution_in_name)
+
+    def get_inputs(self) -> list[str]:
+        return [self.scale_resolution_in_name, self.crop_resolution_in_name, self.enable_crop_jitter_in_name]
+
+    def get_outputs(self) -> list[str]:
+        return [self.crop_resolution_out_name]
+
+    def get_item(self, index: int, requested_name: str = None) -> dict:
+        scale_resolution = self.get_previous_item(self.scale_resolution_in_name, index)
+        crop_resolution = self.get_previous_item(self.crop_resolution_in_name, index)
+        enable_crop_jitter = self.get_previous_item(self.enable_crop_jitter_in_name, index)
+
+        if not enable_crop_jitter:
+            return {
+                self.crop_resolution_out_name: crop_resolution,
+            }
+
+        oversized_resolution = []
+        for scale, crop in zip(scale_resolution, crop_resolution):
+            size = min(int(scale), int(crop) + self.margin)
+            size = max(int(crop), size - (size % self.quantization))
+            oversized_resolution.append(size)
+
+        return {
+            self.crop_resolution_out_name: tuple(oversized_resolution),
+        }
@@ -0,0 +1,86 @@
+import torch
+from mgds.MGDS import PipelineModule
+
+
+class RandomLatentFlipCrop(PipelineModule):
+    """
+    Applies a random horizontal flip and a random crop to latents that were cached at an oversized resolution. All
+    names receive the same flip and crop, so masks, depth and conditioning images stay aligned with the image.
+    """
+
+    def __init__(
+            self,
+            names: list[str],
+            crop_resolution_in_name: str,
+            enable_flip_in_name: str,
+            enable_crop_jitter_in_name: str,
+            crop_offset_name: str | None = None,
+            downscale_factor: int = 8,
+    ):
+        super(RandomLatentFlipCrop, self).__init__()
+        self.names = names
+        self.crop_resolution_in_name = crop_resolution_in_name
+        self.enable_flip_in_name = enable_flip_in_name
+        self.enable_crop_jitter_in_name = enable_crop_jitter_in_name
+        self.crop_offset_name = crop_offset_name
+        self.downscale_factor = downscale_factor
+
+    def length(self) -> int:
+        return self.get_previous_length(self.names[0])
+
+    def get_inputs(self) -> list[str]:
+        inputs = self.names + [self.crop_resolution_in_name, self.enable_flip_in_name, self.enable_crop_jitter_in_name]
+        if self.crop_offset_name is not None:
+            inputs.append(self.crop_offset_name)
+        return inputs
+
+    def get_outputs(self) -> list[str]:
+        outputs = list(self.names)
+        if self.crop_offset_name is not None:
+            outputs.append(self.crop_offset_name)
+        return outputs
+
+    def get_item(self, index: int, requested_name: str = None) -> dict:
+        rand = self._get_rand(index)
+
+        crop_resolution = self.get_previous_item(self.crop_resolution_in_name, index)
+        enable_flip = self.get_previous_item(self.enable_flip_in_name, index)
+        enable_crop_jitter = self.get_previous_item(self.enable_crop_jitter_in_name, index)
+
+        target_height = int(crop_resolution[0]) // self.downscale_factor
+        target_width = int(crop_resolution[1]) // self.downscale_factor
+
+        flip = enable_flip and rand.random() < 0.5
+
+        # all names share the spatial size of the first one
+        latent_height, latent_width = self.get_previous_item(self.names[0], index).shape[-2:]
+        max_top = max(0, latent_height - target_height)
+        max_left = max(0, latent_width - target_width)
+        if enable_crop_jitter:
+            top = rand.randint(0, max_top)
+            left = rand.randint(0, max_left)
+        else:
+            top = max_top // 2
+            left = max_left // 2
+
+        item = {}
+
+        for name in self.names:
+            latent = self.get_previous_item(name, index)
+            if latent is None:
+                item[name] = None
+                continue
+
+            latent = latent[..., top:top + target_height, left:left + target_width]
+            if flip:
+                latent = torch.flip(latent, dims=[-1])
+            item[name] = latent
+
+        if self.crop_offset_name is not None:
+            crop_offset = self.get_previous_item(self.crop_offset_name, index)
+            item[self.crop_offset_name] = [
+                crop_offset[0] + top * self.downscale_factor,
+                crop_offset[1] + left * self.downscale_factor,
+            ]
+
+        return item
@@ -0,0 +1,45 @@
+from mgds.MGDS import PipelineModule
+
+
+class SelectTextVariant(PipelineModule):
+    """
+    Selects one random variant of a text, together with the matching entries of all variant tensors (tokens, hidden
+    states, ...). The variant is selected again in each epoch.
+    """
+
+    def __init__(
+            self,
+            texts_in_name: str,
+            text_out_name: str,
+            in_names: list[str],
+            out_names: list[str],
+    ):
+        super(SelectTextVariant, self).__init__()
+        self.texts_in_name = texts_in_name
+        self.text_out_name = text_out_name
+        self.in_names = in_names
+        self.out_names = out_names
+
+    def length(self) -> int:
+        return self.get_previous_length(self.texts_in_name)
+
+    def get_inputs(self) -> list[str]:
+        return [self.texts_in_name] + self.in_names
+
+    def get_outputs(self) -> list[str]:
+        return [self.text_out_name] + self.out_names
+
+    def get_item(self, index: int, requested_name: str = None) -> dict:
+        rand = self._get_rand(index)
+
+        texts = self.get_previous_item(self.texts_in_name, index)
+        variant = rand.randrange(len(texts))
+
+        item = {
+            self.text_out_name: texts[variant],
+        }
+
+        for in_name, out_name in zip(self.in_names, self.out_names):
+            item[out_name] = self.get_previous_item(in_name, index)[variant]
+
+        return item
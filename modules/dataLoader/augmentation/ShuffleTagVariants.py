@@ -0,0 +1,64 @@
+from mgds.MGDS import PipelineModule
+
+
+class ShuffleTagVariants(PipelineModule):
+    """
+    Creates a fixed pool of variants of a tag based text, each with a different tag order. The first variant keeps
+    the original order, and the first keep_tags_count tags are never moved. The variants are drawn from the random
+    generator of the pipeline, the text cache encodes them once and selects one of the cached variants in each epoch.
+    """
+
+    def __init__(
+            self,
+            text_in_name: str,
+            enabled_in_name: str,
+            delimiter_in_name: str,
+            keep_tags_count_in_name: str,
+            texts_out_name: str,
+            variant_count: int,
+    ):
+        super(ShuffleTagVariants, self).__init__()
+        self.text_in_name = text_in_name
+        self.enabled_in_name = enabled_in_name
+        self.delimiter_in_name = delimiter_in_name
+        self.keep_tags_count_in_name = keep_tags_count_in_name
+        self.texts_out_name = texts_out_name
+        self.variant_count = max(1, variant_count)
+
+    def length(self) -> int:
+        return self.get_previous_length(self.text_in_name)
+
+    def get_inputs(self) -> list[str]:
+        return [self.text_in_name, self.enabled_in_name, self.delimiter_in_name, self.keep_tags_count_in_name]
+
+    def get_outputs(self) -> list[str]:
+        return [self.texts_out_name]
+
+    def get_item(self, index: int, requested_name: str = None) -> dict:
+        text = self.get_previous_item(self.text_in_name, index)
+        enabled = self.get_previous_item(self.enabled_in_name, index)
+
+        if not enabled:
+            return {
+                self.texts_out_name: [text],
+            }
+
+        delimiter = self.get_previous_item(self.delimiter_in_name, index)
+        keep_tags_count = int(self.get_previous_item(self.keep_tags_count_in_name, index))
+
+        tags = [tag.strip() for tag in text.split(delimiter)]
+        keep_tags = tags[:keep_tags_count]
+        shuffle_tags = tags[keep_tags_count:]
+        join_delimiter = delimiter if delimiter.endswith(' ') else delimiter + ' '
+
+        rand = self._get_rand(index)
+
+        texts = [text]
+        for _ in range(self.variant_count - 1):
+            shuffled_tags = list(shuffle_tags)
+            rand.shuffle(shuffled_tags)
+            texts.append(join_delimiter.join(keep_tags + shuffled_tags))
+
+        return {
+            self.texts_out_name: texts,
+        }
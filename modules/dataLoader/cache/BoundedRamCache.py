@@ -0,0 +1,137 @@
+import os
+import shutil
+from collections import OrderedDict
+
+import torch
+from mgds.MGDS import PipelineModule
+from torch import Tensor
+from tqdm import tqdm
+
+
+class BoundedRamCache(PipelineModule):
+    """
+    Caches items in RAM, like RamCache, but never holds more than max_bytes of tensor data. When the budget is
+    exceeded, the least recently used items are evicted. If a spill_dir is set, evicted items are written to that
+    directory and read back on the next access, instead of being recalculated by the previous modules.
+
+    Args:
+        names: the names of the items to cache
+        max_bytes: the maximum number of tensor bytes held in RAM, 0 disables the limit
+        spill_dir: an optional scratch directory for evicted items
+        metrics_prefix: the prefix of the names returned by get_metrics()
+    """
+
+    def __init__(
+            self,
+            names: list[str],
+            max_bytes: int,
+            spill_dir: str | None = None,
+            metrics_prefix: str = 'ram_cache',
+    ):
+        super(BoundedRamCache, self).__init__()
+        self.names = names
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.metrics_prefix = metrics_prefix
+
+        self.__cache = OrderedDict()
+        self.__item_bytes = {}
+        self.__spilled = set()
+        self.__cached_bytes = 0
+        self.__is_cached = False
+
+        self.hits = 0
+        self.spill_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def length(self) -> int:
+        return self.get_previous_length(self.names[0])
+
+    def get_inputs(self) -> list[str]:
+        return self.names
+
+    def get_outputs(self) -> list[str]:
+        return self.names
+
+    def start(self, variation: int):
+        if self.__is_cached:
+            return
+
+        if self.spill_dir is not None:
+            # spilled items are only valid for this run
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+        for index in tqdm(range(self.length()), desc='caching'):
+            self.__insert(index, self.__load_previous(index))
+
+        self.__is_cached = True
+
+    def get_metrics(self) -> dict[str, float]:
+        return {
+            f"{self.metrics_prefix}/hits": self.hits,
+            f"{self.metrics_prefix}/spill_hits": self.spill_hits,
+            f"{self.metrics_prefix}/misses": self.misses,
+            f"{self.metrics_prefix}/evictions": self.evictions,
+            f"{self.metrics_prefix}/cached_bytes": self.__cached_bytes,
+        }
+
+    @staticmethod
+    def __count_bytes(value, seen: set) -> int:
+        if isinstance(value, Tensor):
+            storage = value.untyped_storage()
+            if storage.data_ptr() in seen:
+                return 0
+            seen.add(storage.data_ptr())
+            return storage.nbytes()
+        if isinstance(value, (list, tuple)):
+            return sum(BoundedRamCache.__count_bytes(x, seen) for x in value)
+        if isinstance(value, dict):
+            return sum(BoundedRamCache.__count_bytes(x, seen) for x in value.values())
+        if hasattr(value, '__dict__'):
+            # e.g. the latent distribution returned by a vae
+            return sum(BoundedRamCache.__count_bytes(x, seen) for x in vars(value).values())
+        return 0
+
+    def __spill_path(self, index: int) -> str:
+        return os.path.join(self.spill_dir, f"{index}.pt")
+
+    def __load_previous(self, index: int) -> dict:
+        return {name: self.get_previous_item(name, index) for name in self.names}
+
+    def __insert(self, index: int, item: dict):
+        item_bytes = self.__count_bytes(item, set())
+
+        self.__cache[index] = item
+        self.__item_bytes[index] = item_bytes
+        self.__cached_bytes += item_bytes
+
+        while self.max_bytes > 0 and self.__cached_bytes > self.max_bytes and len(self.__cache) > 1:
+            self.__evict()
+
+    def __evict(self):
+        index, item = self.__cache.popitem(last=False)
+        self.__cached_bytes -= self.__item_bytes.pop(index)
+        self.evictions += 1
+
+        # cached items never change, so each item only needs to be written once
+        if self.spill_dir is not None and index not in self.__spilled:
+            torch.save(item, self.__spill_path(index))
+            self.__spilled.add(index)
+
+    def get_item(self, index: int, requested_name: str = None) -> dict:
+        if index in self.__cache:
+            self.hits += 1
+            self.__cache.move_to_end(index)
+            return self.__cache[index]
+
+        if index in self.__spilled:
+            self.spill_hits += 1
+            item = torch.load(self.__spill_path(index))
+        else:
+            self.misses += 1
+            item = self.__load_previous(index)
+
+        self.__insert(index, item)
+        return item
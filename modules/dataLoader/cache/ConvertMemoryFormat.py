@@ -0,0 +1,36 @@
+import torch
+from mgds.MGDS import PipelineModule
+
+from modules.util.memory_format_util import to_memory_format
+
+
+class ConvertMemoryFormat(PipelineModule):
+    """
+    Converts image and latent tensors to a memory format, for example the cached latents to channels last. Batches
+    that are stacked from the converted tensors have the same memory format, so they don't need to be converted again
+    on the train device.
+    """
+
+    def __init__(
+            self,
+            names: list[str],
+            memory_format: torch.memory_format,
+    ):
+        super(ConvertMemoryFormat, self).__init__()
+        self.names = names
+        self.memory_format = memory_format
+
+    def length(self) -> int:
+        return self.get_previous_length(self.names[0])
+
+    def get_inputs(self) -> list[str]:
+        return self.names
+
+    def get_outputs(self) -> list[str]:
+        return self.names
+
+    def get_item(self, index: int, requested_name: str = None) -> dict:
+        return {
+            name: to_memory_format(self.get_previous_item(name, index), self.memory_format)
+            for name in self.names
+        }
@@ -0,0 +1,177 @@
+import os
+import threading
+import time
+
+import torch
+from mgds.MGDS import PipelineModule
+from tqdm import tqdm
+
+
+class SharedDiskCache(PipelineModule):
+    """
+    A disk cache that can be filled and read by several training runs at the same time. Each item is written to a
+    temporary file and atomically renamed, so readers never see partially written items. Before calculating an item,
+    a run creates a lock file for it. Items locked by other runs are skipped and picked up after they are written. The
+    aggregate values of an item are written to a separate small file, so the aggregate file of an epoch can be
+    created without reading the split items again. An epoch is complete once its aggregate file exists.
+
+    If fill_on_start is False, items are not calculated when an epoch starts, but on their first access. This is used
+    to overlap caching with training.
+
+    Args:
+        cache_dir: the directory of the cache, it should include a key of all settings that change the cached data
+        split_names: the names of the items that are stored in one file per item
+        aggregate_names: the names of the items that are stored in a single file for all items
+        cached_epochs: the number of epochs with different data that are cached
+        lock_timeout: the number of seconds after which a lock of another run is considered stale
+        fill_on_start: calculate all missing items when an epoch starts, instead of on their first access
+    """
+
+    def __init__(
+            self,
+            cache_dir: str,
+            split_names: list[str],
+            aggregate_names: list[str],
+            cached_epochs: int = 1,
+            lock_timeout: float = 600.0,
+            fill_on_start: bool = True,
+    ):
+        super(SharedDiskCache, self).__init__()
+        self.cache_dir = cache_dir
+        self.split_names = split_names
+        self.aggregate_names = aggregate_names
+        self.cached_epochs = max(1, cached_epochs)
+        self.lock_timeout = lock_timeout
+        self.fill_on_start = fill_on_start
+
+        self.__epoch_dir = None
+        self.__aggregate = None
+
+    @staticmethod
+    def is_complete(cache_dir: str, cache_epoch: int) -> bool:
+        return os.path.exists(os.path.join(cache_dir, "epoch-" + str(cache_epoch), "aggregate.pt"))
+
+    def length(self) -> int:
+        return self.get_previous_length(self.split_names[0])
+
+    def get_inputs(self) -> list[str]:
+        return self.split_names + self.aggregate_names
+
+    def get_outputs(self) -> list[str]:
+        return self.split_names + self.aggregate_names
+
+    def __item_path(self, index: int) -> str:
+        return os.path.join(self.__epoch_dir, f"{index}.pt")
+
+    def __item_aggregate_path(self, index: int) -> str:
+        return os.path.join(self.__epoch_dir, f"{index}.aggregate.pt")
+
+    def __is_cached(self, index: int) -> bool:
+        # the item file is written last. Items of older caches without an aggregate file are calculated again
+        return os.path.exists(self.__item_path(index)) and os.path.exists(self.__item_aggregate_path(index))
+
+    def __lock_path(self, index: int) -> str:
+        return os.path.join(self.__epoch_dir, f"{index}.lock")
+
+    @staticmethod
+    def __atomic_save(data, path: str):
+        temp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        torch.save(data, temp_path)
+        os.replace(temp_path, path)
+
+    def __try_lock(self, index: int) -> bool:
+        lock_path = self.__lock_path(index)
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.write(fd, str(os.getpid()).encode('ascii'))
+            os.close(fd)
+            return True
+        except FileExistsError:
+            pass
+
+        try:
+            if time.time() - os.path.getmtime(lock_path) > self.lock_timeout:
+                # the run holding this lock was probably stopped
+                os.remove(lock_path)
+        except OSError:
+            pass
+
+        return False
+
+    def __unlock(self, index: int):
+        try:
+            os.remove(self.__lock_path(index))
+        except OSError:
+            pass
+
+    def __try_cache_item(self, index: int) -> bool:
+        # returns False if the item is currently calculated by another run
+        if self.__is_cached(index):
+            return True
+
+        if not self.__try_lock(index):
+            return False
+
+        try:
+            if not self.__is_cached(index):
+                aggregate_item = {name: self.get_previous_item(name, index) for name in self.aggregate_names}
+                self.__atomic_save(aggregate_item, self.__item_aggregate_path(index))
+                item = {name: self.get_previous_item(name, index) for name in self.split_names}
+                self.__atomic_save(item, self.__item_path(index))
+        finally:
+            self.__unlock(index)
+
+        return True
+
+    def __fill(self):
+        pending = [index for index in range(self.length()) if not self.__is_cached(index)]
+
+        while pending:
+            locked = [index for index in tqdm(pending, desc='caching') if not self.__try_cache_item(index)]
+
+            pending = [index for index in locked if not self.__is_cached(index)]
+            if pending:
+                time.sleep(1.0)
+
+    def __save_aggregate(self, aggregate_path: str):
+        aggregate = {name: [] for name in self.aggregate_names}
+        for index in range(self.length()):
+            # only the small aggregate file of each item is read, the aggregate is moved to the device after loading
+            item = torch.load(self.__item_aggregate_path(index), map_location='cpu')
+            for name in self.aggregate_names:
+                aggregate[name].append(item[name])
+
+        # other runs may write the same aggregate, the atomic rename makes this safe
+        self.__atomic_save(aggregate, aggregate_path)
+
+    def start(self, variation: int):
+        cache_epoch = variation % self.cached_epochs
+        self.__epoch_dir = os.path.join(self.cache_dir, "epoch-" + str(cache_epoch))
+        aggregate_path = os.path.join(self.__epoch_dir, "aggregate.pt")
+
+        self.__aggregate = None
+
+        if not os.path.exists(aggregate_path):
+            os.makedirs(self.__epoch_dir, exist_ok=True)
+
+            if self.fill_on_start:
+                self.__fill()
+            elif any(not self.__is_cached(index) for index in range(self.length())):
+                return
+
+            self.__save_aggregate(aggregate_path)
+
+        self.__aggregate = torch.load(aggregate_path, map_location=self.pipeline.device)
+
+    def get_item(self, index: int, requested_name: str = None) -> dict:
+        if requested_name in self.aggregate_names:
+            if self.__aggregate is None:
+                # the aggregate is written once all items are cached, until then it is calculated on demand
+                return {name: self.get_previous_item(name, index) for name in self.aggregate_names}
+            return {name: self.__aggregate[name][index] for name in self.aggregate_names}
+
+        while not self.__try_cache_item(index):
+            time.sleep(0.1)
+
+        item = torch.load(self.__item_path(index), map_location=self.pipeline.device)
+        return {name: item[name] for name in self.split_names}
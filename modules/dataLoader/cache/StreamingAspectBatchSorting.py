@@ -0,0 +1,151 @@
+import random
+import threading
+
+from mgds.MGDS import PipelineModule
+
+
+class StreamingAspectBatchSorting(PipelineModule):
+    """
+    Groups items of the same resolution into batches, like AspectBatchSorting, while a producer thread loads the
+    items. The producer walks through the epoch in a random order and is at most lookahead items ahead of the
+    consumer. A batch is handed out as soon as its resolution bucket has enough loaded items. If the previous modules
+    calculate their data on the first access, caching is overlapped with training.
+
+    The order of the batches depends on the order in which the buckets fill up, it is not the exact order of
+    AspectBatchSorting.
+
+    Args:
+        resolution_in_name: the name of the resolution used for bucketing
+        names: the names of the items to load
+        batch_size: the batch size
+        lookahead: the maximum number of loaded items that are not yet consumed
+    """
+
+    def __init__(
+            self,
+            resolution_in_name: str,
+            names: list[str],
+            batch_size: int,
+            lookahead: int,
+    ):
+        super(StreamingAspectBatchSorting, self).__init__()
+        self.resolution_in_name = resolution_in_name
+        self.names = names
+        self.batch_size = batch_size
+        self.lookahead = lookahead
+
+        self.__condition = threading.Condition()
+        self.__pause_lock = threading.Lock()
+        self.__thread = None
+        self.__stop = False
+        self.__error = None
+
+        self.__length = None
+        self.__ready = []
+        self.__produced = 0
+        self.__released = 0
+
+    def length(self) -> int:
+        if self.__length is None:
+            return self.get_previous_length(self.resolution_in_name)
+        return self.__length
+
+    def get_inputs(self) -> list[str]:
+        return [self.resolution_in_name] + self.names
+
+    def get_outputs(self) -> list[str]:
+        return self.names
+
+    def pause(self):
+        # blocks until the item that is currently loaded is done
+        self.__pause_lock.acquire()
+
+    def resume(self):
+        self.__pause_lock.release()
+
+    def __stop_producer(self):
+        if self.__thread is not None:
+            with self.__condition:
+                self.__stop = True
+                self.__condition.notify_all()
+            self.__thread.join()
+            self.__thread = None
+
+    def start(self, variation: int):
+        self.__stop_producer()
+
+        rand = random.Random(variation)
+
+        buckets = {}
+        for index in range(self.get_previous_length(self.resolution_in_name)):
+            resolution = tuple(self.get_previous_item(self.resolution_in_name, index))
+            buckets.setdefault(resolution, []).append(index)
+
+        # incomplete batches are dropped
+        order = []
+        for indices in buckets.values():
+            rand.shuffle(indices)
+            order.extend(indices[:len(indices) - len(indices) % self.batch_size])
+        rand.shuffle(order)
+
+        # in the worst case, every bucket holds one item less than a full batch, while the consumer still holds the
+        # previous batch and the requested item and the rest of its batch are not released
+        lookahead = max(self.lookahead, len(buckets) * (self.batch_size - 1) + 2 * self.batch_size + 1)
+
+        self.__length = len(order)
+        self.__ready = []
+        self.__produced = 0
+        self.__released = 0
+        self.__stop = False
+        self.__error = None
+
+        self.__thread = threading.Thread(target=self.__produce, args=(order, lookahead), daemon=True)
+        self.__thread.start()
+
+    def __produce(self, order: list[int], lookahead: int):
+        pending = {}
+
+        try:
+            for index in order:
+                with self.__condition:
+                    while not self.__stop and self.__produced - self.__released >= lookahead:
+                        self.__condition.wait()
+                    if self.__stop:
+                        return
+
+                with self.__pause_lock:
+                    resolution = tuple(self.get_previous_item(self.resolution_in_name, index))
+                    item = {name: self.get_previous_item(name, index) for name in self.names}
+
+                bucket = pending.setdefault(resolution, [])
+                bucket.append(item)
+
+                with self.__condition:
+                    self.__produced += 1
+                    if len(bucket) == self.batch_size:
+                        self.__ready.extend(bucket)
+                        bucket.clear()
+                        self.__condition.notify_all()
+        except Exception as e:
+            with self.__condition:
+                self.__error = e
+                self.__condition.notify_all()
+
+    def get_item(self, index: int, requested_name: str = None) -> dict:
+        if index >= self.length():
+            raise IndexError(index)
+
+        with self.__condition:
+            while len(self.__ready) <= index and self.__error is None:
+                self.__condition.wait()
+
+            if self.__error is not None:
+                raise self.__error
+
+            # items of previous batches are no longer requested
+            while self.__released < index - self.batch_size:
+                self.__ready[self.__released] = None
+                self.__released += 1
+                self.__condition.notify_all()
+
+            return self.__ready[index]
@@ -6,6 +6,7 @@ from mgds.MGDS import MGDS
 from modules.util.TrainProgress import TrainProgress
 from modules.util.args.TrainArgs import TrainArgs
 from modules.util.dtype_util import allow_mixed_precision
+from modules.util.enum.TrainingMethod import TrainingMethod
 
 
 class DataLoaderMgdsMixin(metaclass=ABCMeta):
@@ -17,9 +18,20 @@ class DataLoaderMgdsMixin(metaclass=ABCMeta):
             definition: list,
             train_progress: TrainProgress,
     ):
+        latent_augmentation = args.latent_augmentation
+        if latent_augmentation and (
+                args.model_type.is_wuerstchen() or args.training_method == TrainingMethod.FINE_TUNE_VAE
+        ):
+            print(
+                "Latent augmentation is not supported for Wuerstchen models or VAE fine-tuning, it is turned off"
+                f" for this {args.model_type} {args.training_method} run"
+            )
+            latent_augmentation = False
+
         settings = {
             "enable_random_circular_mask_shrink": args.circular_mask_generation,
             "enable_random_mask_rotate_crop": args.random_rotate_and_crop,
+            "enable_image_crop_jitter": not latent_augmentation,
         }
 
         ds = MGDS(
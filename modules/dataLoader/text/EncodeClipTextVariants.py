@@ -0,0 +1,62 @@
+import torch
+from mgds.MGDS import PipelineModule
+from transformers import CLIPTextModel, CLIPTextModelWithProjection
+
+
+class EncodeClipTextVariants(PipelineModule):
+    """
+    Encodes the tokens of all variants of a text in a single batched text encoder call. The outputs have one entry
+    per variant.
+    """
+
+    def __init__(
+            self,
+            tokens_in_name: str,
+            hidden_state_out_name: str,
+            pooled_out_name: str | None,
+            add_layer_norm: bool,
+            text_encoder: CLIPTextModel | CLIPTextModelWithProjection,
+            hidden_state_output_index: int,
+    ):
+        super(EncodeClipTextVariants, self).__init__()
+        self.tokens_in_name = tokens_in_name
+        self.hidden_state_out_name = hidden_state_out_name
+        self.pooled_out_name = pooled_out_name
+        self.add_layer_norm = add_layer_norm
+        self.text_encoder = text_encoder
+        self.hidden_state_output_index = hidden_state_output_index
+
+    def length(self) -> int:
+        return self.get_previous_length(self.tokens_in_name)
+
+    def get_inputs(self) -> list[str]:
+        return [self.tokens_in_name]
+
+    def get_outputs(self) -> list[str]:
+        if self.pooled_out_name is None:
+            return [self.hidden_state_out_name]
+        return [self.hidden_state_out_name, self.pooled_out_name]
+
+    def get_item(self, index: int, requested_name: str = None) -> dict:
+        tokens = self.get_previous_item(self.tokens_in_name, index)
+        tokens = tokens.to(device=self.text_encoder.device)
+
+        with torch.no_grad(), torch.autocast(
+                device_type=self.pipeline.device.type,
+                dtype=self.pipeline.dtype,
+                enabled=self.pipeline.allow_mixed_precision,
+        ):
+            text_encoder_output = self.text_encoder(tokens, output_hidden_states=True, return_dict=True)
+
+            hidden_state = text_encoder_output.hidden_states[self.hidden_state_output_index]
+            if self.add_layer_norm:
+                hidden_state = self.text_encoder.text_model.final_layer_norm(hidden_state)
+
+        item = {
+            self.hidden_state_out_name: hidden_state,
+        }
+
+        if self.pooled_out_name is not None:
+            item[self.pooled_out_name] = text_encoder_output.text_embeds
+
+        return item
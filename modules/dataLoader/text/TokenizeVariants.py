@@ -0,0 +1,45 @@
+from mgds.MGDS import PipelineModule
+from transformers import PreTrainedTokenizer
+
+
+class TokenizeVariants(PipelineModule):
+    """
+    Tokenizes all variants of a text in one call. The output has one row per variant.
+    """
+
+    def __init__(
+            self,
+            texts_in_name: str,
+            tokens_out_name: str,
+            tokenizer: PreTrainedTokenizer,
+            max_token_length: int,
+    ):
+        super(TokenizeVariants, self).__init__()
+        self.texts_in_name = texts_in_name
+        self.tokens_out_name = tokens_out_name
+        self.tokenizer = tokenizer
+        self.max_token_length = max_token_length
+
+    def length(self) -> int:
+        return self.get_previous_length(self.texts_in_name)
+
+    def get_inputs(self) -> list[str]:
+        return [self.texts_in_name]
+
+    def get_outputs(self) -> list[str]:
+        return [self.tokens_out_name]
+
+    def get_item(self, index: int, requested_name: str = None) -> dict:
+        texts = self.get_previous_item(self.texts_in_name, index)
+
+        tokenizer_output = self.tokenizer(
+            texts,
+            padding='max_length',
+            truncation=True,
+            max_length=self.max_token_length,
+            return_tensors="pt",
+        )
+
+        return {
+            self.tokens_out_name: tokenizer_output.input_ids.to(self.pipeline.device),
+        }
@@ -4,6 +4,7 @@ import torch
 from mgds.MGDS import PipelineModule
 
 from modules.model.WuerstchenModel import WuerstchenEfficientNetEncoder
+from modules.util.memory_format_util import module_memory_format, to_memory_format
 
 
 class EncodeWuerstchenEffnet(PipelineModule):
@@ -38,6 +39,7 @@ class EncodeWuerstchenEffnet(PipelineModule):
             else self.override_allow_mixed_precision
 
         image = image if allow_mixed_precision else image.to(self.effnet_encoder.dtype)
+        image = to_memory_format(image, module_memory_format(self.effnet_encoder))
 
         with torch.no_grad():
             with torch.autocast(self.pipeline.device.type, self.pipeline.dtype) if allow_mixed_precision \
@@ -1,9 +1,12 @@
 from abc import ABCMeta, abstractmethod
+from contextlib import contextmanager
 
 import torch
 from torch.optim import Optimizer
 
 from modules.module.EMAModule import EMAModuleWrapper
+from modules.module.LoRAModule import LoRAModuleWrapper
+from modules.util.ModuleResidency import ModuleResidency
 from modules.util.TrainProgress import TrainProgress
 from modules.util.enum.ModelType import ModelType
 from modules.util.modelSpec.ModelSpec import ModelSpec
@@ -17,6 +20,7 @@ class BaseModel(metaclass=ABCMeta):
     ema_state_dict: dict | None
     train_progress: TrainProgress
     model_spec: ModelSpec | None
+    residency: ModuleResidency
 
     def __init__(
             self,
@@ -32,6 +36,7 @@ class BaseModel(metaclass=ABCMeta):
         self.ema_state_dict = ema_state_dict
         self.train_progress = train_progress if train_progress is not None else TrainProgress()
         self.model_spec = model_spec
+        self.residency = ModuleResidency()
 
     @abstractmethod
     def to(self, device: torch.device):
@@ -40,3 +45,31 @@ class BaseModel(metaclass=ABCMeta):
     @abstractmethod
     def eval(self):
         pass
+
+    @contextmanager
+    def offloaded(self, device: torch.device):
+        """
+        Moves the whole model to a device, and moves every component back to its previous device afterwards.
+        """
+        devices = self.residency.devices()
+        with self.residency.keep_disabled():
+            self.to(device)
+        try:
+            yield
+        finally:
+            self.residency.restore(devices)
+
+    def lora_modules(self) -> list[LoRAModuleWrapper]:
+        return []
+
+    def layer_offload_components(self) -> list[str]:
+        # the names of the components that can be streamed to the train device block by block
+        return []
+
+    def merge_lora(self, strict: bool = False):
+        for lora in self.lora_modules():
+            lora.merge_into_module(strict)
+
+    def unmerge_lora(self):
+        for lora in self.lora_modules():
+            lora.unmerge_from_module()
@@ -5,6 +5,7 @@ from torch import Tensor
 from transformers import CLIPTextModel, CLIPTokenizer, DPTImageProcessor, DPTForDepthEstimation
 
 from modules.model.BaseModel import BaseModel
+from modules.module.AdditionalEmbeddingWrapper import AdditionalEmbeddingWrapper
 from modules.module.LoRAModule import LoRAModuleWrapper
 from modules.util.TrainProgress import TrainProgress
 from modules.util.convert.rescale_noise_scheduler_to_zero_terminal_snr import \
@@ -33,6 +34,7 @@ class StableDiffusionModel(BaseModel):
 
     # persistent training data
     embeddings: list[StableDiffusionModelEmbedding] | None
+    embedding_wrapper: AdditionalEmbeddingWrapper | None
     text_encoder_lora: LoRAModuleWrapper | None
     unet_lora: LoRAModuleWrapper | None
     sd_config: dict | None
@@ -73,28 +75,24 @@ class StableDiffusionModel(BaseModel):
         self.depth_estimator = depth_estimator
 
         self.embeddings = embeddings if embeddings is not None else []
+        self.embedding_wrapper = None
         self.text_encoder_lora = text_encoder_lora
         self.unet_lora = unet_lora
         self.sd_config = sd_config
 
     def vae_to(self, device: torch.device):
-        self.vae.to(device=device)
+        self.residency.move("vae", device, [self.vae])
 
     def depth_estimator_to(self, device: torch.device):
-        if self.depth_estimator is not None:
-            self.depth_estimator.to(device=device)
+        self.residency.move("depth_estimator", device, [self.depth_estimator])
 
     def text_encoder_to(self, device: torch.device):
-        self.text_encoder.to(device=device)
-
-        if self.text_encoder_lora is not None:
-            self.text_encoder_lora.to(device)
+        self.residency.move("text_encoder", device, [
+            self.text_encoder, self.text_encoder_lora, self.embedding_wrapper,
+        ])
 
     def unet_to(self, device: torch.device):
-        self.unet.to(device=device)
-
-        if self.unet_lora is not None:
-            self.unet_lora.to(device)
+        self.residency.move("unet", device, [self.unet, self.unet_lora])
 
     def to(self, device: torch.device):
         self.vae_to(device)
@@ -109,6 +107,13 @@ class StableDiffusionModel(BaseModel):
         self.text_encoder.eval()
         self.unet.eval()
 
+    def layer_offload_components(self) -> list[str]:
+        return ["text_encoder", "unet"]
+
+    def lora_modules(self) -> list[LoRAModuleWrapper]:
+        loras = [self.text_encoder_lora, self.unet_lora]
+        return [lora for lora in loras if lora is not None]
+
     def create_pipeline(self) -> DiffusionPipeline:
         if self.model_type.has_depth_input():
             return StableDiffusionDepth2ImgPipeline(
@@ -4,6 +4,7 @@ from torch import Tensor
 from transformers import CLIPTextModel, CLIPTokenizer
 
 from modules.model.BaseModel import BaseModel
+from modules.module.AdditionalEmbeddingWrapper import AdditionalEmbeddingWrapper
 from modules.module.LoRAModule import LoRAModuleWrapper
 from modules.util.TrainProgress import TrainProgress
 from modules.util.enum.ModelType import ModelType
@@ -37,6 +38,8 @@ class StableDiffusionXLModel(BaseModel):
 
     # persistent training data
     embeddings: list[StableDiffusionXLModelEmbedding] | None
+    embedding_wrapper_1: AdditionalEmbeddingWrapper | None
+    embedding_wrapper_2: AdditionalEmbeddingWrapper | None
     text_encoder_1_lora: LoRAModuleWrapper | None
     text_encoder_2_lora: LoRAModuleWrapper | None
     unet_lora: LoRAModuleWrapper | None
@@ -79,41 +82,32 @@ class StableDiffusionXLModel(BaseModel):
         self.unet = unet
 
         self.embeddings = embeddings if embeddings is not None else []
+        self.embedding_wrapper_1 = None
+        self.embedding_wrapper_2 = None
         self.text_encoder_1_lora = text_encoder_1_lora
         self.text_encoder_2_lora = text_encoder_2_lora
         self.unet_lora = unet_lora
         self.sd_config = sd_config
 
     def vae_to(self, device: torch.device):
-        self.vae.to(device=device)
+        self.residency.move("vae", device, [self.vae])
 
     def text_encoder_to(self, device: torch.device):
-        self.text_encoder_1.to(device=device)
-        self.text_encoder_2.to(device=device)
-
-        if self.text_encoder_1_lora is not None:
-            self.text_encoder_1_lora.to(device)
-
-        if self.text_encoder_2_lora is not None:
-            self.text_encoder_2_lora.to(device)
+        self.text_encoder_1_to(device)
+        self.text_encoder_2_to(device)
 
     def text_encoder_1_to(self, device: torch.device):
-        self.text_encoder_1.to(device=device)
-
-        if self.text_encoder_1_lora is not None:
-            self.text_encoder_1_lora.to(device)
+        self.residency.move("text_encoder_1", device, [
+            self.text_encoder_1, self.text_encoder_1_lora, self.embedding_wrapper_1,
+        ])
 
     def text_encoder_2_to(self, device: torch.device):
-        self.text_encoder_2.to(device=device)
-
-        if self.text_encoder_2_lora is not None:
-            self.text_encoder_2_lora.to(device)
+        self.residency.move("text_encoder_2", device, [
+            self.text_encoder_2, self.text_encoder_2_lora, self.embedding_wrapper_2,
+        ])
 
     def unet_to(self, device: torch.device):
-        self.unet.to(device=device)
-
-        if self.unet_lora is not None:
-            self.unet_lora.to(device)
+        self.residency.move("unet", device, [self.unet, self.unet_lora])
 
     def to(self, device: torch.device):
         self.vae_to(device)
@@ -126,6 +120,13 @@ class StableDiffusionXLModel(BaseModel):
         self.text_encoder_2.eval()
         self.unet.eval()
 
+    def layer_offload_components(self) -> list[str]:
+        return ["text_encoder_1", "text_encoder_2", "unet"]
+
+    def lora_modules(self) -> list[LoRAModuleWrapper]:
+        loras = [self.text_encoder_1_lora, self.text_encoder_2_lora, self.unet_lora]
+        return [lora for lora in loras if lora is not None]
+
     def create_pipeline(self) -> DiffusionPipeline:
         return StableDiffusionXLPipeline(
             vae=self.vae,
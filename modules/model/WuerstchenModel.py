@@ -7,6 +7,7 @@ from torch import nn, Tensor
 from transformers import CLIPTextModel, CLIPTokenizer
 
 from modules.model.BaseModel import BaseModel
+from modules.module.AdditionalEmbeddingWrapper import AdditionalEmbeddingWrapper
 from modules.module.LoRAModule import LoRAModuleWrapper
 from modules.util.TrainProgress import TrainProgress
 from modules.util.enum.ModelType import ModelType
@@ -59,6 +60,7 @@ class WuerstchenModel(BaseModel):
 
     # persistent training data
     embeddings: list[WuerstchenModelEmbedding] | None
+    prior_embedding_wrapper: AdditionalEmbeddingWrapper | None
     prior_text_encoder_lora: LoRAModuleWrapper | None
     prior_prior_lora: LoRAModuleWrapper | None
 
@@ -103,32 +105,29 @@ class WuerstchenModel(BaseModel):
         self.prior_prior = prior_prior
 
         self.embeddings = embeddings if embeddings is not None else []
+        self.prior_embedding_wrapper = None
         self.prior_text_encoder_lora = prior_text_encoder_lora
         self.prior_prior_lora = prior_prior_lora
 
     def decoder_text_encoder_to(self, device: torch.device):
-        self.decoder_text_encoder.to(device=device)
+        self.residency.move("decoder_text_encoder", device, [self.decoder_text_encoder])
 
     def decoder_decoder_to(self, device: torch.device):
-        self.decoder_decoder.to(device=device)
+        self.residency.move("decoder_decoder", device, [self.decoder_decoder])
 
     def decoder_vqgan_to(self, device: torch.device):
-        self.decoder_vqgan.to(device=device)
+        self.residency.move("decoder_vqgan", device, [self.decoder_vqgan])
 
     def effnet_encoder_to(self, device: torch.device):
-        self.effnet_encoder.to(device=device)
+        self.residency.move("effnet_encoder", device, [self.effnet_encoder])
 
     def prior_text_encoder_to(self, device: torch.device):
-        self.prior_text_encoder.to(device=device)
-
-        if self.prior_text_encoder_lora is not None:
-            self.prior_text_encoder_lora.to(device)
+        self.residency.move("prior_text_encoder", device, [
+            self.prior_text_encoder, self.prior_text_encoder_lora, self.prior_embedding_wrapper,
+        ])
 
     def prior_prior_to(self, device: torch.device):
-        self.prior_prior.to(device=device)
-
-        if self.prior_prior_lora is not None:
-            self.prior_prior_lora.to(device)
+        self.residency.move("prior_prior", device, [self.prior_prior, self.prior_prior_lora])
 
     def to(self, device: torch.device):
         self.decoder_text_encoder_to(device)
@@ -146,6 +145,13 @@ class WuerstchenModel(BaseModel):
         self.prior_text_encoder.eval()
         self.prior_prior.eval()
 
+    def layer_offload_components(self) -> list[str]:
+        return ["prior_text_encoder", "prior_prior"]
+
+    def lora_modules(self) -> list[LoRAModuleWrapper]:
+        loras = [self.prior_text_encoder_lora, self.prior_prior_lora]
+        return [lora for lora in loras if lora is not None]
+
     def create_pipeline(self) -> DiffusionPipeline:
         return WuerstchenCombinedPipeline(
             tokenizer=self.decoder_tokenizer,
@@ -15,8 +15,10 @@ from modules.util import create
 from modules.util.ModelNames import ModelNames
 from modules.util.ModelWeightDtypes import ModelWeightDtypes
 from modules.util.TrainProgress import TrainProgress
+from modules.util.dtype_util import enable_stochastic_rounding
 from modules.util.enum.ModelType import ModelType
 from modules.util.enum.NoiseScheduler import NoiseScheduler
+from modules.util.quantization_util import quantize_module
 
 
 class StableDiffusionModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, ModelLoaderSDConfigMixin):
@@ -250,6 +252,16 @@ class StableDiffusionModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, Mod
             model_spec=model_spec,
         )
 
+    @staticmethod
+    def __apply_weight_dtypes(model: StableDiffusionModel, weight_dtypes: ModelWeightDtypes) -> StableDiffusionModel:
+        quantize_module(model.text_encoder, weight_dtypes.text_encoder)
+        enable_stochastic_rounding(model.text_encoder, weight_dtypes.text_encoder)
+        quantize_module(model.vae, weight_dtypes.vae)
+        enable_stochastic_rounding(model.vae, weight_dtypes.vae)
+        quantize_module(model.unet, weight_dtypes.unet)
+        enable_stochastic_rounding(model.unet, weight_dtypes.unet)
+        return model
+
     def load(
             self,
             model_type: ModelType,
@@ -260,32 +272,41 @@ class StableDiffusionModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, Mod
 
         try:
             model = self.__load_internal(model_type, weight_dtypes, model_names.base_model)
-            if model is not None:
-                return model
         except:
+            model = None
             stacktraces.append(traceback.format_exc())
 
+        # errors while applying the weight dtypes are not loading errors of this format, they are raised directly
+        if model is not None:
+            return self.__apply_weight_dtypes(model, weight_dtypes)
+
         try:
             model = self.__load_diffusers(model_type, weight_dtypes, model_names.base_model)
-            if model is not None:
-                return model
         except:
+            model = None
             stacktraces.append(traceback.format_exc())
 
+        if model is not None:
+            return self.__apply_weight_dtypes(model, weight_dtypes)
+
         try:
             model = self.__load_safetensors(model_type, weight_dtypes, model_names.base_model)
-            if model is not None:
-                return model
         except:
+            model = None
             stacktraces.append(traceback.format_exc())
 
+        if model is not None:
+            return self.__apply_weight_dtypes(model, weight_dtypes)
+
         try:
             model = self.__load_ckpt(model_type, weight_dtypes, model_names.base_model)
-            if model is not None:
-                return model
         except:
+            model = None
             stacktraces.append(traceback.format_exc())
 
+        if model is not None:
+            return self.__apply_weight_dtypes(model, weight_dtypes)
+
         for stacktrace in stacktraces:
             print(stacktrace)
         raise Exception("could not load model: " + model_names.base_model)
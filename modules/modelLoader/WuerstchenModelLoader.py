@@ -14,7 +14,9 @@ from modules.modelLoader.mixin.ModelLoaderSDConfigMixin import ModelLoaderSDConf
 from modules.util.ModelNames import ModelNames
 from modules.util.ModelWeightDtypes import ModelWeightDtypes
 from modules.util.TrainProgress import TrainProgress
+from modules.util.dtype_util import enable_stochastic_rounding
 from modules.util.enum.ModelType import ModelType
+from modules.util.quantization_util import quantize_module
 
 
 class WuerstchenModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, ModelLoaderSDConfigMixin):
@@ -177,6 +179,22 @@ class WuerstchenModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, ModelLoa
     ) -> WuerstchenModel | None:
         pass
 
+    @staticmethod
+    def __apply_weight_dtypes(model: WuerstchenModel, weight_dtypes: ModelWeightDtypes) -> WuerstchenModel:
+        quantize_module(model.decoder_text_encoder, weight_dtypes.decoder_text_encoder)
+        enable_stochastic_rounding(model.decoder_text_encoder, weight_dtypes.decoder_text_encoder)
+        quantize_module(model.decoder_decoder, weight_dtypes.decoder)
+        enable_stochastic_rounding(model.decoder_decoder, weight_dtypes.decoder)
+        quantize_module(model.decoder_vqgan, weight_dtypes.decoder_vqgan)
+        enable_stochastic_rounding(model.decoder_vqgan, weight_dtypes.decoder_vqgan)
+        quantize_module(model.effnet_encoder, weight_dtypes.effnet_encoder)
+        enable_stochastic_rounding(model.effnet_encoder, weight_dtypes.effnet_encoder)
+        quantize_module(model.prior_text_encoder, weight_dtypes.text_encoder)
+        enable_stochastic_rounding(model.prior_text_encoder, weight_dtypes.text_encoder)
+        quantize_module(model.prior_prior, weight_dtypes.prior)
+        enable_stochastic_rounding(model.prior_prior, weight_dtypes.prior)
+        return model
+
     def load(
             self,
             model_type: ModelType,
@@ -197,11 +215,14 @@ class WuerstchenModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, ModelLoa
                 effnet_encoder_model_name,
                 decoder_model_name,
             )
-            if model is not None:
-                return model
         except:
+            model = None
             stacktraces.append(traceback.format_exc())
 
+        # errors while applying the weight dtypes are not loading errors of this format, they are raised directly
+        if model is not None:
+            return self.__apply_weight_dtypes(model, weight_dtypes)
+
         try:
             model = self.__load_diffusers(
                 model_type,
@@ -210,11 +231,13 @@ class WuerstchenModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, ModelLoa
                 effnet_encoder_model_name,
                 decoder_model_name,
             )
-            if model is not None:
-                return model
         except:
+            model = None
             stacktraces.append(traceback.format_exc())
 
+        if model is not None:
+            return self.__apply_weight_dtypes(model, weight_dtypes)
+
         try:
             model = self.__load_safetensors(
                 model_type,
@@ -223,11 +246,13 @@ class WuerstchenModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, ModelLoa
                 effnet_encoder_model_name,
                 decoder_model_name,
             )
-            if model is not None:
-                return model
         except:
+            model = None
             stacktraces.append(traceback.format_exc())
 
+        if model is not None:
+            return self.__apply_weight_dtypes(model, weight_dtypes)
+
         try:
             model = self.__load_ckpt(
                 model_type,
@@ -236,11 +261,13 @@ class WuerstchenModelLoader(BaseModelLoader, ModelLoaderModelSpecMixin, ModelLoa
                 effnet_encoder_model_name,
                 decoder_model_name,
             )
-            if model is not None:
-                return model
         except:
+            model = None
             stacktraces.append(traceback.format_exc())
 
+        if model is not None:
+            return self.__apply_weight_dtypes(model, weight_dtypes)
+
         for stacktrace in stacktraces:
             print(stacktrace)
         raise Exception(
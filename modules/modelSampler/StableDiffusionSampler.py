@@ -13,6 +13,7 @@ from modules.util import create
 from modules.util.enum.ImageFormat import ImageFormat
 from modules.util.enum.ModelType import ModelType
 from modules.util.enum.NoiseScheduler import NoiseScheduler
+from modules.util.memory_format_util import module_memory_format, to_memory_format
 from modules.util.params.SampleParams import SampleParams
 from modules.util.torch_util import torch_gc
 
@@ -138,6 +139,7 @@ class StableDiffusionSampler(BaseModelSampler):
             device=self.train_device,
             dtype=torch.float32
         ) * noise_scheduler.init_noise_sigma
+        latent_image = to_memory_format(latent_image, module_memory_format(unet))
 
         # denoising loop
         extra_step_kwargs = {}
@@ -315,6 +317,7 @@ class StableDiffusionSampler(BaseModelSampler):
             device=self.train_device,
             dtype=torch.float32
         ) * noise_scheduler.init_noise_sigma
+        latent_image = to_memory_format(latent_image, module_memory_format(unet))
 
         # denoising loop
         extra_step_kwargs = {}
@@ -10,6 +10,7 @@ from modules.model.StableDiffusionModel import StableDiffusionModel
 from modules.modelSampler.BaseModelSampler import BaseModelSampler
 from modules.util.enum.ImageFormat import ImageFormat
 from modules.util.enum.ModelType import ModelType
+from modules.util.memory_format_util import module_memory_format, to_memory_format
 from modules.util.params.SampleParams import SampleParams
 
 
@@ -47,7 +48,8 @@ class StableDiffusionVaeSampler(BaseModelSampler):
         self.model.vae_to(self.train_device)
 
         with torch.no_grad():
-            latent_image_tensor = self.model.vae.encode(image_tensor.unsqueeze(0)).latent_dist.mean
+            image_tensor = to_memory_format(image_tensor.unsqueeze(0), module_memory_format(self.model.vae))
+            latent_image_tensor = self.model.vae.encode(image_tensor).latent_dist.mean
             image_tensor = self.model.vae.decode(latent_image_tensor).sample.squeeze()
 
         self.model.vae_to(self.temp_device)
@@ -13,6 +13,7 @@ from modules.util import create
 from modules.util.enum.ImageFormat import ImageFormat
 from modules.util.enum.ModelType import ModelType
 from modules.util.enum.NoiseScheduler import NoiseScheduler
+from modules.util.memory_format_util import module_memory_format, to_memory_format
 from modules.util.params.SampleParams import SampleParams
 from modules.util.torch_util import torch_gc
 
@@ -208,6 +209,7 @@ class StableDiffusionXLSampler(BaseModelSampler):
             device=self.train_device,
             dtype=unet.dtype
         ) * noise_scheduler.init_noise_sigma
+        latent_image = to_memory_format(latent_image, module_memory_format(unet))
 
         added_cond_kwargs = {
             "text_embeds": torch.concat([pooled_text_encoder_2_output, negative_pooled_text_encoder_2_output], dim=0),
@@ -460,6 +462,7 @@ class StableDiffusionXLSampler(BaseModelSampler):
             device=self.train_device,
             dtype=unet.dtype
         ) * noise_scheduler.init_noise_sigma
+        latent_image = to_memory_format(latent_image, module_memory_format(unet))
 
         added_cond_kwargs = {
             "text_embeds": torch.concat([pooled_text_encoder_2_output, negative_pooled_text_encoder_2_output], dim=0),
@@ -12,6 +12,7 @@ from modules.modelSampler.BaseModelSampler import BaseModelSampler
 from modules.util.enum.ImageFormat import ImageFormat
 from modules.util.enum.ModelType import ModelType
 from modules.util.enum.NoiseScheduler import NoiseScheduler
+from modules.util.memory_format_util import module_memory_format, to_memory_format
 from modules.util.params.SampleParams import SampleParams
 from modules.util.torch_util import torch_gc
 
@@ -235,6 +236,7 @@ class WuerstchenSampler(BaseModelSampler):
             device=self.train_device,
             dtype=torch.float32
         ) * decoder_noise_scheduler.init_noise_sigma
+        latent_image = to_memory_format(latent_image, module_memory_format(decoder_decoder))
 
         # denoising loop
         extra_step_kwargs = {}
@@ -13,6 +13,7 @@ from modules.util import git_util
 from modules.util.enum.ModelFormat import ModelFormat
 from modules.util.enum.ModelType import ModelType
 from modules.util.modelSpec.ModelSpec import ModelSpec
+from modules.util.quantization_util import dequantize_module
 
 
 class BaseModelSaver(metaclass=ABCMeta):
@@ -37,6 +38,15 @@ class BaseModelSaver(metaclass=ABCMeta):
             else:
                 state_dict[key] = value.contiguous()
 
+    @staticmethod
+    def _prepare_pipeline_copy(pipeline):
+        # quantized weights can't be saved in the diffusers format, the copy is saved with the dequantized weights.
+        # safetensors only saves contiguous tensors, channels last weights are converted back
+        for component in pipeline.components.values():
+            if isinstance(component, torch.nn.Module):
+                dequantize_module(component)
+                component.to(memory_format=torch.contiguous_format)
+
     @staticmethod
     def __calculate_safetensors_hash(state_dict: dict[str, Tensor] | None = None) -> str | None:
         if state_dict is None:
@@ -22,7 +22,7 @@ class StableDiffusionEmbeddingModelSaver(BaseModelSaver):
     ):
         os.makedirs(Path(destination).parent.absolute(), exist_ok=True)
 
-        vector_cpu = model.embeddings[0].vector.to("cpu", dtype)
+        vector_cpu = model.embeddings[0].vector.detach().to("cpu", dtype)
 
         torch.save(
             {
@@ -44,7 +44,7 @@ class StableDiffusionEmbeddingModelSaver(BaseModelSaver):
     ):
         os.makedirs(Path(destination).parent.absolute(), exist_ok=True)
 
-        vector_cpu = model.embeddings[0].vector.to("cpu", dtype)
+        vector_cpu = model.embeddings[0].vector.detach().to("cpu", dtype)
 
         save_file(
             {"emp_params": vector_cpu},
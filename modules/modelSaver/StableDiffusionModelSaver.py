@@ -13,6 +13,7 @@ from modules.modelSaver.BaseModelSaver import BaseModelSaver
 from modules.util.convert.convert_sd_diffusers_to_ckpt import convert_sd_diffusers_to_ckpt
 from modules.util.enum.ModelFormat import ModelFormat
 from modules.util.enum.ModelType import ModelType
+from modules.util.quantization_util import dequantized_state_dict
 
 
 class StableDiffusionModelSaver(BaseModelSaver):
@@ -25,11 +26,10 @@ class StableDiffusionModelSaver(BaseModelSaver):
     ):
         # Copy the model to cpu by first moving the original model to cpu. This preserves some VRAM.
         pipeline = model.create_pipeline()
-        original_device = pipeline.device
-        pipeline.to("cpu")
-        pipeline_copy = copy.deepcopy(pipeline)
-        pipeline.to(original_device)
+        with model.offloaded(torch.device("cpu")):
+            pipeline_copy = copy.deepcopy(pipeline)
 
+        BaseModelSaver._prepare_pipeline_copy(pipeline_copy)
         pipeline_copy.to("cpu", dtype, silence_dtype_warnings=True)
 
         os.makedirs(Path(destination).absolute(), exist_ok=True)
@@ -46,9 +46,9 @@ class StableDiffusionModelSaver(BaseModelSaver):
     ):
         state_dict = convert_sd_diffusers_to_ckpt(
             model_type,
-            model.vae.state_dict(),
-            model.unet.state_dict(),
-            model.text_encoder.state_dict(),
+            dequantized_state_dict(model.vae),
+            dequantized_state_dict(model.unet),
+            dequantized_state_dict(model.text_encoder),
             model.noise_scheduler
         )
 
@@ -73,9 +73,9 @@ class StableDiffusionModelSaver(BaseModelSaver):
     ):
         state_dict = convert_sd_diffusers_to_ckpt(
             model_type,
-            model.vae.state_dict(),
-            model.unet.state_dict(),
-            model.text_encoder.state_dict(),
+            dequantized_state_dict(model.vae),
+            dequantized_state_dict(model.unet),
+            dequantized_state_dict(model.text_encoder),
             model.noise_scheduler
         )
         save_state_dict = BaseModelSaver._convert_state_dict_dtype(state_dict, dtype)
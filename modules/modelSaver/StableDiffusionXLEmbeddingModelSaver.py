@@ -22,8 +22,8 @@ class StableDiffusionXLEmbeddingModelSaver(BaseModelSaver):
     ):
         os.makedirs(Path(destination).parent.absolute(), exist_ok=True)
 
-        text_encoder_1_vector_cpu = model.embeddings[0].text_encoder_1_vector.to("cpu", dtype)
-        text_encoder_2_vector_cpu = model.embeddings[0].text_encoder_2_vector.to("cpu", dtype)
+        text_encoder_1_vector_cpu = model.embeddings[0].text_encoder_1_vector.detach().to("cpu", dtype)
+        text_encoder_2_vector_cpu = model.embeddings[0].text_encoder_2_vector.detach().to("cpu", dtype)
 
         torch.save(
             {
@@ -41,8 +41,8 @@ class StableDiffusionXLEmbeddingModelSaver(BaseModelSaver):
     ):
         os.makedirs(Path(destination).parent.absolute(), exist_ok=True)
 
-        text_encoder_1_vector_cpu = model.embeddings[0].text_encoder_1_vector.to("cpu", dtype)
-        text_encoder_2_vector_cpu = model.embeddings[0].text_encoder_2_vector.to("cpu", dtype)
+        text_encoder_1_vector_cpu = model.embeddings[0].text_encoder_1_vector.detach().to("cpu", dtype)
+        text_encoder_2_vector_cpu = model.embeddings[0].text_encoder_2_vector.detach().to("cpu", dtype)
 
         save_file(
             {
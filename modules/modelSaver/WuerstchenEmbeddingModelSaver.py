@@ -22,7 +22,7 @@ class WuerstchenEmbeddingModelSaver(BaseModelSaver):
     ):
         os.makedirs(Path(destination).parent.absolute(), exist_ok=True)
 
-        prior_text_encoder_vector_cpu = model.embeddings[0].prior_text_encoder_vector.to("cpu", dtype)
+        prior_text_encoder_vector_cpu = model.embeddings[0].prior_text_encoder_vector.detach().to("cpu", dtype)
 
         torch.save(
             {
@@ -39,7 +39,7 @@ class WuerstchenEmbeddingModelSaver(BaseModelSaver):
     ):
         os.makedirs(Path(destination).parent.absolute(), exist_ok=True)
 
-        prior_text_encoder_vector_cpu = model.embeddings[0].prior_text_encoder_vector.to("cpu", dtype)
+        prior_text_encoder_vector_cpu = model.embeddings[0].prior_text_encoder_vector.detach().to("cpu", dtype)
 
         save_file(
             {
@@ -9,6 +9,7 @@ from torch import Tensor
 from modules.model.BaseModel import BaseModel
 from modules.model.WuerstchenModel import WuerstchenModel
 from modules.modelSaver.BaseModelSaver import BaseModelSaver
+from modules.modelSaver.WuerstchenModelSaver import WuerstchenModelSaver
 from modules.util.enum.ModelFormat import ModelFormat
 from modules.util.enum.ModelType import ModelType
 
@@ -104,3 +105,21 @@ class WuerstchenLoRAModelSaver(BaseModelSaver):
                 self.__save_safetensors(model, output_model_destination, dtype)
             case ModelFormat.INTERNAL:
                 self.__save_internal(model, output_model_destination)
+
+    def bake(
+            self,
+            model: BaseModel,
+            model_type: ModelType,
+            output_model_format: ModelFormat,
+            output_model_destination: str,
+            dtype: torch.dtype,
+    ):
+        """
+        Saves the base model with the LoRA merged into its weights. The weights are restored afterwards.
+        """
+        try:
+            # quantized layers can't hold the LoRA, baking fails instead of saving them without it
+            model.merge_lora(strict=True)
+            WuerstchenModelSaver().save(model, model_type, output_model_format, output_model_destination, dtype)
+        finally:
+            model.unmerge_lora()
@@ -22,11 +22,10 @@ class WuerstchenModelSaver(BaseModelSaver):
     ):
         # Copy the model to cpu by first moving the original model to cpu. This preserves some VRAM.
         pipeline = model.create_pipeline().prior_pipe
-        original_device = pipeline.device
-        pipeline.to("cpu")
-        pipeline_copy = copy.deepcopy(pipeline)
-        pipeline.to(original_device)
+        with model.offloaded(torch.device("cpu")):
+            pipeline_copy = copy.deepcopy(pipeline)
 
+        BaseModelSaver._prepare_pipeline_copy(pipeline_copy)
         pipeline_copy.to("cpu", dtype, silence_dtype_warnings=True)
 
         os.makedirs(Path(destination).absolute(), exist_ok=True)
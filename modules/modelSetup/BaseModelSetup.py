@@ -1,3 +1,4 @@
+import os
 from abc import ABCMeta, abstractmethod
 from typing import Iterable
 
@@ -6,8 +7,13 @@ from torch import Tensor
 from torch.nn import Parameter
 
 from modules.model.BaseModel import BaseModel
+from modules.modelSetup.stableDiffusion.CheckpointingPlanner import CheckpointingPlanner
+from modules.module.CompiledForwardWrapper import CompiledForwardWrapper
 from modules.util.TrainProgress import TrainProgress
 from modules.util.args.TrainArgs import TrainArgs
+from modules.util.attention_util import AttentionShape, select_attention_mechanism
+from modules.util.dtype_util import allow_mixed_precision
+from modules.util.enum.AttentionMechanism import AttentionMechanism
 
 
 class BaseModelSetup(metaclass=ABCMeta):
@@ -46,6 +52,39 @@ class BaseModelSetup(metaclass=ABCMeta):
     ):
         pass
 
+    def _select_attention_mechanism(
+            self,
+            name: str,
+            shapes: list[AttentionShape],
+            args: TrainArgs,
+    ) -> AttentionMechanism:
+        return select_attention_mechanism(
+            name=name,
+            shapes=shapes,
+            device=self.train_device,
+            autocast_dtype=args.train_dtype.torch_dtype() if allow_mixed_precision(args) else None,
+            cache_path=os.path.join(args.cache_dir, "attention_benchmark.json"),
+            cache_key=str(args.model_type),
+        )
+
+    def _create_checkpointing_planner(self, args: TrainArgs) -> CheckpointingPlanner:
+        return CheckpointingPlanner(
+            device=self.train_device,
+            autocast_dtype=args.train_dtype.torch_dtype() if allow_mixed_precision(args) else None,
+            batch_size=args.batch_size,
+        )
+
+    @staticmethod
+    def _compile_forward(module: torch.nn.Module, args: TrainArgs):
+        if not args.compile_model or isinstance(getattr(module.forward, '__self__', None), CompiledForwardWrapper):
+            return
+
+        if args.layer_offload:
+            print("Layer offloading can't be combined with model compilation, the model is not compiled")
+            return
+
+        CompiledForwardWrapper(module, os.path.join(args.cache_dir, "torch_compile")).hook_to_module()
+
     @abstractmethod
     def setup_train_device(
             self,
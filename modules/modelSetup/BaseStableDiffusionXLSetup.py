@@ -16,8 +16,11 @@ from modules.modelSetup.stableDiffusion.checkpointing_util import \
     create_checkpointed_unet_forward
 from modules.util.TrainProgress import TrainProgress
 from modules.util.args.TrainArgs import TrainArgs
+from modules.util.attention_util import bucket_resolutions, unet_attention_shapes, vae_attention_shapes, \
+    create_attention_processor
 from modules.util.enum.AttentionMechanism import AttentionMechanism
 from modules.util.enum.TrainingMethod import TrainingMethod
+from modules.util.memory_format_util import to_channels_last
 
 
 class BaseStableDiffusionXLSetup(
@@ -33,7 +36,24 @@ class BaseStableDiffusionXLSetup(
             model: StableDiffusionXLModel,
             args: TrainArgs,
     ):
-        if args.attention_mechanism == AttentionMechanism.DEFAULT:
+        latent_sizes = [
+            (height // 8, width // 8)
+            for height, width in bucket_resolutions(args.resolution, args.aspect_ratio_bucketing)
+        ]
+
+        if args.attention_mechanism == AttentionMechanism.AUTO:
+            unet_attention_mechanism = self._select_attention_mechanism(
+                "unet",
+                unet_attention_shapes(model.unet, latent_sizes, args.batch_size, model.tokenizer_1.model_max_length),
+                args,
+            )
+            model.unet.set_attn_processor(create_attention_processor(unet_attention_mechanism))
+
+            vae_attention_mechanism = self._select_attention_mechanism(
+                "vae", vae_attention_shapes(model.vae, latent_sizes, args.batch_size), args
+            )
+            model.vae.set_attn_processor(create_attention_processor(vae_attention_mechanism))
+        elif args.attention_mechanism == AttentionMechanism.DEFAULT:
             model.unet.set_attn_processor(AttnProcessor())
         elif args.attention_mechanism == AttentionMechanism.XFORMERS and is_xformers_available():
             try:
@@ -58,9 +78,28 @@ class BaseStableDiffusionXLSetup(
 
         if args.gradient_checkpointing:
             model.unet.enable_gradient_checkpointing()
-            enable_checkpointing_for_transformer_blocks(model.unet)
-            enable_checkpointing_for_clip_encoder_layers(model.text_encoder_1)
-            enable_checkpointing_for_clip_encoder_layers(model.text_encoder_2)
+
+            blocks = None
+            if args.gradient_checkpointing_budget > 0:
+                planner = self._create_checkpointing_planner(args)
+                planner.add_transformer_blocks("unet", model.unet, latent_sizes, model.tokenizer_1.model_max_length)
+                if args.train_text_encoder or args.training_method == TrainingMethod.EMBEDDING:
+                    planner.add_clip_encoder_layers("text_encoder_1", model.text_encoder_1)
+                if args.train_text_encoder_2 or args.training_method == TrainingMethod.EMBEDDING:
+                    planner.add_clip_encoder_layers("text_encoder_2", model.text_encoder_2)
+                blocks = planner.plan(int(args.gradient_checkpointing_budget * 1024 ** 3))
+
+            enable_checkpointing_for_transformer_blocks(model.unet, blocks)
+            enable_checkpointing_for_clip_encoder_layers(model.text_encoder_1, blocks)
+            enable_checkpointing_for_clip_encoder_layers(model.text_encoder_2, blocks)
+
+        if args.unet_channels_last:
+            to_channels_last(model.unet)
+
+        if args.vae_channels_last:
+            to_channels_last(model.vae)
+
+        self._compile_forward(model.unet, args)
 
     def __encode_text(
             self,
@@ -141,6 +180,9 @@ class BaseStableDiffusionXLSetup(
         )
 
         latent_image = batch['latent_image']
+        if args.unet_channels_last:
+            # no copy is made if the data loader already returned channels last latents
+            latent_image = latent_image.contiguous(memory_format=torch.channels_last)
         scaled_latent_image = latent_image * vae_scaling_factor
 
         scaled_latent_conditioning_image = None
@@ -2,7 +2,7 @@ from abc import ABCMeta
 
 import torch
 import torch.nn.functional as F
-from diffusers.models.attention_processor import AttnProcessor, XFormersAttnProcessor, AttnProcessor2_0
+from diffusers.models.attention_processor import Attention, AttnProcessor, XFormersAttnProcessor, AttnProcessor2_0
 from diffusers.pipelines.wuerstchen.modeling_wuerstchen_common import AttnBlock
 from diffusers.utils import is_xformers_available
 from torch import Tensor
@@ -17,8 +17,10 @@ from modules.modelSetup.stableDiffusion.checkpointing_util import enable_checkpo
 from modules.util import loss_util
 from modules.util.TrainProgress import TrainProgress
 from modules.util.args.TrainArgs import TrainArgs
+from modules.util.attention_util import bucket_resolutions, create_attention_processor
 from modules.util.enum.AttentionMechanism import AttentionMechanism
 from modules.util.enum.TrainingMethod import TrainingMethod
+from modules.util.memory_format_util import to_channels_last
 
 
 class BaseWuerstchenSetup(
@@ -34,7 +36,18 @@ class BaseWuerstchenSetup(
             model: WuerstchenModel,
             args: TrainArgs,
     ):
-        if args.attention_mechanism == AttentionMechanism.DEFAULT:
+        if args.attention_mechanism == AttentionMechanism.AUTO:
+            # the prior attends to its own latents and the text encoder states at the same time
+            text_length = model.prior_tokenizer.model_max_length
+            shapes = [
+                (attention, args.batch_size, latent_length, latent_length + text_length)
+                for attention in model.prior_prior.modules() if isinstance(attention, Attention)
+                for latent_length in self.__prior_latent_lengths(args)
+            ]
+
+            prior_attention_mechanism = self._select_attention_mechanism("prior", shapes, args)
+            model.prior_prior.set_attn_processor(create_attention_processor(prior_attention_mechanism))
+        elif args.attention_mechanism == AttentionMechanism.DEFAULT:
             model.prior_prior.set_attn_processor(AttnProcessor())
         elif args.attention_mechanism == AttentionMechanism.XFORMERS and is_xformers_available():
             try:
@@ -49,7 +62,32 @@ class BaseWuerstchenSetup(
 
         if args.gradient_checkpointing:
             model.prior_prior.enable_gradient_checkpointing()
-            enable_checkpointing_for_clip_encoder_layers(model.prior_text_encoder)
+
+            # the blocks of the prior are checkpointed by diffusers, only the text encoder layers are planned
+            blocks = None
+            if args.gradient_checkpointing_budget > 0:
+                planner = self._create_checkpointing_planner(args)
+                if args.train_text_encoder or args.training_method == TrainingMethod.EMBEDDING:
+                    planner.add_clip_encoder_layers("prior_text_encoder", model.prior_text_encoder)
+                blocks = planner.plan(int(args.gradient_checkpointing_budget * 1024 ** 3))
+
+            enable_checkpointing_for_clip_encoder_layers(model.prior_text_encoder, blocks)
+
+        if args.effnet_encoder_channels_last:
+            to_channels_last(model.effnet_encoder)
+
+        if args.decoder_channels_last:
+            to_channels_last(model.decoder_decoder)
+
+        self._compile_forward(model.prior_prior, args)
+
+    @staticmethod
+    def __prior_latent_lengths(args: TrainArgs) -> list[int]:
+        # images are scaled by 0.75 before they are encoded by the effnet encoder, which downscales them by 32
+        return [
+            int(height * 0.75 / 32) * int(width * 0.75 / 32)
+            for height, width in bucket_resolutions(args.resolution, args.aspect_ratio_bucketing)
+        ]
 
     def __alpha_cumprod(
             self,
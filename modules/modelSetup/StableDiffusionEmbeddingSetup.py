@@ -1,20 +1,17 @@
 from typing import Iterable
 
 import torch
-from torch import Tensor
 from torch.nn import Parameter
 
 from modules.model.StableDiffusionModel import StableDiffusionModel, StableDiffusionModelEmbedding
 from modules.modelSetup.BaseStableDiffusionSetup import BaseStableDiffusionSetup
+from modules.module.AdditionalEmbeddingWrapper import AdditionalEmbeddingWrapper
 from modules.util import create
 from modules.util.TrainProgress import TrainProgress
 from modules.util.args.TrainArgs import TrainArgs
 
 
 class StableDiffusionEmbeddingSetup(BaseStableDiffusionSetup):
-    all_original_token_embeds: Tensor
-    trainable_token_embeds_mask: list[bool]
-    untrainable_token_embeds_mask: list[bool]
 
     def __init__(
             self,
@@ -33,7 +30,7 @@ class StableDiffusionEmbeddingSetup(BaseStableDiffusionSetup):
             model: StableDiffusionModel,
             args: TrainArgs,
     ) -> Iterable[Parameter]:
-        return model.text_encoder.get_input_embeddings().parameters()
+        return model.embedding_wrapper.parameters()
 
     def create_parameters_for_optimizer(
             self,
@@ -42,7 +39,7 @@ class StableDiffusionEmbeddingSetup(BaseStableDiffusionSetup):
     ) -> Iterable[Parameter] | list[dict]:
         return [
             {
-                'params': model.text_encoder.get_input_embeddings().parameters(),
+                'params': model.embedding_wrapper.parameters(),
                 'lr': args.learning_rate,
                 'initial_lr': args.learning_rate,
             }
@@ -54,7 +51,6 @@ class StableDiffusionEmbeddingSetup(BaseStableDiffusionSetup):
             args: TrainArgs,
     ):
         model.text_encoder.requires_grad_(False)
-        model.text_encoder.get_input_embeddings().requires_grad_(True)
         model.vae.requires_grad_(False)
         model.unet.requires_grad_(False)
 
@@ -64,25 +60,15 @@ class StableDiffusionEmbeddingSetup(BaseStableDiffusionSetup):
         model.tokenizer.add_tokens(tokens)
         model.text_encoder.resize_token_embeddings(len(model.tokenizer))
 
-        model.text_encoder.get_input_embeddings().to(dtype=args.embedding_weight_dtype.torch_dtype())
-
         with torch.no_grad():
             token_ids = model.tokenizer.encode(
                 tokens,
                 add_special_tokens=False,
             )
 
-            all_token_embeds = model.text_encoder.get_input_embeddings().weight.data
-            self.all_original_token_embeds = all_token_embeds.clone()
-            self.trainable_token_embeds_mask = [(i in token_ids) for i in range(len(self.all_original_token_embeds))]
-            self.untrainable_token_embeds_mask = [
-                (i not in token_ids) for i in range(len(self.all_original_token_embeds))
-            ]
-
             if len(model.embeddings) > 0:
                 # an embedding was loaded
-                for i, token_id in enumerate(token_ids):
-                    all_token_embeds[token_id] = model.embeddings[0].vector[i]
+                initial_vector = model.embeddings[0].vector
             else:
                 # create a new embedding
                 initial_token_ids = model.tokenizer.encode(
@@ -96,13 +82,18 @@ class StableDiffusionEmbeddingSetup(BaseStableDiffusionSetup):
                     max_length=token_count,
                 )[0]
                 initial_token_ids += [pad_token_id] * (token_count - len(initial_token_ids))
-                for token_id, initial_token_id in zip(token_ids, initial_token_ids):
-                    all_token_embeds[token_id] = all_token_embeds[initial_token_id]
+                initial_vector = model.text_encoder.get_input_embeddings().weight[initial_token_ids[:token_count]]
 
-                model.embeddings = [
-                    StableDiffusionModelEmbedding(
-                        "*", all_token_embeds[self.trainable_token_embeds_mask],
-                        token_count)]
+        # only the vectors of the new tokens are trained, the embedding table stays frozen
+        model.embedding_wrapper = AdditionalEmbeddingWrapper(
+            model.text_encoder.get_input_embeddings(), token_ids, initial_vector,
+            args.embedding_weight_dtype.torch_dtype()
+        )
+        model.embedding_wrapper.hook_to_module()
+
+        model.embeddings = [
+            StableDiffusionModelEmbedding("*", model.embedding_wrapper.vector, token_count)
+        ]
 
         model.optimizer = create.create_optimizer(
             self.create_parameters_for_optimizer(model, args), model.optimizer_state_dict, args
@@ -123,9 +114,9 @@ class StableDiffusionEmbeddingSetup(BaseStableDiffusionSetup):
     ):
         vae_on_train_device = self.debug_mode or args.align_prop_loss
 
-        model.text_encoder.to(self.train_device)
-        model.vae.to(self.train_device if vae_on_train_device else self.temp_device)
-        model.unet.to(self.train_device)
+        model.text_encoder_to(self.train_device)
+        model.vae_to(self.train_device if vae_on_train_device else self.temp_device)
+        model.unet_to(self.train_device)
         model.depth_estimator_to(self.temp_device)
 
         model.text_encoder.train()
@@ -138,13 +129,7 @@ class StableDiffusionEmbeddingSetup(BaseStableDiffusionSetup):
             args: TrainArgs,
             train_progress: TrainProgress
     ):
-        # reset untrainable embeddings
-        with torch.no_grad():
-            model.text_encoder.get_input_embeddings().weight[
-                self.untrainable_token_embeds_mask
-            ] = self.all_original_token_embeds[self.untrainable_token_embeds_mask]
-
         # save back to model
         model.embeddings = [StableDiffusionModelEmbedding(
-            "*", model.text_encoder.get_input_embeddings().weight[self.trainable_token_embeds_mask], model.embeddings[0].token_count
+            "*", model.embedding_wrapper.vector, model.embeddings[0].token_count
         )]
@@ -70,11 +70,10 @@ class StableDiffusionFineTuneVaeSetup(BaseStableDiffusionSetup):
             model: StableDiffusionModel,
             args: TrainArgs,
     ):
-        model.text_encoder.to(self.temp_device)
-        model.vae.to(self.train_device)
-        model.unet.to(self.temp_device)
-        if model.depth_estimator is not None:
-            model.depth_estimator.to(self.temp_device)
+        model.text_encoder_to(self.temp_device)
+        model.vae_to(self.train_device)
+        model.unet_to(self.temp_device)
+        model.depth_estimator_to(self.temp_device)
 
         model.text_encoder.eval()
         model.vae.train()
@@ -1,25 +1,17 @@
 from typing import Iterable
 
 import torch
-from torch import Tensor
 from torch.nn import Parameter
 
-from modules.model.StableDiffusionModel import StableDiffusionModelEmbedding
 from modules.model.StableDiffusionXLModel import StableDiffusionXLModel, StableDiffusionXLModelEmbedding
 from modules.modelSetup.BaseStableDiffusionXLSetup import BaseStableDiffusionXLSetup
+from modules.module.AdditionalEmbeddingWrapper import AdditionalEmbeddingWrapper
 from modules.util import create
 from modules.util.TrainProgress import TrainProgress
 from modules.util.args.TrainArgs import TrainArgs
 
 
 class StableDiffusionXLEmbeddingSetup(BaseStableDiffusionXLSetup):
-    all_text_encoder_1_original_token_embeds: Tensor
-    text_encoder_1_trainable_token_embeds_mask: list[bool]
-    text_encoder_1_untrainable_token_embeds_mask: list[bool]
-
-    all_text_encoder_2_original_token_embeds: Tensor
-    text_encoder_2_trainable_token_embeds_mask: list[bool]
-    text_encoder_2_untrainable_token_embeds_mask: list[bool]
 
     def __init__(
             self,
@@ -40,8 +32,8 @@ class StableDiffusionXLEmbeddingSetup(BaseStableDiffusionXLSetup):
     ) -> Iterable[Parameter]:
         params = list()
 
-        params += list(model.text_encoder_1.get_input_embeddings().parameters())
-        params += list(model.text_encoder_2.get_input_embeddings().parameters())
+        params += model.embedding_wrapper_1.parameters()
+        params += model.embedding_wrapper_2.parameters()
 
         return params
 
@@ -52,12 +44,12 @@ class StableDiffusionXLEmbeddingSetup(BaseStableDiffusionXLSetup):
     ) -> Iterable[Parameter] | list[dict]:
         return [
             {
-                'params': model.text_encoder_1.get_input_embeddings().parameters(),
+                'params': model.embedding_wrapper_1.parameters(),
                 'lr': args.learning_rate,
                 'initial_lr': args.learning_rate,
             },
             {
-                'params': model.text_encoder_2.get_input_embeddings().parameters(),
+                'params': model.embedding_wrapper_2.parameters(),
                 'lr': args.learning_rate,
                 'initial_lr': args.learning_rate,
             }
@@ -70,8 +62,6 @@ class StableDiffusionXLEmbeddingSetup(BaseStableDiffusionXLSetup):
     ):
         model.text_encoder_1.requires_grad_(False)
         model.text_encoder_2.requires_grad_(False)
-        model.text_encoder_1.get_input_embeddings().requires_grad_(True)
-        model.text_encoder_2.get_input_embeddings().requires_grad_(True)
         model.vae.requires_grad_(False)
         model.unet.requires_grad_(False)
 
@@ -83,42 +73,21 @@ class StableDiffusionXLEmbeddingSetup(BaseStableDiffusionXLSetup):
         model.text_encoder_1.resize_token_embeddings(len(model.tokenizer_1))
         model.text_encoder_2.resize_token_embeddings(len(model.tokenizer_2))
 
-        model.text_encoder_1.get_input_embeddings().to(dtype=args.embedding_weight_dtype.torch_dtype())
-        model.text_encoder_2.get_input_embeddings().to(dtype=args.embedding_weight_dtype.torch_dtype())
-
         with torch.no_grad():
             text_encoder_1_token_ids = model.tokenizer_1.encode(
                 tokens,
                 add_special_tokens=False,
             )
 
-            all_text_encoder_1_token_embeds = model.text_encoder_1.get_input_embeddings().weight.data
-            self.all_text_encoder_1_original_token_embeds = all_text_encoder_1_token_embeds.clone()
-            self.text_encoder_1_trainable_token_embeds_mask = \
-                [(i in text_encoder_1_token_ids) for i in range(len(self.all_text_encoder_1_original_token_embeds))]
-            self.text_encoder_1_untrainable_token_embeds_mask = [
-                (i not in text_encoder_1_token_ids) for i in range(len(self.all_text_encoder_1_original_token_embeds))
-            ]
-
-            text_encoder_2_token_ids = model.tokenizer_1.encode(
+            text_encoder_2_token_ids = model.tokenizer_2.encode(
                 tokens,
                 add_special_tokens=False,
             )
 
-            all_text_encoder_2_token_embeds = model.text_encoder_2.get_input_embeddings().weight.data
-            self.all_text_encoder_2_original_token_embeds = all_text_encoder_2_token_embeds.clone()
-            self.text_encoder_2_trainable_token_embeds_mask = \
-                [(i in text_encoder_2_token_ids) for i in range(len(self.all_text_encoder_2_original_token_embeds))]
-            self.text_encoder_2_untrainable_token_embeds_mask = [
-                (i not in text_encoder_2_token_ids) for i in range(len(self.all_text_encoder_2_original_token_embeds))
-            ]
-
             if len(model.embeddings) > 0:
                 # an embedding was loaded
-                for i, token_id in enumerate(text_encoder_1_token_ids):
-                    all_text_encoder_1_token_embeds[token_id] = model.embeddings[0].text_encoder_1_vector[i]
-                for i, token_id in enumerate(text_encoder_2_token_ids):
-                    all_text_encoder_2_token_embeds[token_id] = model.embeddings[0].text_encoder_2_vector[i]
+                text_encoder_1_initial_vector = model.embeddings[0].text_encoder_1_vector
+                text_encoder_2_initial_vector = model.embeddings[0].text_encoder_2_vector
             else:
                 # create a new embedding
                 text_encoder_1_initial_token_ids = model.tokenizer_1.encode(
@@ -133,13 +102,9 @@ class StableDiffusionXLEmbeddingSetup(BaseStableDiffusionXLSetup):
                 )[0]
                 text_encoder_1_initial_token_ids += [text_encoder_1_pad_token_id] * (
                         token_count - len(text_encoder_1_initial_token_ids))
-                for token_id, initial_token_id in zip(text_encoder_1_token_ids, text_encoder_1_initial_token_ids):
-                    all_text_encoder_1_token_embeds[token_id] = all_text_encoder_1_token_embeds[initial_token_id]
-
-                model.embeddings = [
-                    StableDiffusionModelEmbedding(
-                        "*", all_text_encoder_1_token_embeds[self.text_encoder_1_trainable_token_embeds_mask],
-                        token_count)]
+                text_encoder_1_initial_vector = model.text_encoder_1.get_input_embeddings().weight[
+                    text_encoder_1_initial_token_ids[:token_count]
+                ]
 
                 text_encoder_2_initial_token_ids = model.tokenizer_2.encode(
                     args.initial_embedding_text,
@@ -153,13 +118,28 @@ class StableDiffusionXLEmbeddingSetup(BaseStableDiffusionXLSetup):
                 )[0]
                 text_encoder_2_initial_token_ids += [text_encoder_2_pad_token_id] * (
                         token_count - len(text_encoder_2_initial_token_ids))
-                for token_id, initial_token_id in zip(text_encoder_2_token_ids, text_encoder_2_initial_token_ids):
-                    all_text_encoder_2_token_embeds[token_id] = all_text_encoder_2_token_embeds[initial_token_id]
+                text_encoder_2_initial_vector = model.text_encoder_2.get_input_embeddings().weight[
+                    text_encoder_2_initial_token_ids[:token_count]
+                ]
+
+        # only the vectors of the new tokens are trained, the embedding tables stay frozen
+        model.embedding_wrapper_1 = AdditionalEmbeddingWrapper(
+            model.text_encoder_1.get_input_embeddings(), text_encoder_1_token_ids, text_encoder_1_initial_vector,
+            args.embedding_weight_dtype.torch_dtype()
+        )
+        model.embedding_wrapper_2 = AdditionalEmbeddingWrapper(
+            model.text_encoder_2.get_input_embeddings(), text_encoder_2_token_ids, text_encoder_2_initial_vector,
+            args.embedding_weight_dtype.torch_dtype()
+        )
+        model.embedding_wrapper_1.hook_to_module()
+        model.embedding_wrapper_2.hook_to_module()
 
-                model.embeddings = [
-                    StableDiffusionModelEmbedding(
-                        "*", all_text_encoder_2_token_embeds[self.text_encoder_2_trainable_token_embeds_mask],
-                        token_count)]
+        model.embeddings = [StableDiffusionXLModelEmbedding(
+            "*",
+            model.embedding_wrapper_1.vector,
+            model.embedding_wrapper_2.vector,
+            token_count,
+        )]
 
         model.optimizer = create.create_optimizer(
             self.create_parameters_for_optimizer(model, args), model.optimizer_state_dict, args
@@ -195,20 +175,10 @@ class StableDiffusionXLEmbeddingSetup(BaseStableDiffusionXLSetup):
             args: TrainArgs,
             train_progress: TrainProgress
     ):
-        # reset untrainable embeddings
-        with torch.no_grad():
-            model.text_encoder_1.get_input_embeddings().weight[
-                self.text_encoder_1_untrainable_token_embeds_mask
-            ] = self.all_text_encoder_1_original_token_embeds[self.text_encoder_1_untrainable_token_embeds_mask]
-
-            model.text_encoder_2.get_input_embeddings().weight[
-                self.text_encoder_2_untrainable_token_embeds_mask
-            ] = self.all_text_encoder_2_original_token_embeds[self.text_encoder_2_untrainable_token_embeds_mask]
-
         # save back to model
         model.embeddings = [StableDiffusionXLModelEmbedding(
             "*",
-            model.text_encoder_1.get_input_embeddings().weight[self.text_encoder_1_trainable_token_embeds_mask],
-            model.text_encoder_2.get_input_embeddings().weight[self.text_encoder_2_trainable_token_embeds_mask],
+            model.embedding_wrapper_1.vector,
+            model.embedding_wrapper_2.vector,
             model.embeddings[0].token_count
         )]
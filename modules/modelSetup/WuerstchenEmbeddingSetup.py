@@ -1,21 +1,17 @@
 from typing import Iterable
 
 import torch
-from torch import Tensor
 from torch.nn import Parameter
 
-from modules.model.StableDiffusionModel import StableDiffusionModelEmbedding
 from modules.model.WuerstchenModel import WuerstchenModel, WuerstchenModelEmbedding
 from modules.modelSetup.BaseWuerstchenSetup import BaseWuerstchenSetup
+from modules.module.AdditionalEmbeddingWrapper import AdditionalEmbeddingWrapper
 from modules.util import create
 from modules.util.TrainProgress import TrainProgress
 from modules.util.args.TrainArgs import TrainArgs
 
 
 class WuerstchenEmbeddingSetup(BaseWuerstchenSetup):
-    all_prior_text_encoder_original_token_embeds: Tensor
-    prior_text_encoder_trainable_token_embeds_mask: list[bool]
-    prior_text_encoder_untrainable_token_embeds_mask: list[bool]
 
     def __init__(
             self,
@@ -36,7 +32,7 @@ class WuerstchenEmbeddingSetup(BaseWuerstchenSetup):
     ) -> Iterable[Parameter]:
         params = list()
 
-        params += list(model.prior_text_encoder.get_input_embeddings().parameters())
+        params += model.prior_embedding_wrapper.parameters()
 
         return params
 
@@ -47,7 +43,7 @@ class WuerstchenEmbeddingSetup(BaseWuerstchenSetup):
     ) -> Iterable[Parameter] | list[dict]:
         return [
             {
-                'params': model.prior_text_encoder.get_input_embeddings().parameters(),
+                'params': model.prior_embedding_wrapper.parameters(),
                 'lr': args.learning_rate,
                 'initial_lr': args.learning_rate,
             }
@@ -59,7 +55,6 @@ class WuerstchenEmbeddingSetup(BaseWuerstchenSetup):
             args: TrainArgs,
     ):
         model.prior_text_encoder.requires_grad_(False)
-        model.prior_text_encoder.get_input_embeddings().requires_grad_(True)
         model.prior_prior.requires_grad_(False)
         model.decoder_text_encoder.requires_grad_(False)
         model.decoder_decoder.requires_grad_(False)
@@ -72,28 +67,15 @@ class WuerstchenEmbeddingSetup(BaseWuerstchenSetup):
         model.prior_tokenizer.add_tokens(tokens)
         model.prior_text_encoder.resize_token_embeddings(len(model.prior_tokenizer))
 
-        model.prior_text_encoder.get_input_embeddings().to(dtype=args.embedding_weight_dtype.torch_dtype())
-
         with torch.no_grad():
             prior_text_encoder_token_ids = model.prior_tokenizer.encode(
                 tokens,
                 add_special_tokens=False,
             )
 
-            all_prior_text_encoder_token_embeds = model.prior_text_encoder.get_input_embeddings().weight.data
-            self.all_prior_text_encoder_original_token_embeds = all_prior_text_encoder_token_embeds.clone()
-            self.prior_text_encoder_trainable_token_embeds_mask = \
-                [(i in prior_text_encoder_token_ids) for i in
-                 range(len(self.all_prior_text_encoder_original_token_embeds))]
-            self.prior_text_encoder_untrainable_token_embeds_mask = [
-                (i not in prior_text_encoder_token_ids) for i in
-                range(len(self.all_prior_text_encoder_original_token_embeds))
-            ]
-
             if len(model.embeddings) > 0:
                 # an embedding was loaded
-                for i, token_id in enumerate(prior_text_encoder_token_ids):
-                    all_prior_text_encoder_token_embeds[token_id] = model.embeddings[0].prior_text_encoder_vector[i]
+                prior_text_encoder_initial_vector = model.embeddings[0].prior_text_encoder_vector
             else:
                 # create a new embedding
                 prior_text_encoder_initial_token_ids = model.prior_tokenizer.encode(
@@ -108,13 +90,22 @@ class WuerstchenEmbeddingSetup(BaseWuerstchenSetup):
                 )[0]
                 prior_text_encoder_initial_token_ids += [prior_text_encoder_pad_token_id] * (
                         token_count - len(prior_text_encoder_initial_token_ids))
-                for token_id, initial_token_id in zip(prior_text_encoder_token_ids, prior_text_encoder_initial_token_ids):
-                    all_prior_text_encoder_token_embeds[token_id] = all_prior_text_encoder_token_embeds[initial_token_id]
+                prior_text_encoder_initial_vector = model.prior_text_encoder.get_input_embeddings().weight[
+                    prior_text_encoder_initial_token_ids[:token_count]
+                ]
+
+        # only the vectors of the new tokens are trained, the embedding table stays frozen
+        model.prior_embedding_wrapper = AdditionalEmbeddingWrapper(
+            model.prior_text_encoder.get_input_embeddings(), prior_text_encoder_token_ids,
+            prior_text_encoder_initial_vector, args.embedding_weight_dtype.torch_dtype()
+        )
+        model.prior_embedding_wrapper.hook_to_module()
 
-                model.embeddings = [
-                    StableDiffusionModelEmbedding(
-                        "*", all_prior_text_encoder_token_embeds[self.prior_text_encoder_trainable_token_embeds_mask],
-                        token_count)]
+        model.embeddings = [WuerstchenModelEmbedding(
+            "*",
+            model.prior_embedding_wrapper.vector,
+            token_count,
+        )]
 
         model.optimizer = create.create_optimizer(
             self.create_parameters_for_optimizer(model, args), model.optimizer_state_dict, args
@@ -155,15 +146,9 @@ class WuerstchenEmbeddingSetup(BaseWuerstchenSetup):
             args: TrainArgs,
             train_progress: TrainProgress
     ):
-        # reset untrainable embeddings
-        with torch.no_grad():
-            model.prior_text_encoder.get_input_embeddings().weight[
-                self.prior_text_encoder_untrainable_token_embeds_mask
-            ] = self.all_prior_text_encoder_original_token_embeds[self.prior_text_encoder_untrainable_token_embeds_mask]
-
         # save back to model
         model.embeddings = [WuerstchenModelEmbedding(
             "*",
-            model.prior_text_encoder.get_input_embeddings().weight[self.prior_text_encoder_trainable_token_embeds_mask],
+            model.prior_embedding_wrapper.vector,
             model.embeddings[0].token_count
         )]
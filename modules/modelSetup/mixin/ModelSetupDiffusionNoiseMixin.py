@@ -42,4 +42,8 @@ class ModelSetupDiffusionNoiseMixin(metaclass=ABCMeta):
             )
             noise = noise + (args.perturbation_noise_weight * perturbation_noise)
 
+        if not source_tensor.is_contiguous():
+            # keep the memory format of the source, for example channels last latents
+            noise = torch.empty_like(source_tensor).copy_(noise)
+
         return noise
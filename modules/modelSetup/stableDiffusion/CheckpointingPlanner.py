@@ -0,0 +1,182 @@
+import time
+from contextlib import nullcontext
+
+import torch
+from diffusers.models.attention import BasicTransformerBlock
+from torch import nn, Tensor
+from transformers.models.clip.modeling_clip import CLIPEncoderLayer
+
+from modules.util.attention_util import unet_sequence_length
+
+
+class CheckpointingPlanner:
+    """
+    Selects the blocks that are checkpointed to fit their activations into a memory budget. The activation memory of
+    every block is measured once, by running it with inputs of the configured resolution and batch size and adding
+    up the tensors that autograd saves for the backward pass. Inputs and weights are not counted, checkpointing keeps
+    them anyway. The forward time of the block is its recompute cost.
+
+    Blocks are checkpointed in the order of the most saved memory per second of recompute time, until the remaining
+    activations fit into the budget. Blocks with the same configuration are only measured once.
+    """
+
+    def __init__(
+            self,
+            device: torch.device,
+            autocast_dtype: torch.dtype | None,
+            batch_size: int,
+    ):
+        self.device = device
+        self.autocast_dtype = autocast_dtype
+        self.batch_size = batch_size
+
+        # name, module and the inputs of every configuration the block is called with
+        self.__blocks: list[tuple[str, nn.Module, list[tuple]]] = []
+        # bytes of saved activations and forward time of each configuration
+        self.__measurements: dict[tuple, tuple[int, float]] = {}
+
+    def add_transformer_blocks(
+            self,
+            prefix: str,
+            unet: nn.Module,
+            latent_sizes: list[tuple[int, int]],
+            text_length: int,
+    ):
+        for name, module in unet.named_modules():
+            if not isinstance(module, BasicTransformerBlock):
+                continue
+
+            dim = module.attn1.to_q.in_features
+            cross_dim = module.attn2.to_k.in_features \
+                if module.attn2 is not None and module.attn2.is_cross_attention else None
+            configurations = [
+                ('transformer', dim, cross_dim, unet_sequence_length(unet, name, latent_size), text_length)
+                for latent_size in latent_sizes
+            ]
+            self.__blocks.append((f"{prefix}.{name}", module, configurations))
+
+    def add_clip_encoder_layers(
+            self,
+            prefix: str,
+            text_encoder: nn.Module,
+    ):
+        text_length = text_encoder.config.max_position_embeddings
+        for name, module in text_encoder.named_modules():
+            if isinstance(module, CLIPEncoderLayer):
+                configurations = [('clip', module.embed_dim, text_length)]
+                self.__blocks.append((f"{prefix}.{name}", module, configurations))
+
+    def __inputs(self, configuration: tuple, dtype: torch.dtype) -> tuple[tuple, dict]:
+        if configuration[0] == 'transformer':
+            _, dim, cross_dim, sequence_length, text_length = configuration
+            hidden_states = torch.randn(
+                (self.batch_size, sequence_length, dim), device=self.device, dtype=dtype, requires_grad=True
+            )
+            encoder_hidden_states = None if cross_dim is None else torch.randn(
+                (self.batch_size, text_length, cross_dim), device=self.device, dtype=dtype, requires_grad=True
+            )
+            return (hidden_states,), {'encoder_hidden_states': encoder_hidden_states}
+        else:
+            _, dim, text_length = configuration
+            hidden_states = torch.randn(
+                (self.batch_size, text_length, dim), device=self.device, dtype=dtype, requires_grad=True
+            )
+            causal_attention_mask = torch.full(
+                (text_length, text_length), torch.finfo(dtype).min, device=self.device, dtype=dtype
+            ).triu(1).expand(self.batch_size, 1, -1, -1)
+            return (hidden_states, None, causal_attention_mask), {}
+
+    def __synchronize(self):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+
+    def __measure(self, module: nn.Module, configuration: tuple) -> tuple[int, float]:
+        parameters = list(module.parameters())
+        orig_device = parameters[0].device
+        dtype = self.autocast_dtype if self.autocast_dtype is not None \
+            else next(p.dtype for p in parameters if p.is_floating_point())
+
+        module.to(self.device)
+        try:
+            args, kwargs = self.__inputs(configuration, dtype)
+
+            excluded_storages = set(p.untyped_storage().data_ptr() for p in module.parameters())
+            excluded_storages.update(
+                x.untyped_storage().data_ptr() for x in list(args) + list(kwargs.values()) if isinstance(x, Tensor)
+            )
+            saved_storages = {}
+
+            def pack(tensor: Tensor):
+                storage = tensor.untyped_storage()
+                if storage.data_ptr() not in excluded_storages:
+                    saved_storages[storage.data_ptr()] = storage.nbytes()
+                return tensor
+
+            with torch.autocast(self.device.type, dtype=self.autocast_dtype) if self.autocast_dtype is not None \
+                    else nullcontext():
+                # the first call is a warm-up
+                module(*args, **kwargs)
+
+                self.__synchronize()
+                start = time.perf_counter()
+                with torch.autograd.graph.saved_tensors_hooks(pack, lambda x: x):
+                    module(*args, **kwargs)
+                self.__synchronize()
+                forward_time = time.perf_counter() - start
+
+            return sum(saved_storages.values()), forward_time
+        finally:
+            module.to(orig_device)
+
+    def __block_measurement(self, module: nn.Module, configurations: list[tuple]) -> tuple[int, float]:
+        measurements = []
+        for configuration in configurations:
+            key = (configuration, tuple((name, p.shape, p.dtype) for name, p in module.named_parameters()))
+            if key not in self.__measurements:
+                self.__measurements[key] = self.__measure(module, configuration)
+            measurements.append(self.__measurements[key])
+
+        # the largest bucket decides the memory usage
+        return max(measurements, key=lambda x: x[0])
+
+    def activation_sizes(self) -> dict[str, int]:
+        """
+        Returns the measured activation memory in bytes of every block.
+        """
+        return {
+            name: self.__block_measurement(module, configurations)[0]
+            for name, module, configurations in self.__blocks
+        }
+
+    def plan(self, budget: int) -> set[nn.Module]:
+        """
+        Returns the blocks that need to be checkpointed, so their remaining activations fit into the budget.
+
+        Args:
+            budget: the activation memory in bytes that all blocks together may use
+        """
+        blocks = [
+            (name, module, *self.__block_measurement(module, configurations))
+            for name, module, configurations in self.__blocks
+        ]
+
+        total_bytes = sum(block[2] for block in blocks)
+        blocks.sort(key=lambda block: block[2] / max(block[3], 1e-9), reverse=True)
+
+        checkpointed = set()
+        remaining_bytes = total_bytes
+        for name, module, activation_bytes, forward_time in blocks:
+            if remaining_bytes <= budget:
+                break
+            checkpointed.add(module)
+            remaining_bytes -= activation_bytes
+
+        gb = 1024 ** 3
+        print(
+            f"Gradient checkpointing {len(checkpointed)} of {len(blocks)} blocks. Estimated activation memory:"
+            f" {remaining_bytes / gb:.2f}GB of {total_bytes / gb:.2f}GB, budget {budget / gb:.2f}GB"
+        )
+        if remaining_bytes > budget:
+            print("The activations don't fit into the budget, even with all blocks checkpointed")
+
+        return checkpointed
@@ -33,9 +33,9 @@ def __create_basic_transformer_block_forward(orig_module) -> Callable:
     return forward
 
 
-def enable_checkpointing_for_transformer_blocks(orig_module: nn.Module):
+def enable_checkpointing_for_transformer_blocks(orig_module: nn.Module, blocks: set[nn.Module] | None = None):
     for name, child_module in orig_module.named_modules():
-        if isinstance(child_module, BasicTransformerBlock):
+        if isinstance(child_module, BasicTransformerBlock) and (blocks is None or child_module in blocks):
             child_module.forward = __create_basic_transformer_block_forward(child_module)
 
 
@@ -79,9 +79,9 @@ def __create_clip_encoder_layer_forward(orig_module) -> Callable:
     return forward
 
 
-def enable_checkpointing_for_clip_encoder_layers(orig_module: nn.Module):
+def enable_checkpointing_for_clip_encoder_layers(orig_module: nn.Module, blocks: set[nn.Module] | None = None):
     for name, child_module in orig_module.named_modules():
-        if isinstance(child_module, CLIPEncoderLayer):
+        if isinstance(child_module, CLIPEncoderLayer) and (blocks is None or child_module in blocks):
             child_module.forward = __create_clip_encoder_layer_forward(child_module)
 
 def create_checkpointed_unet_forward(orig_module) -> Callable:
@@ -0,0 +1,74 @@
+import torch
+from torch import nn, Tensor
+from torch.nn import Parameter
+
+
+class AdditionalEmbeddingWrapper:
+    orig_module: nn.Embedding
+    vector: Parameter
+    token_ids: Tensor
+    token_rows: Tensor
+
+    def __init__(
+            self,
+            orig_module: nn.Embedding,
+            token_ids: list[int],
+            initial_vector: Tensor,
+            dtype: torch.dtype,
+    ):
+        """
+        Trains the vectors of a few tokens, without training the whole embedding table. The vectors are stored in a
+        separate parameter and replace the rows of their tokens during the forward pass of the frozen table.
+
+        Args:
+            orig_module: the embedding table of the text encoder
+            token_ids: the ids of the trained tokens
+            initial_vector: the initial vectors of the trained tokens, one row per token
+            dtype: the data type of the trained vectors
+        """
+        super(AdditionalEmbeddingWrapper, self).__init__()
+        device = orig_module.weight.device
+
+        self.orig_module = orig_module
+        self.vector = Parameter(initial_vector.detach().to(device=device, dtype=dtype).clone())
+        self.token_ids = torch.tensor(token_ids, dtype=torch.long, device=device)
+
+        # maps every token id to its row in vector, or to -1 for tokens of the original table
+        self.token_rows = torch.full((orig_module.num_embeddings,), -1, dtype=torch.long, device=device)
+        self.token_rows[self.token_ids] = torch.arange(len(token_ids), dtype=torch.long, device=device)
+
+        self.is_applied = False
+        self.orig_forward = self.orig_module.forward
+
+    def forward(self, input_ids: Tensor, *args, **kwargs) -> Tensor:
+        embeds = self.orig_forward(input_ids)
+
+        rows = self.token_rows[input_ids]
+        vectors = self.vector[rows.clamp(min=0)].to(dtype=embeds.dtype)
+
+        return torch.where((rows >= 0).unsqueeze(-1), vectors, embeds)
+
+    def parameters(self) -> list[Parameter]:
+        return [self.vector]
+
+    def requires_grad_(self, requires_grad: bool):
+        self.vector.requires_grad_(requires_grad)
+
+    def to(self, device: torch.device = None) -> 'AdditionalEmbeddingWrapper':
+        # the parameter object is kept, so the optimizer and ema still reference it
+        self.vector.data = self.vector.data.to(device=device)
+        if self.vector.grad is not None:
+            self.vector.grad = self.vector.grad.to(device=device)
+        self.token_ids = self.token_ids.to(device=device)
+        self.token_rows = self.token_rows.to(device=device)
+        return self
+
+    def hook_to_module(self):
+        if not self.is_applied:
+            self.orig_module.forward = self.forward
+            self.is_applied = True
+
+    def remove_hook_from_module(self):
+        if self.is_applied:
+            self.orig_module.forward = self.orig_forward
+            self.is_applied = False
@@ -0,0 +1,142 @@
+import copy
+import os
+
+import torch
+import torch._dynamo
+from torch import nn, Tensor
+
+
+class CompiledForwardWrapper:
+    orig_module: nn.Module
+    shapes: set[tuple]
+
+    def __init__(
+            self,
+            orig_module: nn.Module,
+            cache_dir: str | None = None,
+            max_shapes: int = 32,
+            max_recompilations: int = 4,
+    ):
+        """
+        Compiles the forward function of a module with torch.compile. Every input shape is compiled once, the first
+        time it is used. Aspect ratio buckets only produce a few different shapes, so this is the warm-up of every
+        bucket resolution. The compiled forward is only used while gradients are enabled, sampling and caching call
+        the eager forward.
+
+        The module falls back to the eager forward if it is called with more than max_shapes different shapes, if
+        an already compiled shape is compiled again more than max_recompilations times, or if compilation fails.
+
+        Args:
+            orig_module: the module to compile
+            cache_dir: the compiled kernels are stored in this directory, and are reused in the next run
+            max_shapes: the maximum number of different input shapes
+            max_recompilations: the maximum number of compilations of shapes that were already compiled
+        """
+        super(CompiledForwardWrapper, self).__init__()
+        self.orig_module = orig_module
+        self.cache_dir = cache_dir
+        self.max_shapes = max_shapes
+        self.max_recompilations = max_recompilations
+
+        self.shapes = set()
+        self.compilations = 0
+        self.recompilations = 0
+        self.is_eager = False
+
+        self.is_applied = False
+        self.orig_forward = self.orig_module.forward
+        self.compiled_forward = None
+
+    def __setup_cache(self):
+        if self.cache_dir is not None:
+            os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.join(self.cache_dir, "inductor"))
+            os.environ.setdefault("TRITON_CACHE_DIR", os.path.join(self.cache_dir, "triton"))
+
+        import torch._inductor.config
+        if hasattr(torch._inductor.config, "fx_graph_cache"):
+            torch._inductor.config.fx_graph_cache = True
+
+        # every shape is a separate entry in the cache of dynamo, the guard below decides when to stop compiling
+        torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, self.max_shapes)
+
+    def __backend(self, graph_module: torch.fx.GraphModule, example_inputs: list[Tensor]):
+        from torch._inductor.compile_fx import compile_fx
+
+        self.compilations += 1
+        return compile_fx(graph_module, example_inputs)
+
+    @staticmethod
+    def __shape_key(value) -> tuple:
+        if isinstance(value, Tensor):
+            return 'tensor', tuple(value.shape), value.dtype, value.device, value.requires_grad
+        elif isinstance(value, (list, tuple)):
+            return tuple(CompiledForwardWrapper.__shape_key(x) for x in value)
+        elif isinstance(value, dict):
+            return tuple((key, CompiledForwardWrapper.__shape_key(x)) for key, x in value.items())
+        elif value is None or isinstance(value, (bool, int, float, str)):
+            return 'constant', value
+        else:
+            return 'object', type(value)
+
+    def __disable(self, reason: str):
+        print(f"Disabling compilation of {type(self.orig_module).__name__}, {reason}. Using the eager forward instead")
+        self.is_eager = True
+        self.compiled_forward = None
+
+    def forward(self, *args, **kwargs):
+        if self.is_eager or not torch.is_grad_enabled():
+            return self.orig_forward(*args, **kwargs)
+
+        key = (
+            self.__shape_key(args),
+            self.__shape_key(kwargs),
+            torch.is_autocast_enabled(),
+            torch.get_autocast_gpu_dtype(),
+        )
+        is_new_shape = key not in self.shapes
+        if is_new_shape and len(self.shapes) >= self.max_shapes:
+            self.__disable(f"it was called with more than {self.max_shapes} different input shapes")
+            return self.orig_forward(*args, **kwargs)
+
+        compilations = self.compilations
+        try:
+            output = self.compiled_forward(*args, **kwargs)
+        except torch._dynamo.exc.TorchDynamoException as e:
+            self.__disable(f"compilation failed: {e}")
+            return self.orig_forward(*args, **kwargs)
+
+        if is_new_shape:
+            self.shapes.add(key)
+        elif self.compilations > compilations:
+            self.recompilations += 1
+            if self.recompilations > self.max_recompilations:
+                self.__disable(f"already compiled shapes were compiled again {self.recompilations} times")
+
+        return output
+
+    def __deepcopy__(self, memo):
+        # copies, like the one that is saved, are not compiled and call the eager forward of the copied module
+        orig_module = copy.deepcopy(self.orig_module, memo)
+        wrapper = CompiledForwardWrapper(orig_module, self.cache_dir, self.max_shapes, self.max_recompilations)
+        wrapper.orig_forward = type(orig_module).forward.__get__(orig_module)
+        wrapper.is_eager = True
+        wrapper.is_applied = True
+        return wrapper
+
+    def hook_to_module(self):
+        if self.is_applied:
+            return
+
+        if self.compiled_forward is None and not self.is_eager:
+            self.__setup_cache()
+            self.compiled_forward = torch.compile(self.orig_forward, backend=self.__backend, dynamic=False)
+
+        self.orig_module.forward = self.forward
+        self.is_applied = True
+
+    def remove_hook_from_module(self):
+        if not self.is_applied:
+            return
+
+        self.orig_module.forward = self.orig_forward
+        self.is_applied = False
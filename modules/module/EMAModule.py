@@ -1,3 +1,5 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
 from typing import Iterable
 
 import torch
@@ -10,15 +12,26 @@ class EMAModuleWrapper:
             decay: float = 0.9999,
             update_step_interval: int = 1,
             device: torch.device | None = None,
+            dtype: torch.dtype | None = None,
     ):
         parameters = list(parameters)
-        self.ema_parameters = [p.clone().detach().to(device) for p in parameters]
+        self.ema_parameters = [
+            p.clone().detach().to(device=device, dtype=dtype) if p.is_floating_point() else p.clone().detach().to(device)
+            for p in parameters
+        ]
+        self.ema_compensation = self.__create_compensation() if dtype in [torch.bfloat16, torch.float16] else None
 
         self.temp_stored_parameters = None
 
         self.decay = decay
         self.update_step_interval = update_step_interval
         self.device = device
+        self.dtype = dtype
+        self.use_foreach = hasattr(torch, '_foreach_lerp_')
+
+        # used to swap parameters with ema parameters on a different device
+        self.staging_size = 64 * 1024 * 1024
+        self.staging_buffer = None
 
         # TODO: add an automatic decay calculation based on this formula:
         # The impact of the last n steps can be calculated as:
@@ -28,6 +41,32 @@ class EMAModuleWrapper:
         # The decay needed to reach a specific impact after n steps is:
         #     decay = (1-impact)^(1/n)
 
+    def __create_compensation(self) -> list[torch.Tensor]:
+        return [torch.zeros_like(p, dtype=torch.int8) for p in self.ema_parameters]
+
+    @staticmethod
+    def _compensated_lerp_(
+            ema_parameter: torch.Tensor,
+            compensation: torch.Tensor,
+            target: torch.Tensor,
+            weight: float,
+    ):
+        # The compensation stores the rounding error of a 16 bit ema parameter as a fraction of its ulp, in steps of
+        # 1/256. Together, they keep about 8 bits more precision than the ema parameter alone, so small updates at a
+        # high decay are not rounded away.
+        significand_bits = 8 if ema_parameter.dtype == torch.bfloat16 else 11
+
+        value = ema_parameter.float()
+        ulp = torch.ldexp(torch.ones_like(value), torch.frexp(value).exponent - significand_bits)
+        value.addcmul_(compensation.float(), ulp, value=1 / 256)
+        value.lerp_(target.to(device=value.device, dtype=torch.float32), weight)
+
+        ema_parameter.copy_(value)
+        rounded = ema_parameter.float()
+        ulp = torch.ldexp(torch.ones_like(value), torch.frexp(rounded).exponent - significand_bits)
+        value.sub_(rounded).div_(ulp).mul_(256).round_().clamp_(-128, 127)
+        compensation.copy_(value)
+
     def get_current_decay(self, optimization_step) -> float:
         return min(
             (1 + optimization_step) / (10 + optimization_step),
@@ -36,22 +75,64 @@ class EMAModuleWrapper:
 
     @torch.no_grad()
     def step(self, parameters: Iterable[torch.nn.Parameter], optimization_step):
-        parameters = list(parameters)
-
         one_minus_decay = 1 - self.get_current_decay(optimization_step)
 
         if (optimization_step + 1) % self.update_step_interval == 0:
-            for ema_parameter, parameter in zip(self.ema_parameters, parameters):
-                if parameter.requires_grad:
-                    if ema_parameter.device == parameter.device:
-                        ema_parameter.add_(one_minus_decay * (parameter - ema_parameter))
-                    else:
-                        # in place calculations to save memory
-                        parameter_copy = parameter.detach().to(ema_parameter.device)
-                        parameter_copy.sub_(ema_parameter)
-                        parameter_copy.mul_(one_minus_decay)
-                        ema_parameter.add_(parameter_copy)
-                        del parameter_copy
+            if self.ema_compensation is not None:
+                for ema_parameter, compensation, parameter in zip(
+                        self.ema_parameters, self.ema_compensation, parameters
+                ):
+                    if parameter.requires_grad:
+                        self._compensated_lerp_(ema_parameter, compensation, parameter.detach(), one_minus_decay)
+                return
+
+            parameters = [
+                (ema_parameter, parameter)
+                for ema_parameter, parameter in zip(self.ema_parameters, parameters)
+                if parameter.requires_grad
+            ]
+
+            if self.use_foreach:
+                parameters = self.__step_foreach(parameters, one_minus_decay)
+
+            for ema_parameter, parameter in parameters:
+                if ema_parameter.device == parameter.device:
+                    ema_parameter.add_(one_minus_decay * (parameter - ema_parameter))
+                else:
+                    # in place calculations to save memory
+                    parameter_copy = parameter.detach().to(ema_parameter.device)
+                    parameter_copy.sub_(ema_parameter)
+                    parameter_copy.mul_(one_minus_decay)
+                    ema_parameter.add_(parameter_copy)
+                    del parameter_copy
+
+    def __step_foreach(
+            self,
+            parameters: list[tuple[torch.Tensor, torch.nn.Parameter]],
+            one_minus_decay: float,
+    ) -> list[tuple[torch.Tensor, torch.nn.Parameter]]:
+        # updates all parameters that share a device and dtype with their ema parameter in a few fused calls,
+        # returns the remaining parameters
+        groups = {}
+        remaining = []
+        for ema_parameter, parameter in parameters:
+            if ema_parameter.device == parameter.device and ema_parameter.dtype == parameter.dtype:
+                ema_parameters, group_parameters = groups.setdefault((parameter.device, parameter.dtype), ([], []))
+                ema_parameters.append(ema_parameter)
+                group_parameters.append(parameter.detach())
+            else:
+                remaining.append((ema_parameter, parameter))
+
+        for ema_parameters, group_parameters in groups.values():
+            torch._foreach_lerp_(ema_parameters, group_parameters, one_minus_decay)
+
+        return remaining
+
+    def before_optimizer_step(self) -> None:
+        pass
+
+    def synchronize(self) -> None:
+        pass
 
     def to(self, device: torch.device = None, dtype: torch.dtype = None) -> None:
         self.device = device
@@ -59,28 +140,268 @@ class EMAModuleWrapper:
             p.to(device=device, dtype=dtype) if p.is_floating_point() else p.to(device=device)
             for p in self.ema_parameters
         ]
+        if self.ema_compensation is not None:
+            self.ema_compensation = [c.to(device=device) for c in self.ema_compensation]
 
-    def copy_ema_to(self, parameters: Iterable[torch.nn.Parameter], store_temp: bool = True) -> None:
-        if store_temp:
-            self.temp_stored_parameters = [parameter.detach().cpu() for parameter in parameters]
+    def __staging(self, numel: int, dtype: torch.dtype) -> torch.Tensor:
+        if self.staging_buffer is None:
+            self.staging_buffer = torch.empty(
+                self.staging_size, dtype=torch.uint8, pin_memory=torch.cuda.is_available()
+            )
 
+        element_size = torch.empty(0, dtype=dtype).element_size()
+        return self.staging_buffer[:numel * element_size].view(dtype)
+
+    @torch.no_grad()
+    def __swap_staged(self, ema_parameter: torch.Tensor, parameter: torch.Tensor):
+        # swaps the contents of tensors on different devices in chunks, without a full copy of either
+        ema_parameter = ema_parameter.view(-1)
+        parameter = parameter.view(-1)
+        chunk_size = self.staging_size // parameter.element_size()
+
+        for start in range(0, parameter.numel(), chunk_size):
+            end = min(start + chunk_size, parameter.numel())
+            staging = self.__staging(end - start, parameter.dtype)
+            staging.copy_(ema_parameter[start:end])
+            ema_parameter[start:end].copy_(parameter[start:end])
+            parameter[start:end].copy_(staging)
+
+    def copy_ema_to(self, parameters: Iterable[torch.nn.Parameter], store_temp: bool = True) -> None:
         parameters = list(parameters)
-        for ema_parameter, parameter in zip(self.ema_parameters, parameters):
-            parameter.data.copy_(ema_parameter.to(parameter.device).data)
+
+        if not store_temp:
+            for ema_parameter, parameter in zip(self.ema_parameters, parameters):
+                parameter.data.copy_(ema_parameter.to(parameter.device).data)
+            return
+
+        # The ema parameters and the parameters are swapped, the ema parameters hold the trained values until
+        # copy_temp_to swaps them back. None marks a swapped parameter.
+        self.temp_stored_parameters = []
+        for i, (ema_parameter, parameter) in enumerate(zip(self.ema_parameters, parameters)):
+            swappable = ema_parameter.dtype == parameter.dtype and ema_parameter.shape == parameter.shape
+            if swappable and ema_parameter.device == parameter.device:
+                parameter.data, self.ema_parameters[i] = ema_parameter, parameter.data
+                self.temp_stored_parameters.append(None)
+            elif swappable and ema_parameter.is_contiguous() and parameter.data.is_contiguous():
+                self.__swap_staged(ema_parameter, parameter.data)
+                self.temp_stored_parameters.append(None)
+            else:
+                self.temp_stored_parameters.append(parameter.detach().cpu())
+                parameter.data.copy_(ema_parameter.to(parameter.device).data)
 
     def copy_temp_to(self, parameters: Iterable[torch.nn.Parameter]) -> None:
-        for temp_parameter, parameter in zip(self.temp_stored_parameters, parameters):
-            parameter.data.copy_(temp_parameter.data)
+        parameters = list(parameters)
+
+        for i, (temp_parameter, parameter) in enumerate(zip(self.temp_stored_parameters, parameters)):
+            ema_parameter = self.ema_parameters[i]
+            if temp_parameter is not None:
+                parameter.data.copy_(temp_parameter.data)
+            elif ema_parameter.device == parameter.device:
+                parameter.data, self.ema_parameters[i] = ema_parameter, parameter.data
+            else:
+                self.__swap_staged(ema_parameter, parameter.data)
 
         self.temp_stored_parameters = None
 
     def load_state_dict(self, state_dict: dict) -> None:
         self.decay = self.decay if self.decay else state_dict.get("decay", self.decay)
         self.ema_parameters = state_dict.get("ema_parameters", None)
-        self.to(self.device)
+
+        if self.ema_compensation is not None:
+            # the compensation is only valid for ema parameters of the same dtype
+            compensation = state_dict.get("ema_compensation", None)
+            same_dtype = all(p.dtype == self.dtype for p in self.ema_parameters if p.is_floating_point())
+            self.ema_compensation = compensation if compensation is not None and same_dtype \
+                else self.__create_compensation()
+
+        self.to(self.device, self.dtype)
 
     def state_dict(self) -> dict:
-        return {
+        state_dict = {
             "decay": self.decay,
             "ema_parameters": self.ema_parameters,
         }
+        if self.ema_compensation is not None:
+            state_dict["ema_compensation"] = self.ema_compensation
+        return state_dict
+
+
+class AsyncCpuEMAModuleWrapper(EMAModuleWrapper):
+    """
+    An EMA that is stored on the cpu and updated in the background. On each update, the parameters are copied in
+    chunks into two reusable pinned buffers on a separate cuda stream, while a background thread updates the EMA
+    from the previously copied chunk. The pinned memory is bounded by two chunks.
+
+    Training only waits before the next optimizer step, if the parameters are not yet copied, and when the EMA
+    parameters are read.
+
+    Args:
+        parameters: the trained parameters
+        decay: the EMA decay
+        update_step_interval: the number of optimizer steps between two updates
+        dtype: the data type of the EMA parameters, defaults to the data type of the trained parameters
+        chunk_size: the maximum number of bytes copied in one chunk
+    """
+
+    def __init__(
+            self,
+            parameters: Iterable[torch.nn.Parameter],
+            decay: float = 0.9999,
+            update_step_interval: int = 1,
+            dtype: torch.dtype | None = None,
+            chunk_size: int = 256 * 1024 * 1024,
+    ):
+        super(AsyncCpuEMAModuleWrapper, self).__init__(
+            parameters=parameters,
+            decay=decay,
+            update_step_interval=update_step_interval,
+            device=torch.device("cpu"),
+            dtype=dtype,
+        )
+        self.chunk_size = chunk_size
+
+        self.__executor = ThreadPoolExecutor(max_workers=1)
+        self.__update_future: Future | None = None
+        self.__copies_enqueued = threading.Event()
+        self.__copies_enqueued.set()
+        self.__copy_done_event = None
+
+        self.__stream = None
+        self.__buffers = None
+        self.__chunks = None
+
+    def __create_chunks(self, parameters: list[tuple[torch.Tensor, torch.Tensor | None, torch.nn.Parameter]]):
+        # every chunk is a list of (ema_parameter, compensation, parameter, offset), offsets are aligned for every dtype
+        chunks = [[]]
+        chunk_bytes = 0
+        max_chunk_bytes = 0
+        for ema_parameter, compensation, parameter in parameters:
+            size = parameter.numel() * parameter.element_size()
+            if chunk_bytes > 0 and chunk_bytes + size > self.chunk_size:
+                chunks.append([])
+                chunk_bytes = 0
+
+            chunks[-1].append((ema_parameter, compensation, parameter, chunk_bytes))
+            chunk_bytes += (size + 63) // 64 * 64
+            max_chunk_bytes = max(max_chunk_bytes, chunk_bytes)
+
+        self.__chunks = chunks
+        self.__stream = torch.cuda.Stream()
+        self.__buffers = [torch.empty(max_chunk_bytes, dtype=torch.uint8, pin_memory=True) for _ in range(2)]
+
+    @staticmethod
+    def __staging_view(buffer: torch.Tensor, parameter: torch.Tensor, offset: int) -> torch.Tensor:
+        size = parameter.numel() * parameter.element_size()
+        return buffer[offset:offset + size].view(parameter.dtype).view(parameter.shape)
+
+    def __copy_chunk(self, chunk: list, buffer: torch.Tensor, ready_event: torch.cuda.Event) -> torch.cuda.Event:
+        with torch.cuda.stream(self.__stream):
+            self.__stream.wait_event(ready_event)
+            for ema_parameter, compensation, parameter, offset in chunk:
+                source = parameter.detach()
+                self.__staging_view(buffer, parameter, offset).copy_(source, non_blocking=True)
+                # the parameter can be moved off the device while the copy is still running
+                source.record_stream(self.__stream)
+            copy_event = torch.cuda.Event()
+            copy_event.record(self.__stream)
+        return copy_event
+
+    @torch.no_grad()
+    def __update_chunk(self, chunk: list, buffer: torch.Tensor, copy_event: torch.cuda.Event, weight: float):
+        copy_event.synchronize()
+
+        ema_parameters = []
+        staged_parameters = []
+        for ema_parameter, compensation, parameter, offset in chunk:
+            staged_parameter = self.__staging_view(buffer, parameter, offset)
+            if compensation is not None:
+                self._compensated_lerp_(ema_parameter, compensation, staged_parameter, weight)
+            elif ema_parameter.dtype == staged_parameter.dtype and self.use_foreach:
+                ema_parameters.append(ema_parameter)
+                staged_parameters.append(staged_parameter)
+            else:
+                ema_parameter.lerp_(staged_parameter.to(dtype=ema_parameter.dtype), weight)
+
+        if ema_parameters:
+            torch._foreach_lerp_(ema_parameters, staged_parameters, weight)
+
+    def __update(self, ready_event: torch.cuda.Event, weight: float):
+        try:
+            previous = None
+            for i, chunk in enumerate(self.__chunks):
+                # the buffer of chunk i-2 is free, its update finished in the previous iteration
+                buffer = self.__buffers[i % 2]
+                copy_event = self.__copy_chunk(chunk, buffer, ready_event)
+
+                if previous is not None:
+                    self.__update_chunk(*previous, weight)
+                previous = (chunk, buffer, copy_event)
+
+            self.__copy_done_event = previous[2] if previous is not None else None
+            self.__copies_enqueued.set()
+
+            if previous is not None:
+                self.__update_chunk(*previous, weight)
+        finally:
+            self.__copies_enqueued.set()
+
+    def synchronize(self):
+        if self.__update_future is not None:
+            self.__update_future.result()
+            self.__update_future = None
+
+    def before_optimizer_step(self) -> None:
+        # the optimizer must not change the parameters before they are copied
+        self.__copies_enqueued.wait()
+        if self.__copy_done_event is not None:
+            torch.cuda.current_stream().wait_event(self.__copy_done_event)
+            self.__copy_done_event = None
+
+    @torch.no_grad()
+    def step(self, parameters: Iterable[torch.nn.Parameter], optimization_step):
+        if (optimization_step + 1) % self.update_step_interval != 0:
+            return
+
+        parameters = list(parameters)
+        if any(parameter.device.type != 'cuda' for parameter in parameters):
+            self.synchronize()
+            super(AsyncCpuEMAModuleWrapper, self).step(parameters, optimization_step)
+            return
+
+        compensation = self.ema_compensation if self.ema_compensation is not None else [None] * len(parameters)
+        parameters = [
+            (ema_parameter, compensation, parameter)
+            for ema_parameter, compensation, parameter in zip(self.ema_parameters, compensation, parameters)
+            if parameter.requires_grad
+        ]
+
+        # at most one update is running, the previous one usually finished during the last training step
+        self.synchronize()
+
+        if self.__chunks is None:
+            self.__create_chunks(parameters)
+
+        ready_event = torch.cuda.Event()
+        ready_event.record(torch.cuda.current_stream())
+
+        self.__copies_enqueued.clear()
+        weight = 1 - self.get_current_decay(optimization_step)
+        self.__update_future = self.__executor.submit(self.__update, ready_event, weight)
+
+    def to(self, device: torch.device = None, dtype: torch.dtype = None) -> None:
+        # the EMA stays on the cpu
+        self.synchronize()
+        super(AsyncCpuEMAModuleWrapper, self).to(torch.device("cpu"), dtype)
+        self.__chunks = None
+
+    def copy_ema_to(self, parameters: Iterable[torch.nn.Parameter], store_temp: bool = True) -> None:
+        self.synchronize()
+        super(AsyncCpuEMAModuleWrapper, self).copy_ema_to(parameters, store_temp)
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        self.synchronize()
+        super(AsyncCpuEMAModuleWrapper, self).load_state_dict(state_dict)
+
+    def state_dict(self) -> dict:
+        self.synchronize()
+        return super(AsyncCpuEMAModuleWrapper, self).state_dict()
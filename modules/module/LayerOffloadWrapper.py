@@ -0,0 +1,271 @@
+import torch
+from torch import nn, Tensor
+from torch.nn import Parameter
+
+
+class LayerOffloadWrapper:
+    orig_module: nn.Module
+    device: torch.device
+    blocks: list[nn.Module]
+
+    def __init__(
+            self,
+            orig_module: nn.Module,
+            device: torch.device,
+            block_size: int = 64 * 1024 * 1024,
+    ):
+        """
+        Streams the frozen weights of a module to a device, one block at a time. The weights of every block are stored
+        on the cpu, and are copied to the device just before the block is called. The next block is prefetched on a
+        separate stream. During the backward pass, the weights of a block are loaded again as soon as autograd needs
+        them, and are released once autograd is done with the block. At most the current block and its neighbours are
+        on the device during the forward pass.
+
+        Trained parameters, the parameters that are not part of a block, and all buffers stay on the device.
+
+        Args:
+            orig_module: the module to stream
+            device: the device the module is called on, this can also be the cpu
+            block_size: the maximum size of a block in bytes. Modules are split into their children until every
+                        block fits, or until a module has no more children
+        """
+        super(LayerOffloadWrapper, self).__init__()
+        self.orig_module = orig_module
+        self.device = device
+        self.block_size = block_size
+        self.pin_memory = device.type == 'cuda'
+
+        self.blocks = self.__split(orig_module)
+        self.block_parameters = self.__block_parameters(orig_module, self.blocks)
+        self.parameter_blocks = {
+            id(parameter): index
+            for index, parameters in enumerate(self.block_parameters)
+            for parameter in parameters
+        }
+
+        self.host_tensors: dict[int, Tensor] = {}
+        self.loaded_blocks: dict[int, dict[Parameter, int]] = {}
+        self.prefetched_blocks: dict[int, tuple[torch.cuda.Event, list[tuple[Parameter, Tensor]]]] = {}
+        self.stream = torch.cuda.Stream(device) if device.type == 'cuda' else None
+
+        # the order in which the blocks are called, it is recorded during the first forward pass
+        self.order: list[int] = []
+        self.positions: dict[int, int] = {}
+        self.backward_graph_task_id = -1
+
+        self.is_applied = False
+        self.orig_forward = self.orig_module.forward
+        self.hook_handles = []
+
+    @staticmethod
+    def __size(module: nn.Module) -> int:
+        return sum(p.numel() * p.element_size() for p in module.parameters())
+
+    def __split(self, module: nn.Module) -> list[nn.Module]:
+        children = list(module.children())
+        if self.__size(module) <= self.block_size or not children:
+            return [module] if self.__size(module) > 0 else []
+
+        blocks = []
+        for child in children:
+            blocks += self.__split(child)
+        return blocks
+
+    @staticmethod
+    def __block_parameters(orig_module: nn.Module, blocks: list[nn.Module]) -> list[list[Parameter]]:
+        # parameters that are shared between blocks stay on the device
+        counts = {}
+        for block in blocks:
+            for parameter in block.parameters():
+                counts[id(parameter)] = counts.get(id(parameter), 0) + 1
+
+        # module.device and module.dtype are read from the first parameter, it stays on the device as well
+        first_parameter = next(orig_module.parameters(), None)
+        if first_parameter is not None:
+            counts[id(first_parameter)] = 0
+
+        return [[p for p in block.parameters() if counts[id(p)] == 1] for block in blocks]
+
+    def __resident_parameters(self) -> list[Parameter]:
+        return [p for p in self.orig_module.parameters() if id(p) not in self.parameter_blocks]
+
+    def resident_bytes(self) -> int:
+        parameters = self.__resident_parameters()
+        parameters += [p for p in self.orig_module.parameters() if p.requires_grad and id(p) in self.parameter_blocks]
+        buffers = list(self.orig_module.buffers())
+        return sum(t.numel() * t.element_size() for t in parameters + buffers)
+
+    def __to_host(self, tensor: Tensor) -> Tensor:
+        host_tensor = torch.empty_like(tensor, device="cpu", pin_memory=self.pin_memory)
+        host_tensor.copy_(tensor)
+        return host_tensor
+
+    def __is_on_host(self, parameter: Parameter) -> bool:
+        host_tensor = self.host_tensors.get(id(parameter), None)
+        return host_tensor is not None and parameter.data.data_ptr() == host_tensor.data_ptr()
+
+    def load_block(self, index: int):
+        """
+        Copies the weights of a block to the device, if they are not already there.
+        """
+        if index in self.loaded_blocks:
+            return
+
+        prefetched = self.prefetched_blocks.pop(index, None)
+        if prefetched is not None:
+            event, tensors = prefetched
+            torch.cuda.current_stream(self.device).wait_event(event)
+            for parameter, tensor in tensors:
+                # the tensors were allocated on the prefetch stream, but are used on the current stream
+                tensor.record_stream(torch.cuda.current_stream(self.device))
+                parameter.data = tensor
+        else:
+            for parameter in self.block_parameters[index]:
+                if self.__is_on_host(parameter):
+                    parameter.data = parameter.data.to(self.device, non_blocking=True, copy=True)
+
+        self.loaded_blocks[index] = {parameter: parameter._version for parameter in self.block_parameters[index]}
+
+    def prefetch_block(self, index: int):
+        if self.stream is None or index in self.loaded_blocks or index in self.prefetched_blocks:
+            return
+
+        self.stream.wait_stream(torch.cuda.current_stream(self.device))
+        with torch.cuda.stream(self.stream):
+            tensors = [
+                (parameter, parameter.data.to(self.device, non_blocking=True, copy=True))
+                for parameter in self.block_parameters[index]
+                if self.__is_on_host(parameter)
+            ]
+            event = torch.cuda.Event()
+            event.record(self.stream)
+        self.prefetched_blocks[index] = (event, tensors)
+
+    def release_block(self, index: int):
+        """
+        Frees the device memory of a block. Frozen weights that were changed on the device are copied back first.
+        """
+        loaded_parameters = self.loaded_blocks.pop(index, None)
+        if loaded_parameters is None:
+            return
+
+        for parameter, version in loaded_parameters.items():
+            if parameter.requires_grad:
+                # trained parameters stay on the device, the host copy is outdated
+                self.host_tensors.pop(id(parameter), None)
+                continue
+
+            if parameter._version != version or id(parameter) not in self.host_tensors:
+                self.host_tensors[id(parameter)] = self.__to_host(parameter.data)
+            parameter.data = self.host_tensors[id(parameter)]
+
+    def release_all(self):
+        for index in list(self.loaded_blocks.keys()):
+            self.release_block(index)
+        for event, _ in self.prefetched_blocks.values():
+            event.synchronize()
+        self.prefetched_blocks.clear()
+
+    def __use_block(self, index: int, direction: int):
+        if not self.is_applied:
+            return
+
+        if index not in self.positions:
+            self.positions[index] = len(self.order)
+            self.order.append(index)
+        position = self.positions[index]
+
+        self.load_block(index)
+
+        graph_task_id = torch._C._current_graph_task_id()
+        if graph_task_id == -1:
+            for loaded_index in list(self.loaded_blocks.keys()):
+                if abs(self.positions.get(loaded_index, -2) - position) > 1:
+                    self.release_block(loaded_index)
+        else:
+            # checkpointed blocks are recomputed during the backward pass, and the recomputed graph still refers to
+            # the weights of the blocks before the current one. Autograd runs the blocks in reverse order, so only
+            # the blocks after the current one are finished. The remaining blocks are released after the backward pass
+            for loaded_index in list(self.loaded_blocks.keys()):
+                if self.positions.get(loaded_index, -2) > position + 1:
+                    self.release_block(loaded_index)
+
+            if self.backward_graph_task_id != graph_task_id:
+                self.backward_graph_task_id = graph_task_id
+                torch.autograd.Variable._execution_engine.queue_callback(self.release_all)
+
+        next_position = position + direction
+        if 0 <= next_position < len(self.order) and len(self.order) == len(self.blocks):
+            self.prefetch_block(self.order[next_position])
+
+    def __before_block(self, index: int):
+        def hook(module: nn.Module, args):
+            self.__use_block(index, 1)
+        return hook
+
+    def __pack(self, tensor: Tensor):
+        index = self.parameter_blocks.get(id(tensor), None)
+        if index is None:
+            return tensor
+        return index, tensor
+
+    def __unpack(self, packed):
+        if isinstance(packed, tuple):
+            index, parameter = packed
+            self.__use_block(index, -1)
+            return parameter
+        return packed
+
+    def forward(self, *args, **kwargs):
+        with torch.autograd.graph.saved_tensors_hooks(self.__pack, self.__unpack):
+            output = self.orig_forward(*args, **kwargs)
+
+        # blocks that were never called are added to the end of the order
+        for index in range(len(self.blocks)):
+            if index not in self.positions:
+                self.positions[index] = len(self.order)
+                self.order.append(index)
+
+        # the backward pass loads the weights again when they are needed
+        self.release_all()
+        return output
+
+    def hook_to_module(self):
+        if self.is_applied:
+            return
+
+        for parameter in self.__resident_parameters():
+            parameter.data = parameter.data.to(self.device)
+
+        for index, parameters in enumerate(self.block_parameters):
+            for parameter in parameters:
+                if parameter.requires_grad:
+                    parameter.data = parameter.data.to(self.device)
+                    continue
+
+                if parameter.device.type != 'cpu' or (self.pin_memory and not parameter.is_pinned()):
+                    parameter.data = self.__to_host(parameter.data)
+                self.host_tensors[id(parameter)] = parameter.data
+
+        for module in self.orig_module.modules():
+            for key, buffer in module._buffers.items():
+                if buffer is not None:
+                    module._buffers[key] = buffer.to(self.device)
+
+        self.hook_handles = [
+            block.register_forward_pre_hook(self.__before_block(index))
+            for index, block in enumerate(self.blocks)
+        ]
+        self.orig_module.forward = self.forward
+        self.is_applied = True
+
+    def remove_hook_from_module(self):
+        if not self.is_applied:
+            return
+
+        self.release_all()
+        for handle in self.hook_handles:
+            handle.remove()
+        self.hook_handles = []
+        self.orig_module.forward = self.orig_forward
+        self.is_applied = False
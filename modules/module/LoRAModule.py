@@ -5,6 +5,9 @@ import torch
 from torch import nn, Tensor
 from torch.nn import Linear, Conv2d, Parameter
 
+from modules.util import lora_util
+from modules.util.quantization_util import is_quantized, dequantized_weight
+
 
 class LoRAModule(metaclass=ABCMeta):
     prefix: str
@@ -24,6 +27,9 @@ class LoRAModule(metaclass=ABCMeta):
         self.alpha.requires_grad_(False)
 
         self.is_applied = False
+        self.is_merged = False
+        self.was_applied = False
+        self.merge_backup = None
         self.orig_forward = self.orig_module.forward if self.orig_module is not None else None
 
     def forward(self, x, *args, **kwargs):
@@ -71,13 +77,84 @@ class LoRAModule(metaclass=ABCMeta):
             self.orig_module.forward = self.orig_forward
             self.is_applied = False
 
+    def delta_weight(self) -> Tensor:
+        weight = self.orig_module.weight
+        down = self.lora_down.weight.to(device=weight.device, dtype=torch.float32)
+        up = self.lora_up.weight.to(device=weight.device, dtype=torch.float32)
+        scale = self.alpha.item() / self.rank
+
+        delta = (up.flatten(start_dim=1) @ down.flatten(start_dim=1)) * scale
+
+        if weight.dim() == 4:
+            # the 1x1 convolution of the LoRA only contributes to the center of bigger kernels
+            kernel_delta = torch.zeros(weight.shape, device=weight.device, dtype=torch.float32)
+            kernel_delta[:, :, weight.shape[2] // 2, weight.shape[3] // 2] = delta
+            delta = kernel_delta
+
+        return delta
+
+    @torch.no_grad()
+    def merge_into_module(self, strict: bool = False):
+        if self.is_merged:
+            return
+
+        if is_quantized(self.orig_module):
+            if strict:
+                raise Exception("can't merge a LoRA into quantized weights: " + self.prefix)
+            # quantized weights can't hold the lora, it stays hooked into the module instead
+            return
+
+        self.was_applied = self.is_applied
+        self.remove_hook_from_module()
+
+        weight = self.orig_module.weight
+        # the original weight is kept on its device in its own data type, restoring it is exact and doesn't need a
+        # round trip through host memory
+        self.merge_backup = weight.data.clone()
+        weight.data.add_(self.delta_weight().to(dtype=weight.dtype))
+
+        self.is_merged = True
+
+    @torch.no_grad()
+    def unmerge_from_module(self):
+        if not self.is_merged:
+            return
+
+        self.orig_module.weight.data.copy_(self.merge_backup)
+        self.merge_backup = None
+        self.is_merged = False
+
+        if self.was_applied:
+            self.hook_to_module()
+
+    @torch.no_grad()
     def apply_to_module(self):
-        # TODO
-        pass
+        if is_quantized(self.orig_module):
+            raise Exception("can't apply a LoRA to quantized weights: " + self.prefix)
+
+        self.unmerge_from_module()
+        self.remove_hook_from_module()
 
+        weight = self.orig_module.weight
+        weight.data.add_(self.delta_weight().to(dtype=weight.dtype))
+
+    @torch.no_grad()
     def extract_from_module(self, base_module: nn.Module):
-        # TODO
-        pass
+        weight = dequantized_weight(self.orig_module, torch.float32)
+        delta = weight - dequantized_weight(base_module, torch.float32).to(device=weight.device)
+        if delta.dim() == 4:
+            # the 1x1 convolution of the LoRA can only represent the center of bigger kernels
+            delta = delta[:, :, delta.shape[2] // 2, delta.shape[3] // 2]
+
+        up, down = lora_util.factorize(delta, self.rank)
+
+        # cancel the alpha / rank scale of the forward pass
+        scale = (self.rank / self.alpha.item()) ** 0.5
+        up = torch.nn.functional.pad(up * scale, (0, self.rank - up.shape[1]))
+        down = torch.nn.functional.pad(down * scale, (0, 0, 0, self.rank - down.shape[0]))
+
+        self.lora_up.weight.copy_(up.reshape(self.lora_up.weight.shape))
+        self.lora_down.weight.copy_(down.reshape(self.lora_down.weight.shape))
 
 
 class LinearLoRAModule(LoRAModule):
@@ -140,6 +217,12 @@ class DummyLoRAModule(LoRAModule):
     def remove_hook_from_module(self):
         pass
 
+    def merge_into_module(self, strict: bool = False):
+        pass
+
+    def unmerge_from_module(self):
+        pass
+
     def apply_to_module(self):
         pass
 
@@ -245,9 +328,28 @@ class LoRAModuleWrapper:
         for name, module in self.modules.items():
             module.remove_hook_from_module()
 
+    def merge_into_module(self, strict: bool = False):
+        """
+        Adds the LoRA to the weights of the module. Until unmerge_from_module is called, the module runs at the speed
+        of the base module. The original weights are backed up on their device.
+
+        Args:
+            strict: raise an exception for quantized layers, instead of keeping their LoRA hooked into the module
+        """
+        for name, module in self.modules.items():
+            module.merge_into_module(strict)
+
+    def unmerge_from_module(self):
+        """
+        Restores the original weights of the module after merge_into_module, and hooks the LoRA into the module again
+        if it was hooked before
+        """
+        for name, module in self.modules.items():
+            module.unmerge_from_module()
+
     def apply_to_module(self):
         """
-        Applys the LoRA to the module, changing its weights
+        Applys the LoRA to the module, changing its weights permanently
         """
         for name, module in self.modules.items():
             module.apply_to_module()
@@ -257,7 +359,8 @@ class LoRAModuleWrapper:
         Creates a LoRA from the difference between the base_module and the orig_module
         """
         for name, module in self.modules.items():
-            module.extract_from_module(base_module)
+            if not isinstance(module, DummyLoRAModule):
+                module.extract_from_module(base_module.get_submodule(name))
 
     def prune(self):
         """
@@ -4,7 +4,7 @@ import shutil
 import subprocess
 import sys
 import traceback
-from contextlib import nullcontext
+from contextlib import nullcontext, contextmanager
 from datetime import datetime
 from pathlib import Path
 from typing import Callable
@@ -27,6 +27,8 @@ from modules.modelSaver.BaseModelSaver import BaseModelSaver
 from modules.modelSetup.BaseModelSetup import BaseModelSetup
 from modules.trainer.BaseTrainer import BaseTrainer
 from modules.util import path_util, create
+from modules.util.FusedBackwardStep import FusedBackwardStep
+from modules.util.StochasticRoundingStep import StochasticRoundingStep
 from modules.util.TrainProgress import TrainProgress
 from modules.util.args.TrainArgs import TrainArgs
 from modules.util.callbacks.TrainCallbacks import TrainCallbacks
@@ -78,6 +80,7 @@ class GenericTrainer(BaseTrainer):
                 ]
             )
         self.one_step_trained = False
+        self.streaming_epoch = False
 
     def start(self):
         if self.args.clear_cache_before_training and self.args.latent_caching:
@@ -87,6 +90,8 @@ class GenericTrainer(BaseTrainer):
             torch.backends.cuda.matmul.allow_tf32 = True
             torch.backends.cudnn.allow_tf32 = True
 
+        self.__check_quantized_weights()
+
         self.model_loader = self.create_model_loader()
         self.model_setup = self.create_model_setup()
 
@@ -117,10 +122,16 @@ class GenericTrainer(BaseTrainer):
             weight_dtypes=self.args.weight_dtypes(),
         )
 
+        self.model.residency.set_budget(self.train_device, int(self.args.resident_memory_budget * 1024 ** 3))
+        self.model.residency.set_pinned_offload(self.args.pinned_offload and self.train_device.type == 'cuda')
+        if self.args.layer_offload:
+            self.model.residency.set_layer_offload(self.model.layer_offload_components())
+
         self.callbacks.on_update_status("running model setup")
 
         self.model_setup.setup_train_device(self.model, self.args)
         self.model_setup.setup_model(self.model, self.args)
+        self.model.residency.set_ema(self.model.ema)
         self.model.to(self.temp_device)
         self.model.eval()
         torch_gc()
@@ -138,6 +149,48 @@ class GenericTrainer(BaseTrainer):
 
         self.parameters = list(self.model_setup.create_parameters(self.model, self.args))
 
+    def __check_quantized_weights(self):
+        # quantized weights are frozen, they can only be used for the parts of the model that are not trained
+        if any(dtype.is_quantized() for dtype in self.args.trainable_weight_dtypes()):
+            raise Exception("quantized weights can't be fine tuned, use a LoRA or an embedding, or a different weight data type")
+
+    def __create_stochastic_rounding(self) -> StochasticRoundingStep | None:
+        if self.args.training_method in [TrainingMethod.LORA, TrainingMethod.EMBEDDING]:
+            # all trained weights are created by the model setup, with the same data type
+            if any(dtype.stochastic_rounding() for dtype in self.args.trainable_weight_dtypes()):
+                parameters = self.parameters
+            else:
+                parameters = []
+        else:
+            # the parameters of fine tuned components are marked by the model loader
+            parameters = [p for p in self.parameters if getattr(p, 'stochastic_rounding', False)]
+
+        if not parameters:
+            return None
+        return StochasticRoundingStep(self.model.optimizer, parameters)
+
+    def __create_fused_back_pass(
+            self,
+            scaler: GradScaler | None,
+            stochastic_rounding: StochasticRoundingStep | None,
+    ) -> FusedBackwardStep | None:
+        if not self.args.fused_back_pass:
+            return None
+
+        if self.args.gradient_accumulation_steps != 1:
+            print("Fused back pass disabled, it can't be used with gradient accumulation")
+            return None
+        if scaler is not None:
+            print("Fused back pass disabled, it can't be used with loss scaling")
+            return None
+        if not self.args.optimizer.supports_fused_back_pass():
+            print(f"Fused back pass disabled, it can't be used with the {self.args.optimizer} optimizer")
+            return None
+
+        fused_back_pass = FusedBackwardStep(self.model.optimizer, max_norm=1, stochastic_rounding=stochastic_rounding)
+        fused_back_pass.register()
+        return fused_back_pass
+
     def __clear_cache(self):
         print(
             f'Clearing cache directory {self.args.cache_dir}! '
@@ -146,7 +199,7 @@ class GenericTrainer(BaseTrainer):
         if os.path.isdir(self.args.cache_dir):
             for filename in os.listdir(self.args.cache_dir):
                 path = os.path.join(self.args.cache_dir, filename)
-                if os.path.isdir(path) and (filename.startswith('epoch-') or filename in ['image', 'text']):
+                if os.path.isdir(path) and (filename.startswith('epoch-') or filename in ['image', 'text', 'image-streaming', 'text-streaming']):
                     shutil.rmtree(path)
 
     def __get_last_backup_dirpath(self):
@@ -182,6 +235,32 @@ class GenericTrainer(BaseTrainer):
 
         return None
 
+    @contextmanager
+    def __streaming_paused(self):
+        if not self.streaming_epoch:
+            yield
+            return
+
+        self.data_loader.pause_streaming()
+        try:
+            yield
+        finally:
+            # sampling and backups move the encoders off the train device
+            self.data_loader.setup_cache_device(self.model, self.train_device, self.temp_device, self.args)
+            self.data_loader.resume_streaming()
+
+    @contextmanager
+    def __lora_merged(self):
+        if not self.args.merge_lora_for_sampling:
+            yield
+            return
+
+        self.model.merge_lora()
+        try:
+            yield
+        finally:
+            self.model.unmerge_lora()
+
     def __enqueue_sample_during_training(self, fun: Callable):
         self.sample_queue.append(fun)
 
@@ -276,27 +355,29 @@ class GenericTrainer(BaseTrainer):
         if self.model.ema:
             self.model.ema.copy_ema_to(self.parameters, store_temp=True)
 
-        self.__sample_loop(
-            train_progress=train_progress,
-            train_device=train_device,
-            sample_params_list=sample_params_list,
-            image_format=self.args.sample_image_format,
-            is_custom_sample=is_custom_sample,
-        )
-
-        if self.model.ema:
-            self.model.ema.copy_temp_to(self.parameters)
-
-        # ema-less sampling, if an ema model exists
-        if self.model.ema and not is_custom_sample:
+        with self.__lora_merged():
             self.__sample_loop(
                 train_progress=train_progress,
                 train_device=train_device,
                 sample_params_list=sample_params_list,
                 image_format=self.args.sample_image_format,
-                folder_postfix=" - no-ema",
+                is_custom_sample=is_custom_sample,
             )
 
+        if self.model.ema:
+            self.model.ema.copy_temp_to(self.parameters)
+
+        # ema-less sampling, if an ema model exists
+        if self.model.ema and not is_custom_sample:
+            with self.__lora_merged():
+                self.__sample_loop(
+                    train_progress=train_progress,
+                    train_device=train_device,
+                    sample_params_list=sample_params_list,
+                    image_format=self.args.sample_image_format,
+                    folder_postfix=" - no-ema",
+                )
+
         self.model_setup.setup_train_device(self.model, self.args)
 
         torch_gc()
@@ -390,6 +471,29 @@ class GenericTrainer(BaseTrainer):
 
         torch_gc()
 
+    def __bake_lora(self):
+        self.callbacks.on_update_status("baking the LoRA into the base model")
+
+        output_model_format = self.args.output_model_format
+        if output_model_format == ModelFormat.INTERNAL:
+            output_model_format = ModelFormat.DIFFUSERS
+
+        bake_path = os.path.splitext(self.args.output_model_destination)[0] \
+                    + "-baked" + output_model_format.file_extension()
+        print("Saving baked model " + bake_path)
+
+        try:
+            self.model_saver.bake(
+                model=self.model,
+                model_type=self.args.model_type,
+                output_model_format=output_model_format,
+                output_model_destination=bake_path,
+                dtype=self.args.output_dtype.torch_dtype()
+            )
+        except:
+            traceback.print_exc()
+            print("Could not save the baked model")
+
     def __needs_sample(self, train_progress: TrainProgress):
         return self.action_needed("sample", self.args.sample_after, self.args.sample_after_unit, train_progress)
 
@@ -449,6 +553,9 @@ class GenericTrainer(BaseTrainer):
         else:
             scaler = None
 
+        stochastic_rounding = self.__create_stochastic_rounding()
+        fused_back_pass = self.__create_fused_back_pass(scaler, stochastic_rounding)
+
         # False if the model gradients are all None, True otherwise
         # This is used to schedule sampling only when the gradients don't take up any space
         has_gradient = False
@@ -458,14 +565,23 @@ class GenericTrainer(BaseTrainer):
         for epoch in tqdm(range(train_progress.epoch, self.args.epochs, 1), desc="epoch"):
             self.callbacks.on_update_status("starting epoch/caching")
 
+            self.streaming_epoch = False
             if self.data_loader.needs_setup_cache_device(train_progress, self.args):
-                self.model.to(self.temp_device)
-                self.data_loader.setup_cache_device(self.model, self.train_device, self.temp_device, self.args)
+                with self.model.residency.phase("caching"):
+                    self.model.to(self.temp_device)
+                    self.data_loader.setup_cache_device(self.model, self.train_device, self.temp_device, self.args)
                 self.model.eval()
                 torch_gc()
 
+                if self.args.streaming_caching_enabled():
+                    # the cache is filled during training, so the encoders need to stay on the train device
+                    self.model_setup.setup_train_device(self.model, self.args)
+                    self.data_loader.setup_cache_device(self.model, self.train_device, self.temp_device, self.args)
+                    self.streaming_epoch = True
+
             self.data_loader.get_data_set().start_next_epoch()
-            self.model_setup.setup_train_device(self.model, self.args)
+            if not self.streaming_epoch:
+                self.model_setup.setup_train_device(self.model, self.args)
             torch_gc()
 
             current_epoch_length = len(self.data_loader.get_data_loader()) + train_progress.epoch_step
@@ -486,13 +602,16 @@ class GenericTrainer(BaseTrainer):
                     torch_gc()
 
                 if not has_gradient:
-                    self.__execute_sample_during_training()
+                    with self.__streaming_paused(), self.model.residency.phase("sampling"):
+                        self.__execute_sample_during_training()
 
                 if self.__needs_backup(train_progress) or self.commands.get_and_reset_backup_command():
-                    self.backup()
+                    with self.__streaming_paused(), self.model.residency.phase("backup"):
+                        self.backup()
 
                 if self.__needs_save(train_progress):
-                    self.save(train_progress)
+                    with self.__streaming_paused(), self.model.residency.phase("save"):
+                        self.save(train_progress)
 
                 self.callbacks.on_update_status("training")
 
@@ -507,22 +626,37 @@ class GenericTrainer(BaseTrainer):
                     loss = self.model_setup.calculate_loss(self.model, batch, model_output_data, self.args)
 
                 loss = loss / self.args.gradient_accumulation_steps
+                if fused_back_pass and self.model.ema:
+                    # the parameters are updated during the backward pass
+                    self.model.ema.before_optimizer_step()
+
                 if scaler:
                     scaler.scale(loss).backward()
                 else:
                     loss.backward()
                 has_gradient = True
+
+                if fused_back_pass:
+                    fused_back_pass.finish_step()
                 accumulated_loss += loss.item()
 
                 if self.__is_update_step(train_progress):
-                    if scaler:
-                        scaler.unscale_(self.model.optimizer)
-                        nn.utils.clip_grad_norm_(self.parameters, 1)
-                        scaler.step(self.model.optimizer)
-                        scaler.update()
-                    else:
-                        nn.utils.clip_grad_norm_(self.parameters, 1)
-                        self.model.optimizer.step()
+                    # with a fused back pass, the optimizer step already happened during the backward pass
+                    if not fused_back_pass:
+                        if self.model.ema:
+                            self.model.ema.before_optimizer_step()
+
+                        if scaler:
+                            scaler.unscale_(self.model.optimizer)
+                            nn.utils.clip_grad_norm_(self.parameters, 1)
+                            scaler.step(self.model.optimizer)
+                            scaler.update()
+                        else:
+                            nn.utils.clip_grad_norm_(self.parameters, 1)
+                            if stochastic_rounding:
+                                stochastic_rounding.step()
+                            else:
+                                self.model.optimizer.step()
 
                     self.model.optimizer.zero_grad(set_to_none=True)
                     has_gradient = False
@@ -532,6 +666,12 @@ class GenericTrainer(BaseTrainer):
                         "learning_rate", lr_scheduler.get_last_lr()[0], train_progress.global_step
                     )
                     self.tensorboard.add_scalar("loss", accumulated_loss, train_progress.global_step)
+                    for metric_name, metric_value in self.data_loader.get_metrics().items():
+                        self.tensorboard.add_scalar(metric_name, metric_value, train_progress.global_step)
+                    for phase_name, bytes_moved in self.model.residency.pop_bytes_moved().items():
+                        self.tensorboard.add_scalar(
+                            f"moved_mb/{phase_name}", bytes_moved / 1024 ** 2, train_progress.global_step
+                        )
                     ema_loss = ema_loss or accumulated_loss
                     ema_loss = (ema_loss * 0.99) + (accumulated_loss * 0.01)
                     step_tqdm.set_postfix({
@@ -567,6 +707,11 @@ class GenericTrainer(BaseTrainer):
                 return
 
     def end(self):
+        if self.streaming_epoch:
+            # stop filling the cache, the encoders are moved while saving
+            self.data_loader.pause_streaming()
+            self.streaming_epoch = False
+
         if self.one_step_trained:
             if self.args.backup_before_save:
                 self.backup()
@@ -584,6 +729,9 @@ class GenericTrainer(BaseTrainer):
                 dtype=self.args.output_dtype.torch_dtype()
             )
 
+            if self.args.bake_lora and self.args.training_method == TrainingMethod.LORA:
+                self.__bake_lora()
+
         self.tensorboard.close()
 
         if self.args.tensorboard:
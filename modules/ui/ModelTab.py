@@ -103,6 +103,7 @@ class ModelTab:
         components.options_kv(self.scroll_frame, row, 4, [
             ("float32", DataType.FLOAT_32),
             ("bfloat16", DataType.BFLOAT_16),
+            ("bfloat16 stochastic", DataType.BFLOAT_16_STOCHASTIC),
             ("float16", DataType.FLOAT_16),
         ], self.ui_state, "weight_dtype")
 
@@ -136,11 +137,21 @@ class ModelTab:
                 ("", DataType.NONE),
                 ("float32", DataType.FLOAT_32),
                 ("bfloat16", DataType.BFLOAT_16),
+                ("bfloat16 stochastic", DataType.BFLOAT_16_STOCHASTIC),
                 ("float16", DataType.FLOAT_16),
+                ("int8", DataType.INT_8),
+                ("nfloat4", DataType.NFLOAT_4),
             ], self.ui_state, "unet_weight_dtype")
 
             row += 1
 
+            # unet channels last
+            components.label(self.scroll_frame, row, 3, "UNet Channels Last",
+                             tooltip="Stores the convolution weights and inputs of the unet in the channels last memory format. Many convolutions are faster in this format")
+            components.switch(self.scroll_frame, row, 4, self.ui_state, "unet_channels_last")
+
+            row += 1
+
         if has_prior:
             # prior weight dtype
             components.label(self.scroll_frame, row, 3, "Override Prior Data Type",
@@ -149,7 +160,10 @@ class ModelTab:
                 ("", DataType.NONE),
                 ("float32", DataType.FLOAT_32),
                 ("bfloat16", DataType.BFLOAT_16),
+                ("bfloat16 stochastic", DataType.BFLOAT_16_STOCHASTIC),
                 ("float16", DataType.FLOAT_16),
+                ("int8", DataType.INT_8),
+                ("nfloat4", DataType.NFLOAT_4),
             ], self.ui_state, "prior_weight_dtype")
 
             row += 1
@@ -162,7 +176,10 @@ class ModelTab:
                 ("", DataType.NONE),
                 ("float32", DataType.FLOAT_32),
                 ("bfloat16", DataType.BFLOAT_16),
+                ("bfloat16 stochastic", DataType.BFLOAT_16_STOCHASTIC),
                 ("float16", DataType.FLOAT_16),
+                ("int8", DataType.INT_8),
+                ("nfloat4", DataType.NFLOAT_4),
             ], self.ui_state, "text_encoder_weight_dtype")
 
             row += 1
@@ -175,7 +192,10 @@ class ModelTab:
                 ("", DataType.NONE),
                 ("float32", DataType.FLOAT_32),
                 ("bfloat16", DataType.BFLOAT_16),
+                ("bfloat16 stochastic", DataType.BFLOAT_16_STOCHASTIC),
                 ("float16", DataType.FLOAT_16),
+                ("int8", DataType.INT_8),
+                ("nfloat4", DataType.NFLOAT_4),
             ], self.ui_state, "text_encoder_weight_dtype")
 
             row += 1
@@ -188,7 +208,10 @@ class ModelTab:
                 ("", DataType.NONE),
                 ("float32", DataType.FLOAT_32),
                 ("bfloat16", DataType.BFLOAT_16),
+                ("bfloat16 stochastic", DataType.BFLOAT_16_STOCHASTIC),
                 ("float16", DataType.FLOAT_16),
+                ("int8", DataType.INT_8),
+                ("nfloat4", DataType.NFLOAT_4),
             ], self.ui_state, "text_encoder_2_weight_dtype")
 
             row += 1
@@ -201,11 +224,21 @@ class ModelTab:
                 ("", DataType.NONE),
                 ("float32", DataType.FLOAT_32),
                 ("bfloat16", DataType.BFLOAT_16),
+                ("bfloat16 stochastic", DataType.BFLOAT_16_STOCHASTIC),
                 ("float16", DataType.FLOAT_16),
+                ("int8", DataType.INT_8),
+                ("nfloat4", DataType.NFLOAT_4),
             ], self.ui_state, "vae_weight_dtype")
 
             row += 1
 
+            # vae channels last
+            components.label(self.scroll_frame, row, 3, "VAE Channels Last",
+                             tooltip="Stores the convolution weights and inputs of the vae in the channels last memory format. Many convolutions are faster in this format")
+            components.switch(self.scroll_frame, row, 4, self.ui_state, "vae_channels_last")
+
+            row += 1
+
         return row
 
     def __create_effnet_encoder_components(self, row: int):
@@ -225,10 +258,19 @@ class ModelTab:
             ("float32", DataType.FLOAT_32),
             ("bfloat16", DataType.BFLOAT_16),
             ("float16", DataType.FLOAT_16),
+            ("int8", DataType.INT_8),
+            ("nfloat4", DataType.NFLOAT_4),
         ], self.ui_state, "effnet_encoder_weight_dtype")
 
         row += 1
 
+        # effnet encoder channels last
+        components.label(self.scroll_frame, row, 3, "Effnet Encoder Channels Last",
+                         tooltip="Stores the convolution weights and inputs of the effnet encoder in the channels last memory format. Many convolutions are faster in this format")
+        components.switch(self.scroll_frame, row, 4, self.ui_state, "effnet_encoder_channels_last")
+
+        row += 1
+
         return row
 
     def __create_decoder_components(self, row: int) -> int:
@@ -248,10 +290,19 @@ class ModelTab:
             ("float32", DataType.FLOAT_32),
             ("bfloat16", DataType.BFLOAT_16),
             ("float16", DataType.FLOAT_16),
+            ("int8", DataType.INT_8),
+            ("nfloat4", DataType.NFLOAT_4),
         ], self.ui_state, "decoder_weight_dtype")
 
         row += 1
 
+        # decoder channels last
+        components.label(self.scroll_frame, row, 3, "Decoder Channels Last",
+                         tooltip="Stores the convolution weights and inputs of the decoder in the channels last memory format. Many convolutions are faster in this format")
+        components.switch(self.scroll_frame, row, 4, self.ui_state, "decoder_channels_last")
+
+        row += 1
+
         # decoder text encoder weight dtype
         components.label(self.scroll_frame, row, 3, "Override Decoder Text Encoder Data Type",
                          tooltip="Overrides the decoder text encoder weight data type")
@@ -260,6 +311,8 @@ class ModelTab:
             ("float32", DataType.FLOAT_32),
             ("bfloat16", DataType.BFLOAT_16),
             ("float16", DataType.FLOAT_16),
+            ("int8", DataType.INT_8),
+            ("nfloat4", DataType.NFLOAT_4),
         ], self.ui_state, "decoder_text_encoder_weight_dtype")
 
         row += 1
@@ -272,6 +325,8 @@ class ModelTab:
             ("float32", DataType.FLOAT_32),
             ("bfloat16", DataType.BFLOAT_16),
             ("float16", DataType.FLOAT_16),
+            ("int8", DataType.INT_8),
+            ("nfloat4", DataType.NFLOAT_4),
         ], self.ui_state, "decoder_vqgan_weight_dtype")
 
         row += 1
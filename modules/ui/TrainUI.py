@@ -203,6 +203,56 @@ class TrainUI(ctk.CTk):
                          tooltip="Clears the cache directory before starting to train. Only disable this if you want to continue using the same cached data. Disabling this can lead to errors, if other settings are changed during a restart")
         components.switch(master, 5, 1, self.ui_state, "clear_cache_before_training")
 
+        # batched augmentation
+        components.label(master, 0, 3, "Batched Augmentation",
+                         tooltip="Applies the image augmentations of each concept in batches on the train device instead of per sample on the CPU. This speeds up caching")
+        components.switch(master, 0, 4, self.ui_state, "batched_augmentation")
+
+        # batched augmentation chunk size
+        components.label(master, 1, 3, "Batched Augmentation Chunk Size",
+                         tooltip="The number of samples that are loaded and augmented together if batched augmentation is enabled")
+        components.entry(master, 1, 4, self.ui_state, "batched_augmentation_chunk_size")
+
+        # latent augmentation
+        components.label(master, 2, 3, "Latent Augmentation",
+                         tooltip="Applies random flip and crop jitter to the cached latents instead of the images. Each image is only cached once, regardless of the latent caching epochs. Only supported for Stable Diffusion models")
+        components.switch(master, 2, 4, self.ui_state, "latent_augmentation")
+
+        # latent augmentation crop margin
+        components.label(master, 3, 3, "Latent Augmentation Crop Margin",
+                         tooltip="The number of additional pixels cached in each direction to apply crop jitter in latent space")
+        components.entry(master, 3, 4, self.ui_state, "latent_augmentation_crop_margin")
+
+        # tag shuffling variants
+        components.label(master, 4, 3, "Tag Shuffling Variants",
+                         tooltip="The number of shuffled caption variants that are encoded and cached once. If greater than 1, a random variant is selected in each epoch instead of caching the text for every epoch")
+        components.entry(master, 4, 4, self.ui_state, "tag_shuffling_variants")
+
+        # ram cache max size
+        components.label(master, 5, 3, "RAM Cache Max Size",
+                         tooltip="The maximum size of the RAM cache in GB, used if latent caching is disabled. The least recently used items are evicted. 0 disables the limit")
+        components.entry(master, 5, 4, self.ui_state, "ram_cache_max_size")
+
+        # ram cache spill
+        components.label(master, 6, 3, "RAM Cache Spill",
+                         tooltip="Writes items evicted from the RAM cache to a scratch directory in the cache directory, instead of recalculating them")
+        components.switch(master, 6, 4, self.ui_state, "ram_cache_spill")
+
+        # shared cache
+        components.label(master, 7, 3, "Shared Cache",
+                         tooltip="Uses a latent cache that can be filled and used by several training runs at the same time. The cache is identified by the model, resolution, augmentation and concept settings. It is not removed by clear cache before training")
+        components.switch(master, 7, 4, self.ui_state, "shared_cache")
+
+        # streaming caching
+        components.label(master, 8, 3, "Streaming Caching",
+                         tooltip="Fills the latent cache in the background while training, instead of caching everything before the first step. The encoders stay on the train device until the cache is filled. Batches are not sorted in the exact aspect bucketing order")
+        components.switch(master, 8, 4, self.ui_state, "streaming_caching")
+
+        # streaming caching lookahead
+        components.label(master, 9, 3, "Streaming Caching Lookahead",
+                         tooltip="The maximum number of samples that are cached ahead of training in streaming caching mode")
+        components.entry(master, 9, 4, self.ui_state, "streaming_caching_lookahead")
+
     def create_concepts_tab(self, master):
         ConceptTab(master, self.train_args, self.ui_state)
 
@@ -305,8 +355,19 @@ class TrainUI(ctk.CTk):
         components.options_kv(master, 3, 1, [
             ("float32", DataType.FLOAT_32),
             ("bfloat16", DataType.BFLOAT_16),
+            ("bfloat16 stochastic", DataType.BFLOAT_16_STOCHASTIC),
         ], self.ui_state, "lora_weight_dtype")
 
+        # merge lora for sampling
+        components.label(master, 4, 0, "Merge LoRA for Sampling",
+                         tooltip="Merges the LoRA into the base model weights while sampling. Sampling is as fast as without a LoRA, but a copy of the original weights is kept on the train device while sampling")
+        components.switch(master, 4, 1, self.ui_state, "merge_lora_for_sampling")
+
+        # bake lora
+        components.label(master, 5, 0, "Bake LoRA",
+                         tooltip="Additionally saves the base model with the LoRA merged into its weights when training ends")
+        components.switch(master, 5, 1, self.ui_state, "bake_lora")
+
         return master
 
     def embedding_tab(self, master):
@@ -340,6 +401,7 @@ class TrainUI(ctk.CTk):
         components.options_kv(master, 3, 1, [
             ("float32", DataType.FLOAT_32),
             ("bfloat16", DataType.BFLOAT_16),
+            ("bfloat16 stochastic", DataType.BFLOAT_16_STOCHASTIC),
         ], self.ui_state, "embedding_weight_dtype")
 
         return master
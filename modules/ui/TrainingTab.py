@@ -125,13 +125,18 @@ class TrainingTab:
                          tooltip="Number of accumulation steps. Increase this number to trade batch size for training speed")
         components.entry(frame, 7, 1, self.ui_state, "gradient_accumulation_steps")
 
+        # fused back pass
+        components.label(frame, 8, 0, "Fused Back Pass",
+                         tooltip="Runs the optimizer step of every parameter during the backward pass, and frees its gradient right away. This saves the memory of all gradients, but is only used without accumulation steps and with optimizers that update every parameter on its own")
+        components.switch(frame, 8, 1, self.ui_state, "fused_back_pass")
+
     def __create_base2_frame(self, master, row):
         frame = ctk.CTkFrame(master=master, corner_radius=5)
         frame.grid(row=row, column=0, padx=5, pady=5, sticky="nsew")
 
         # attention mechanism
         components.label(frame, 0, 0, "Attention",
-                         tooltip="The attention mechanism used during training. This has a big effect on speed and memory consumption")
+                         tooltip="The attention mechanism used during training. This has a big effect on speed and memory consumption. AUTO times every available mechanism at startup and selects the fastest one for each model component")
         components.options(frame, 0, 1, [str(x) for x in list(AttentionMechanism)], self.ui_state,
                            "attention_mechanism")
 
@@ -151,15 +156,25 @@ class TrainingTab:
                          tooltip="Number of steps between EMA update steps")
         components.entry(frame, 3, 1, self.ui_state, "ema_update_step_interval")
 
+        # ema weight dtype
+        components.label(frame, 4, 0, "EMA Data Type",
+                         tooltip="The data type of the EMA weights. float16 and bfloat16 store a small correction term with each weight, to keep updates with a high decay accurate")
+        components.options_kv(frame, 4, 1, [
+            ("same as weights", DataType.NONE),
+            ("float32", DataType.FLOAT_32),
+            ("bfloat16", DataType.BFLOAT_16),
+            ("float16", DataType.FLOAT_16),
+        ], self.ui_state, "ema_weight_dtype")
+
         # gradient checkpointing
-        components.label(frame, 4, 0, "Gradient checkpointing",
+        components.label(frame, 5, 0, "Gradient checkpointing",
                          tooltip="Enables gradient checkpointing. This reduces memory usage, but increases training time")
-        components.switch(frame, 4, 1, self.ui_state, "gradient_checkpointing")
+        components.switch(frame, 5, 1, self.ui_state, "gradient_checkpointing")
 
         # train dtype
-        components.label(frame, 5, 0, "Train Data Type",
+        components.label(frame, 6, 0, "Train Data Type",
                          tooltip="The mixed precision data type used for training. This can increase training speed, but reduces precision")
-        components.options_kv(frame, 5, 1, [
+        components.options_kv(frame, 6, 1, [
             ("float32", DataType.FLOAT_32),
             ("float16", DataType.FLOAT_16),
             ("bfloat16", DataType.BFLOAT_16),
@@ -167,9 +182,34 @@ class TrainingTab:
         ], self.ui_state, "train_dtype")
 
         # resolution
-        components.label(frame, 6, 0, "Resolution",
+        components.label(frame, 7, 0, "Resolution",
                          tooltip="The resolution used for training")
-        components.entry(frame, 6, 1, self.ui_state, "resolution")
+        components.entry(frame, 7, 1, self.ui_state, "resolution")
+
+        # resident memory budget
+        components.label(frame, 8, 0, "Resident Memory Budget",
+                         tooltip="The memory in GB of the train device that is used to keep model components resident while sampling and saving, instead of moving them back and forth. This memory is not available for training")
+        components.entry(frame, 8, 1, self.ui_state, "resident_memory_budget")
+
+        # pinned offload
+        components.label(frame, 9, 0, "Pinned Offload",
+                         tooltip="Keeps a pinned copy of every model component in host memory. This speeds up moving components between the train device and the temp device, but uses more host memory")
+        components.switch(frame, 9, 1, self.ui_state, "pinned_offload")
+
+        # layer offload
+        components.label(frame, 10, 0, "Layer Offload",
+                         tooltip="Keeps the frozen weights of the unet, prior and text encoders on the cpu, and streams them to the train device block by block. This reduces memory usage a lot, but slows down training")
+        components.switch(frame, 10, 1, self.ui_state, "layer_offload")
+
+        # compile model
+        components.label(frame, 11, 0, "Compile Model",
+                         tooltip="Compiles the unet or prior with torch.compile. Every resolution bucket is compiled once, the first time it is used. This speeds up long training runs, but the first steps are slow")
+        components.switch(frame, 11, 1, self.ui_state, "compile_model")
+
+        # gradient checkpointing budget
+        components.label(frame, 12, 0, "Gradient Checkpointing Budget",
+                         tooltip="The activation memory in GB of the transformer blocks and trained text encoder layers. The blocks are measured once, and only the blocks that are needed to stay within this budget are checkpointed, the ones with the most memory per recompute time first. 0 checkpoints all blocks")
+        components.entry(frame, 12, 1, self.ui_state, "gradient_checkpointing_budget")
 
     def __create_align_prop_frame(self, master, row):
         frame = ctk.CTkFrame(master=master, corner_radius=5)
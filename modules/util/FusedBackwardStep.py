@@ -0,0 +1,84 @@
+import torch
+from torch import Tensor
+from torch.nn import Parameter
+
+from modules.util.StochasticRoundingStep import StochasticRoundingStep
+from modules.util.optimizer_util import step_parameter
+
+
+class FusedBackwardStep:
+    """
+    Runs the optimizer step of every parameter during the backward pass, as soon as its gradient is accumulated. The
+    gradient is freed right after the step, so at most a few gradients are alive at the same time.
+
+    The total gradient norm is only known after the backward pass. Gradients are clipped with the norm of the
+    previous step instead. During the first step, the gradient of every parameter is clipped on its own.
+    """
+
+    def __init__(
+            self,
+            optimizer: torch.optim.Optimizer,
+            max_norm: float = 1.0,
+            stochastic_rounding: StochasticRoundingStep | None = None,
+    ):
+        self.optimizer = optimizer
+        self.max_norm = max_norm
+        self.stochastic_rounding = stochastic_rounding
+
+        self.__groups: dict[Parameter, dict] = {}
+        self.__hook_handles = []
+
+        self.__norm_squared: Tensor | None = None
+        self.__previous_norm: Tensor | None = None
+
+    def register(self):
+        if self.__hook_handles:
+            return
+
+        for group in self.optimizer.param_groups:
+            for parameter in group['params']:
+                if parameter.requires_grad:
+                    self.__groups[parameter] = group
+                    self.__hook_handles.append(parameter.register_post_accumulate_grad_hook(self.__step))
+
+    def remove(self):
+        for handle in self.__hook_handles:
+            handle.remove()
+        self.__hook_handles = []
+        self.__groups.clear()
+
+    @torch.no_grad()
+    def __clip(self, parameter: Parameter):
+        grad = parameter.grad
+        norm_squared = grad.detach().float().square().sum()
+        self.__norm_squared = norm_squared if self.__norm_squared is None else self.__norm_squared + norm_squared
+
+        if self.__previous_norm is None:
+            norm = norm_squared.sqrt()
+        else:
+            norm = self.__previous_norm.to(device=grad.device)
+
+        # the same clamp as clip_grad_norm_, without synchronizing with the host
+        clip_coefficient = (self.max_norm / (norm + 1e-6)).clamp(max=1.0)
+        grad.mul_(clip_coefficient.to(dtype=grad.dtype))
+
+    def __step(self, parameter: Parameter):
+        if parameter.grad is None:
+            return
+
+        self.__clip(parameter)
+
+        if self.stochastic_rounding is not None and self.stochastic_rounding.is_rounded(parameter):
+            self.stochastic_rounding.step_parameter(parameter)
+        else:
+            step_parameter(self.optimizer, parameter, self.__groups[parameter])
+
+        parameter.grad = None
+
+    def finish_step(self):
+        """
+        Call this after every backward pass.
+        """
+        if self.__norm_squared is not None:
+            self.__previous_norm = self.__norm_squared.sqrt()
+            self.__norm_squared = None
@@ -0,0 +1,197 @@
+import traceback
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any
+
+import torch
+
+from modules.module.EMAModule import EMAModuleWrapper
+from modules.module.LayerOffloadWrapper import LayerOffloadWrapper
+from modules.util.PinnedOffloader import PinnedOffloader
+
+
+class ModuleResidency:
+    """
+    Tracks the device of every component of a model, like the unet or the vae. A component is only moved if it is
+    not already on the requested device.
+
+    With a budget, components that are moved off the budget device are kept there instead, as long as their combined
+    size fits into the budget. Once a component no longer fits, the components that were kept the longest are moved to
+    their requested device. The budget is shared with training, so it should only be as big as the memory that is
+    not needed for training.
+
+    The number of bytes that are moved is recorded for the current phase, for example sampling or backup.
+    """
+
+    def __init__(self):
+        self.__devices: dict[str, torch.device] = {}
+        self.__requested_devices: dict[str, torch.device] = {}
+        self.__modules: dict[str, list[Any]] = {}
+        self.__kept: OrderedDict[str, int] = OrderedDict()
+
+        self.budget_device = None
+        self.budget = 0
+        self.keep_enabled = True
+
+        # moves modules between the cpu and cuda through persistent pinned memory, if set
+        self.pinned_offloader: PinnedOffloader | None = None
+
+        # an ema that reads the parameters in the background, it is finished before any component is moved
+        self.ema: EMAModuleWrapper | None = None
+
+        # components that are streamed to the device block by block, instead of being moved as a whole
+        self.layer_offload_names: set[str] = set()
+        self.__layer_offloads: dict[str, LayerOffloadWrapper] = {}
+
+        self.phase_name = "training"
+        self.bytes_moved: dict[str, int] = {}
+
+    def set_pinned_offload(self, enabled: bool):
+        self.pinned_offloader = PinnedOffloader() if enabled else None
+
+    def set_ema(self, ema: EMAModuleWrapper | None):
+        self.ema = ema
+
+    def set_layer_offload(self, names: list[str]):
+        self.layer_offload_names = set(names)
+
+    def set_budget(self, device: torch.device, budget: int):
+        self.budget_device = self.__normalize(device)
+        self.budget = budget
+
+    @contextmanager
+    def phase(self, name: str):
+        previous_phase_name = self.phase_name
+        self.phase_name = name
+        try:
+            yield
+        finally:
+            self.phase_name = previous_phase_name
+
+    @contextmanager
+    def keep_disabled(self):
+        previous_keep_enabled = self.keep_enabled
+        self.keep_enabled = False
+        try:
+            yield
+        finally:
+            self.keep_enabled = previous_keep_enabled
+
+    def pop_bytes_moved(self) -> dict[str, int]:
+        bytes_moved = self.bytes_moved
+        self.bytes_moved = {}
+        return bytes_moved
+
+    def devices(self) -> dict[str, torch.device]:
+        return dict(self.__devices)
+
+    def device_of(self, name: str) -> torch.device | None:
+        return self.__devices.get(name, None)
+
+    def restore(self, devices: dict[str, torch.device]):
+        for name, device in devices.items():
+            if name in self.__modules:
+                self.move(name, device, self.__modules[name])
+
+    @staticmethod
+    def __normalize(device: torch.device | str) -> torch.device:
+        device = torch.device(device)
+        if device.type == 'cuda' and device.index is None:
+            device = torch.device('cuda', torch.cuda.current_device())
+        return device
+
+    @staticmethod
+    def __size(modules: list[Any]) -> int:
+        size = 0
+        for module in modules:
+            tensors = list(module.parameters())
+            if isinstance(module, torch.nn.Module):
+                tensors += list(module.buffers())
+            size += sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+        return size
+
+    def __hook_layer_offload(self, name: str, device: torch.device, module: torch.nn.Module) -> int:
+        layer_offload = self.__layer_offloads.get(name, None)
+        if layer_offload is None or layer_offload.orig_module is not module or layer_offload.device != device:
+            layer_offload = LayerOffloadWrapper(module, device)
+            self.__layer_offloads[name] = layer_offload
+
+        layer_offload.hook_to_module()
+        return layer_offload.resident_bytes()
+
+    def __move(self, name: str, device: torch.device, modules: list[Any]):
+        if self.ema is not None:
+            self.ema.synchronize()
+
+        if name in self.__layer_offloads:
+            self.__layer_offloads[name].remove_hook_from_module()
+
+        bytes_moved = 0
+        if name in self.layer_offload_names and device.type == 'cuda' \
+                and modules and isinstance(modules[0], torch.nn.Module):
+            # the base module is streamed, its trained wrappers are moved as a whole
+            bytes_moved += self.__hook_layer_offload(name, device, modules[0])
+            modules = modules[1:]
+
+        for module in modules:
+            if self.pinned_offloader is not None and isinstance(module, torch.nn.Module):
+                try:
+                    self.pinned_offloader.to(module, device)
+                    continue
+                except RuntimeError:
+                    # pinned memory is limited, the remaining tensors are moved normally
+                    traceback.print_exc()
+                    print("Could not allocate pinned memory, disabling pinned offloading")
+                    self.pinned_offloader = None
+            module.to(device)
+
+        self.__devices[name] = device
+        bytes_moved += self.__size(modules)
+        self.bytes_moved[self.phase_name] = self.bytes_moved.get(self.phase_name, 0) + bytes_moved
+
+    def __keep(self, name: str, modules: list[Any]) -> bool:
+        size = self.__size(modules)
+        if size > self.budget:
+            return False
+
+        # move the components that were kept the longest, until the new one fits
+        while self.__kept and sum(self.__kept.values()) + size > self.budget:
+            kept_name, _ = self.__kept.popitem(last=False)
+            self.__move(kept_name, self.__requested_devices[kept_name], self.__modules[kept_name])
+
+        self.__kept[name] = size
+        return True
+
+    def move(self, name: str, device: torch.device | str, modules: list[Any]):
+        """
+        Moves a component to a device, if it is not already there.
+
+        Args:
+            name: the name of the component
+            device: the requested device
+            modules: the modules of the component, they are moved together. None entries are ignored
+        """
+        device = self.__normalize(device)
+        modules = [module for module in modules if module is not None]
+
+        if [id(module) for module in self.__modules.get(name, [])] != [id(module) for module in modules]:
+            # modules were added to the component, their device is not known
+            self.__devices.pop(name, None)
+
+        self.__requested_devices[name] = device
+        self.__modules[name] = modules
+
+        current_device = self.__devices.get(name, None)
+        if current_device == device:
+            self.__kept.pop(name, None)
+            return
+
+        if name in self.__kept:
+            # the component is already kept, its size could have changed
+            self.__kept.pop(name)
+
+        if self.keep_enabled and self.budget > 0 and current_device == self.budget_device \
+                and self.__keep(name, modules):
+            return
+
+        self.__move(name, device, modules)
@@ -0,0 +1,105 @@
+import torch
+from torch import nn, Tensor
+
+
+class PinnedOffloader:
+    """
+    Moves modules between a cuda device and the cpu through a persistent pinned copy of every parameter and buffer.
+    Offloading copies the tensors into their pinned copies and frees the device memory, without allocating new host
+    memory. Loading copies the pinned tensors to the device without blocking the host.
+
+    The pinned copies are kept while a module is on the device, so the host memory of a module is only allocated once.
+    """
+
+    def __init__(self):
+        self.__pinned_tensors: dict[int, list[Tensor | None]] = {}
+
+    @staticmethod
+    def __slots(module: nn.Module) -> list[tuple[dict, str]]:
+        # every slot is a (container, key) pair of a parameter or buffer, so it can be replaced in place
+        slots = []
+        for submodule in module.modules():
+            for container in [submodule._parameters, submodule._buffers]:
+                for key, tensor in container.items():
+                    if tensor is not None:
+                        slots.append((container, key))
+        return slots
+
+    @staticmethod
+    def __replace(container: dict, key: str, tensor: Tensor, new_tensor: Tensor):
+        if isinstance(tensor, nn.Parameter):
+            # keep the parameter object, the optimizer and ema still reference it
+            tensor.data = new_tensor
+            if tensor.grad is not None:
+                tensor.grad = tensor.grad.to(new_tensor.device)
+        else:
+            container[key] = new_tensor
+
+    @staticmethod
+    def __pinned_tensor(pinned_tensors: list[Tensor | None], index: int, tensor: Tensor) -> Tensor:
+        pinned_tensor = pinned_tensors[index]
+        if pinned_tensor is None \
+                or pinned_tensor.shape != tensor.shape \
+                or pinned_tensor.dtype != tensor.dtype \
+                or pinned_tensor.stride() != tensor.stride():
+            pinned_tensor = torch.empty_like(tensor, device="cpu", pin_memory=True)
+            pinned_tensors[index] = pinned_tensor
+        return pinned_tensor
+
+    def __offload(self, slots: list[tuple[dict, str]], pinned_tensors: list[Tensor | None]):
+        source_devices = set()
+        for index, (container, key) in enumerate(slots):
+            tensor = container[key]
+            if tensor.device.type != 'cuda':
+                continue
+
+            source_devices.add(tensor.device)
+            pinned_tensor = self.__pinned_tensor(pinned_tensors, index, tensor)
+            pinned_tensor.copy_(tensor.detach(), non_blocking=True)
+            self.__replace(container, key, tensor, pinned_tensor)
+
+        # the pinned tensors are read on the host, the copies need to be finished
+        for device in source_devices:
+            torch.cuda.current_stream(device).synchronize()
+
+    def __load(
+            self,
+            slots: list[tuple[dict, str]],
+            pinned_tensors: list[Tensor | None],
+            device: torch.device,
+    ):
+        for index, (container, key) in enumerate(slots):
+            tensor = container[key]
+            if tensor.device == device:
+                continue
+
+            if tensor.device.type == 'cpu' and not tensor.is_pinned():
+                # the first load of a module that is stored in pageable memory
+                pinned_tensor = self.__pinned_tensor(pinned_tensors, index, tensor)
+                pinned_tensor.copy_(tensor.detach())
+                self.__replace(container, key, tensor, pinned_tensor)
+                tensor = container[key]
+
+            self.__replace(container, key, tensor, tensor.detach().to(device, non_blocking=True))
+
+    def to(self, module: nn.Module, device: torch.device):
+        """
+        Moves a module to a device. Moves between a cuda device and the cpu use the pinned copies, all other moves
+        fall back to module.to.
+        """
+        slots = self.__slots(module)
+        pinned_tensors = self.__pinned_tensors.get(id(module), None)
+        if pinned_tensors is None or len(pinned_tensors) != len(slots):
+            pinned_tensors = [None] * len(slots)
+            self.__pinned_tensors[id(module)] = pinned_tensors
+
+        if device.type == 'cpu':
+            self.__offload(slots, pinned_tensors)
+        elif device.type == 'cuda':
+            self.__load(slots, pinned_tensors, device)
+
+        # moves everything that is not handled above, this is a no-op for tensors that are already on the device
+        module.to(device)
+
+    def clear(self):
+        self.__pinned_tensors.clear()
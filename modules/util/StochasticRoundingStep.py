@@ -0,0 +1,62 @@
+import torch
+from torch import Tensor
+from torch.nn import Parameter
+
+from modules.util.dtype_util import copy_stochastic_
+from modules.util.optimizer_util import step_parameter
+
+
+class StochasticRoundingStep:
+    """
+    Runs the optimizer step of bfloat16 parameters in float32, and rounds the result back to bfloat16 with stochastic
+    rounding. Updates that are smaller than the precision of bfloat16 are kept on average, without storing float32
+    copies of the weights. Only one parameter is converted to float32 at a time.
+    """
+
+    def __init__(self, optimizer: torch.optim.Optimizer, parameters: list[Parameter]):
+        self.optimizer = optimizer
+        self.parameters = [parameter for parameter in parameters if parameter.dtype == torch.bfloat16]
+
+        self.__parameter_ids = set(id(parameter) for parameter in self.parameters)
+        self.__groups: dict[Parameter, dict] = {}
+        for group in optimizer.param_groups:
+            for parameter in group['params']:
+                self.__groups[parameter] = group
+
+    def is_rounded(self, parameter: Parameter) -> bool:
+        return id(parameter) in self.__parameter_ids
+
+    def __upcast_state(self, parameter: Parameter):
+        # loaded states are converted to the data type of the parameter, but the step is calculated in float32
+        state = self.optimizer.state[parameter]
+        for key, value in state.items():
+            if isinstance(value, Tensor) and value.is_floating_point() and value.dtype != torch.float32:
+                state[key] = value.float()
+
+    @torch.no_grad()
+    def step_parameter(self, parameter: Parameter):
+        data = parameter.data
+        grad = parameter.grad
+
+        parameter.data = data.float()
+        parameter.grad = grad.float()
+        self.__upcast_state(parameter)
+        try:
+            step_parameter(self.optimizer, parameter, self.__groups[parameter])
+            copy_stochastic_(data, parameter.data)
+        finally:
+            parameter.data = data
+            parameter.grad = grad
+
+    def step(self):
+        """
+        Runs the optimizer step of all parameters. The rounded parameters are updated one by one, all other
+        parameters are updated together.
+        """
+        for parameter in self.parameters:
+            if parameter.grad is not None:
+                self.step_parameter(parameter)
+                # the optimizer skips parameters without a gradient
+                parameter.grad = None
+
+        self.optimizer.step()
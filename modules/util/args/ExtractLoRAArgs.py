@@ -0,0 +1,65 @@
+import argparse
+from typing import Any
+
+from modules.util.args.BaseArgs import BaseArgs
+from modules.util.enum.DataType import DataType
+from modules.util.enum.ModelType import ModelType
+
+
+class ExtractLoRAArgs(BaseArgs):
+    model_type: ModelType
+    base_model_name: str
+    tuned_model_name: str
+    lora_model_name: str
+    lora_rank: int
+    lora_alpha: float
+    exact_svd: bool
+    threads: int
+    device: str
+    output_dtype: DataType
+    output_model_destination: str
+
+    def __init__(self, data: list[(str, Any, type, bool)]):
+        super(ExtractLoRAArgs, self).__init__(data)
+
+    @staticmethod
+    def parse_args() -> 'ExtractLoRAArgs':
+        parser = argparse.ArgumentParser(description="One Trainer LoRA Extraction Script.")
+
+        # @formatter:off
+
+        parser.add_argument("--model-type", type=ModelType, required=True, dest="model_type", help="Type of the base model", choices=list(ModelType))
+        parser.add_argument("--base-model-name", type=str, required=False, default="", dest="base_model_name", help="The base model in diffusers format, to extract a LoRA")
+        parser.add_argument("--tuned-model-name", type=str, required=False, default="", dest="tuned_model_name", help="The fine tuned model in diffusers format, to extract a LoRA")
+        parser.add_argument("--lora-model-name", type=str, required=False, default="", dest="lora_model_name", help="An existing LoRA to resize, instead of extracting a new one")
+        parser.add_argument("--lora-rank", type=int, required=True, dest="lora_rank", help="The rank of the LoRA")
+        parser.add_argument("--lora-alpha", type=float, required=False, default=None, dest="lora_alpha", help="The alpha of the LoRA. Defaults to the rank")
+        parser.add_argument("--exact-svd", required=False, action='store_true', dest="exact_svd", help="Use a full svd instead of a randomized svd. This is slower, but more precise")
+        parser.add_argument("--threads", type=int, required=False, default=4, dest="threads", help="The number of modules that are factored at the same time")
+        parser.add_argument("--device", type=str, required=False, default="cuda", dest="device", help="The device used to calculate the svd")
+        parser.add_argument("--output-dtype", type=DataType, required=False, default=DataType.FLOAT_16, dest="output_dtype", help="The data type to save the LoRA", choices=list(DataType))
+        parser.add_argument("--output-model-destination", type=str, required=True, dest="output_model_destination", help="The safetensors file to save the LoRA")
+
+        # @formatter:on
+
+        args = ExtractLoRAArgs.default_values()
+        args.from_dict(vars(parser.parse_args()))
+        return args
+
+    @staticmethod
+    def default_values():
+        data = []
+
+        data.append(("model_type", ModelType.STABLE_DIFFUSION_15, ModelType, False))
+        data.append(("base_model_name", "", str, False))
+        data.append(("tuned_model_name", "", str, False))
+        data.append(("lora_model_name", "", str, False))
+        data.append(("lora_rank", 16, int, False))
+        data.append(("lora_alpha", None, float, True))
+        data.append(("exact_svd", False, bool, False))
+        data.append(("threads", 4, int, False))
+        data.append(("device", "cuda", str, False))
+        data.append(("output_dtype", DataType.FLOAT_16, DataType, False))
+        data.append(("output_model_destination", "", str, False))
+
+        return ExtractLoRAArgs(data)
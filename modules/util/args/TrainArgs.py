@@ -35,6 +35,7 @@ class TrainArgs(BaseArgs):
     output_model_format: ModelFormat
     output_model_destination: str
     gradient_checkpointing: bool
+    gradient_checkpointing_budget: float
 
     # data settings
     concept_file_name: str
@@ -44,6 +45,16 @@ class TrainArgs(BaseArgs):
     latent_caching: bool
     latent_caching_epochs: int
     clear_cache_before_training: bool
+    shared_cache: bool
+    streaming_caching: bool
+    streaming_caching_lookahead: int
+    ram_cache_max_size: float
+    ram_cache_spill: bool
+    batched_augmentation: bool
+    batched_augmentation_chunk_size: int
+    latent_augmentation: bool
+    latent_augmentation_crop_margin: int
+    tag_shuffling_variants: int
 
     # training settings
     learning_rate_scheduler: LearningRateScheduler
@@ -53,11 +64,17 @@ class TrainArgs(BaseArgs):
     epochs: int
     batch_size: int
     gradient_accumulation_steps: int
+    fused_back_pass: bool
     ema: EMAMode
     ema_decay: float
     ema_update_step_interval: int
+    ema_weight_dtype: DataType
     train_device: str
     temp_device: str
+    resident_memory_budget: float
+    pinned_offload: bool
+    layer_offload: bool
+    compile_model: bool
     train_dtype: DataType
     only_cache: bool
     resolution: int
@@ -81,6 +98,7 @@ class TrainArgs(BaseArgs):
     force_epsilon_prediction: bool
     max_noising_strength: float
     unet_weight_dtype: DataType
+    unet_channels_last: bool
 
     # prior
     train_prior: bool
@@ -104,14 +122,17 @@ class TrainArgs(BaseArgs):
 
     # vae
     vae_weight_dtype: DataType
+    vae_channels_last: bool
 
     # effnet encoder
     effnet_encoder_model_name: str
     effnet_encoder_weight_dtype: DataType
+    effnet_encoder_channels_last: bool
 
     # decoder
     decoder_model_name: str
     decoder_weight_dtype: DataType
+    decoder_channels_last: bool
 
     # decoder text encoder
     decoder_text_encoder_weight_dtype: DataType
@@ -136,6 +157,8 @@ class TrainArgs(BaseArgs):
     lora_rank: int
     lora_alpha: float
     lora_weight_dtype: DataType
+    merge_lora_for_sampling: bool
+    bake_lora: bool
 
     # optimizer settings
     optimizer: Optimizer
@@ -228,10 +251,18 @@ class TrainArgs(BaseArgs):
             dtypes = []
             if self.train_text_encoder:
                 dtypes.append(weight_dtypes.text_encoder)
-            elif self.unet_weight_dtype:
+            if self.model_type.is_stable_diffusion_xl() and self.train_text_encoder_2:
+                dtypes.append(weight_dtypes.text_encoder_2)
+            if self.model_type.is_wuerstchen():
+                if self.train_prior:
+                    dtypes.append(weight_dtypes.prior)
+            elif self.train_unet:
                 dtypes.append(weight_dtypes.unet)
             return dtypes
 
+    def streaming_caching_enabled(self) -> bool:
+        return self.streaming_caching and self.latent_caching and not self.only_cache
+
     def model_names(self) -> ModelNames:
         return ModelNames(
             base_model=self.base_model_name,
@@ -263,6 +294,7 @@ class TrainArgs(BaseArgs):
         parser.add_argument("--output-model-format", type=ModelFormat, required=False, default=ModelFormat.SAFETENSORS, dest="output_model_format", help="The format to save the final output model", choices=list(ModelFormat))
         parser.add_argument("--output-model-destination", type=str, required=True, dest="output_model_destination", help="The destination to save the final output model")
         parser.add_argument("--gradient-checkpointing", required=False, action='store_true', dest="gradient_checkpointing", help="Enable gradient checkpointing to reduce memory usage")
+        parser.add_argument("--gradient-checkpointing-budget", type=float, required=False, default=0.0, dest="gradient_checkpointing_budget", help="The activation memory in GB of the transformer blocks. Only the blocks that are needed to stay within this budget are checkpointed. 0 checkpoints all blocks")
 
         # data settings
         parser.add_argument("--concept-file-name", type=str, required=True, dest="concept_file_name", help="The json file containing the concept definition")
@@ -272,6 +304,16 @@ class TrainArgs(BaseArgs):
         parser.add_argument("--latent-caching", required=False, action='store_true', dest="latent_caching", help="Enable latent caching")
         parser.add_argument("--latent-caching-epochs", type=int, required=False, default=1, dest="latent_caching_epochs", help="The amount of epochs to cache, to increase sample diversity")
         parser.add_argument("--clear-cache-before-training", required=False, action='store_true', dest="clear_cache_before_training", help="Clears the latent cache before starting to train")
+        parser.add_argument("--shared-cache", required=False, action='store_true', dest="shared_cache", help="Use a latent cache that can be shared by several training runs at the same time. The cache is identified by the model, resolution, augmentation and concept settings")
+        parser.add_argument("--streaming-caching", required=False, action='store_true', dest="streaming_caching", help="Fill the latent cache in the background while training, instead of caching before the first step. Batches are not sorted in the exact aspect bucketing order")
+        parser.add_argument("--streaming-caching-lookahead", type=int, required=False, default=256, dest="streaming_caching_lookahead", help="The maximum number of samples that are cached ahead of training in streaming caching mode")
+        parser.add_argument("--ram-cache-max-size", type=float, required=False, default=0.0, dest="ram_cache_max_size", help="The maximum size of the RAM cache in GB if latent caching is disabled. 0 disables the limit")
+        parser.add_argument("--ram-cache-spill", required=False, action='store_true', dest="ram_cache_spill", help="Write items evicted from the RAM cache to a scratch directory instead of recalculating them")
+        parser.add_argument("--batched-augmentation", required=False, action='store_true', dest="batched_augmentation", help="Apply image augmentations in batches on the train device instead of per sample on the CPU")
+        parser.add_argument("--batched-augmentation-chunk-size", type=int, required=False, default=16, dest="batched_augmentation_chunk_size", help="The number of samples loaded together for batched augmentations")
+        parser.add_argument("--latent-augmentation", required=False, action='store_true', dest="latent_augmentation", help="Apply random flip and crop jitter to the cached latents instead of the images, so each image is only cached once")
+        parser.add_argument("--latent-augmentation-crop-margin", type=int, required=False, default=64, dest="latent_augmentation_crop_margin", help="The number of additional pixels cached in each direction to apply crop jitter in latent space")
+        parser.add_argument("--tag-shuffling-variants", type=int, required=False, default=1, dest="tag_shuffling_variants", help="The number of shuffled caption variants that are encoded and cached once. If greater than 1, a random variant is selected in each epoch")
 
         # training settings
         parser.add_argument("--optimizer", type=Optimizer, required=False, default=Optimizer.ADAMW, dest="optimizer", help="The optimizer", choices=list(Optimizer))
@@ -282,11 +324,17 @@ class TrainArgs(BaseArgs):
         parser.add_argument("--epochs", type=int, required=True, dest="epochs", help="Number of epochs to train")
         parser.add_argument("--batch-size", type=int, required=True, dest="batch_size", help="The batch size")
         parser.add_argument("--gradient-accumulation-steps", type=int, required=False, default=1, dest="gradient_accumulation_steps", help="The amount of steps used for gradient accumulation")
+        parser.add_argument("--fused-back-pass", required=False, action='store_true', dest="fused_back_pass", help="Run the optimizer step of every parameter during the backward pass, and free its gradient right away. Only used without gradient accumulation")
         parser.add_argument("--ema", type=EMAMode, required=False, default=EMAMode.OFF, dest="ema", help="Activate EMA during training", choices=list(EMAMode))
         parser.add_argument("--ema-decay", type=float, required=False, default=0.999, dest="ema_decay", help="Decay parameter of the EMA model")
         parser.add_argument("--ema-update-step-interval", type=int, required=False, default=5, dest="ema_update_step_interval", help="")
+        parser.add_argument("--ema-weight-dtype", type=DataType, required=False, default=DataType.NONE, dest="ema_weight_dtype", help="The data type of the EMA weights. Defaults to the data type of the trained weights", choices=list(DataType))
         parser.add_argument("--train-device", type=str, required=False, default="cuda", dest="train_device", help="The device to train on")
         parser.add_argument("--temp-device", type=str, required=False, default="cpu", dest="temp_device", help="The device to use for temporary data")
+        parser.add_argument("--resident-memory-budget", type=float, required=False, default=0.0, dest="resident_memory_budget", help="The memory in GB of the train device that is used to keep model components resident, instead of moving them to the temp device")
+        parser.add_argument("--pinned-offload", required=False, action='store_true', dest="pinned_offload", help="Keep a pinned copy of every model component in host memory, to speed up moves between the train device and the temp device")
+        parser.add_argument("--layer-offload", required=False, action='store_true', dest="layer_offload", help="Keep the frozen weights of the unet, prior and text encoders on the cpu, and stream them to the train device block by block")
+        parser.add_argument("--compile-model", required=False, action='store_true', dest="compile_model", help="Compile the unet or prior with torch.compile. Every resolution bucket is compiled once, the compiled kernels are cached in the cache directory")
         parser.add_argument("--train-dtype", type=DataType, required=False, default=DataType.FLOAT_16, dest="train_dtype", help="The data type to use for training weights", choices=list(DataType))
         parser.add_argument("--only-cache", required=False, action='store_true', dest="only_cache", help="Only do the caching process without any training")
         parser.add_argument("--resolution", type=int, required=True, dest="resolution", help="Resolution to train at")
@@ -310,6 +358,7 @@ class TrainArgs(BaseArgs):
         parser.add_argument("--force-epsilon-prediction", required=False, action='store_true', dest="force_epsilon_prediction", help="Forces the training to use epsilon-prediction")
         parser.add_argument("--max-noising-strength", type=float, required=False, default=1.0, dest="max_noising_strength", help="The max noising strength for training. Useful to prevent overfitting")
         parser.add_argument("--unet-weight-dtype", type=DataType, required=False, default=DataType.NONE, dest="unet_weight_dtype", help="The data type to use for unet weights during training", choices=list(DataType))
+        parser.add_argument("--unet-channels-last", required=False, action='store_true', dest="unet_channels_last", help="Store the convolution weights and inputs of the unet in the channels last memory format")
 
         # prior
         parser.add_argument("--train-prior", required=False, action='store_true', dest="train_prior", help="Whether the unet should be trained")
@@ -333,14 +382,17 @@ class TrainArgs(BaseArgs):
 
         # vae
         parser.add_argument("--vae-weight-dtype", type=DataType, required=False, default=DataType.NONE, dest="vae_weight_dtype", help="The data type to use for vae weights during training", choices=list(DataType))
+        parser.add_argument("--vae-channels-last", required=False, action='store_true', dest="vae_channels_last", help="Store the convolution weights and inputs of the vae in the channels last memory format")
 
         # effnet encoder
         parser.add_argument("--effnet-encoder-model-name", type=str, required=False, dest="effnet_encoder_model_name", default="", help="The effnet encoder model to start training from")
         parser.add_argument("--effnet-encoder-weight-dtype", type=DataType, required=False, default=DataType.NONE, dest="effnet_encoder_weight_dtype", help="The data type to use for effnet encoder weights during training", choices=list(DataType))
+        parser.add_argument("--effnet-encoder-channels-last", required=False, action='store_true', dest="effnet_encoder_channels_last", help="Store the convolution weights and inputs of the effnet encoder in the channels last memory format")
 
         # decoder
         parser.add_argument("--decoder-model-name", type=str, required=True, dest="decoder_model_name", default="", help="The decoder model to start training from")
         parser.add_argument("--decoder-weight-dtype", type=DataType, required=False, default=DataType.NONE, dest="decoder_weight_dtype", help="The data type to use for decoder weights during training", choices=list(DataType))
+        parser.add_argument("--decoder-channels-last", required=False, action='store_true', dest="decoder_channels_last", help="Store the convolution weights and inputs of the decoder in the channels last memory format")
 
         # decoder text encoder
         parser.add_argument("--decoder-text-encoder-weight-dtype", type=DataType, required=False, default=DataType.NONE, dest="decoder_text_encoder_weight_dtype", help="The data type to use for decoder text encoder weights during training", choices=list(DataType))
@@ -365,6 +417,8 @@ class TrainArgs(BaseArgs):
         parser.add_argument("--lora-rank", type=int, required=False, default=1, dest="lora_rank", help="The rank parameter used when initializing new LoRA networks")
         parser.add_argument("--lora-alpha", type=float, required=False, default=1.0, dest="lora_alpha", help="The alpha parameter used when initializing new LoRA networks")
         parser.add_argument("--lora-weight-dtype", type=DataType, required=False, default=DataType.FLOAT_32, dest="lora_weight_dtype", help="The data type to use for training the LoRA", choices=list(DataType))
+        parser.add_argument("--merge-lora-for-sampling", required=False, action='store_true', dest="merge_lora_for_sampling", help="Merge the LoRA into the base model weights while sampling. This makes sampling as fast as the base model, but keeps a copy of the original weights on the train device")
+        parser.add_argument("--bake-lora", required=False, action='store_true', dest="bake_lora", help="Additionally save the base model with the LoRA merged into its weights when training ends")
 
         # optimizer settings
         parser.add_argument("--optimizer-adam-w-mode", type=nullable_bool, default=None, dest="optimizer_adam_w_mode", help='Whether to use weight decay correction for Adam optimizer.')
@@ -454,6 +508,7 @@ class TrainArgs(BaseArgs):
         data.append(("output_model_format", ModelFormat.SAFETENSORS, ModelFormat, False))
         data.append(("output_model_destination", "models/model.safetensors", str, False))
         data.append(("gradient_checkpointing", True, bool, False))
+        data.append(("gradient_checkpointing_budget", 0.0, float, False))
 
         # data settings
         data.append(("concept_file_name", "training_concepts/concepts.json", str, False))
@@ -463,6 +518,16 @@ class TrainArgs(BaseArgs):
         data.append(("latent_caching", True, bool, False))
         data.append(("latent_caching_epochs", 1, int, False))
         data.append(("clear_cache_before_training", True, bool, False))
+        data.append(("shared_cache", False, bool, False))
+        data.append(("streaming_caching", False, bool, False))
+        data.append(("streaming_caching_lookahead", 256, int, False))
+        data.append(("ram_cache_max_size", 0.0, float, False))
+        data.append(("ram_cache_spill", False, bool, False))
+        data.append(("batched_augmentation", False, bool, False))
+        data.append(("batched_augmentation_chunk_size", 16, int, False))
+        data.append(("latent_augmentation", False, bool, False))
+        data.append(("latent_augmentation_crop_margin", 64, int, False))
+        data.append(("tag_shuffling_variants", 1, int, False))
 
         # training settings
         data.append(("learning_rate_scheduler", LearningRateScheduler.CONSTANT, LearningRateScheduler, False))
@@ -472,11 +537,17 @@ class TrainArgs(BaseArgs):
         data.append(("epochs", 100, int, False))
         data.append(("batch_size", 1, int, False))
         data.append(("gradient_accumulation_steps", 1, int, False))
+        data.append(("fused_back_pass", False, bool, False))
         data.append(("ema", EMAMode.OFF, EMAMode, False))
         data.append(("ema_decay", 0.999, float, False))
         data.append(("ema_update_step_interval", 5, int, False))
+        data.append(("ema_weight_dtype", DataType.NONE, DataType, False))
         data.append(("train_device", "cuda", str, False))
         data.append(("temp_device", "cpu", str, False))
+        data.append(("resident_memory_budget", 0.0, float, False))
+        data.append(("pinned_offload", True, bool, False))
+        data.append(("layer_offload", False, bool, False))
+        data.append(("compile_model", False, bool, False))
         data.append(("train_dtype", DataType.FLOAT_16, DataType, False))
         data.append(("only_cache", False, bool, False))
         data.append(("resolution", 512, int, False))
@@ -500,6 +571,7 @@ class TrainArgs(BaseArgs):
         data.append(("force_epsilon_prediction", False, bool, False))
         data.append(("max_noising_strength", 1.0, float, False))
         data.append(("unet_weight_dtype", DataType.NONE, DataType, False))
+        data.append(("unet_channels_last", False, bool, False))
 
         # prior
         data.append(("train_prior", True, bool, False))
@@ -523,14 +595,17 @@ class TrainArgs(BaseArgs):
 
         # vae
         data.append(("vae_weight_dtype", DataType.FLOAT_32, DataType, False))
+        data.append(("vae_channels_last", False, bool, False))
 
         # effnet encoder
         data.append(("effnet_encoder_model_name", "", str, False))
         data.append(("effnet_encoder_weight_dtype", DataType.NONE, DataType, False))
+        data.append(("effnet_encoder_channels_last", False, bool, False))
 
         # decoder
         data.append(("decoder_model_name", "", str, False))
         data.append(("decoder_weight_dtype", DataType.NONE, DataType, False))
+        data.append(("decoder_channels_last", False, bool, False))
 
         # decoder text encoder
         data.append(("decoder_text_encoder_weight_dtype", DataType.NONE, DataType, False))
@@ -555,6 +630,8 @@ class TrainArgs(BaseArgs):
         data.append(("lora_rank", 16, int, False))
         data.append(("lora_alpha", 1.0, float, False))
         data.append(("lora_weight_dtype", DataType.FLOAT_32, DataType, False))
+        data.append(("merge_lora_for_sampling", False, bool, False))
+        data.append(("bake_lora", False, bool, False))
 
         # optimizer settings
         data.append(("optimizer", Optimizer.ADAMW, Optimizer, False))
@@ -0,0 +1,265 @@
+import hashlib
+import json
+import math
+import os
+import time
+from contextlib import nullcontext
+
+import torch
+import torch.nn.functional as F
+from diffusers.models.attention_processor import Attention, AttnProcessor, XFormersAttnProcessor, AttnProcessor2_0
+from diffusers.utils import is_xformers_available
+from torch import nn
+
+from modules.util.enum.AttentionMechanism import AttentionMechanism
+
+# (attention module, batch size, query length, key length or None for self attention)
+AttentionShape = tuple[Attention, int, int, int | None]
+
+
+def create_attention_processor(attention_mechanism: AttentionMechanism):
+    match attention_mechanism:
+        case AttentionMechanism.DEFAULT:
+            return AttnProcessor()
+        case AttentionMechanism.XFORMERS:
+            return XFormersAttnProcessor()
+        case AttentionMechanism.SDP:
+            return AttnProcessor2_0()
+        case _:
+            raise Exception(f"No attention processor for {attention_mechanism}")
+
+
+def available_attention_mechanisms(device: torch.device) -> list[AttentionMechanism]:
+    attention_mechanisms = [AttentionMechanism.DEFAULT]
+    if hasattr(F, "scaled_dot_product_attention"):
+        attention_mechanisms.append(AttentionMechanism.SDP)
+    if device.type == 'cuda' and is_xformers_available():
+        attention_mechanisms.append(AttentionMechanism.XFORMERS)
+    return attention_mechanisms
+
+
+def bucket_resolutions(resolution: int, aspect_ratio_bucketing: bool) -> list[tuple[int, int]]:
+    """
+    Returns representative (height, width) resolutions of the aspect ratio buckets. All buckets have about the same
+    number of pixels, the square and the 1:2 buckets cover the shapes that are used during training.
+    """
+    resolutions = [(resolution, resolution)]
+    if aspect_ratio_bucketing:
+        resolutions.append((
+            round(resolution / math.sqrt(2) / 8) * 8,
+            round(resolution * math.sqrt(2) / 8) * 8,
+        ))
+    return resolutions
+
+
+def __downscale(size: int, level: int) -> int:
+    # every downsampling convolution rounds up
+    return -(-size // (1 << level))
+
+
+def unet_sequence_length(unet: nn.Module, name: str, latent_size: tuple[int, int]) -> int:
+    """
+    Returns the number of spatial positions at a submodule of a unet. The resolution is derived from the position of
+    the submodule, every down block halves the resolution, every up block doubles it.
+
+    Args:
+        unet: the unet
+        name: the name of the submodule, as returned by named_modules()
+        latent_size: the (height, width) of the latent image
+    """
+    levels = len(unet.down_blocks)
+    parts = name.split('.')
+    if parts[0] == 'down_blocks':
+        level = int(parts[1])
+    elif parts[0] == 'up_blocks':
+        level = levels - 1 - int(parts[1])
+    else:
+        level = levels - 1
+
+    height, width = latent_size
+    return __downscale(height, level) * __downscale(width, level)
+
+
+def unet_attention_shapes(
+        unet: nn.Module,
+        latent_sizes: list[tuple[int, int]],
+        batch_size: int,
+        text_length: int,
+) -> list[AttentionShape]:
+    """
+    Returns the shapes of all attention calls of a unet.
+    """
+    shapes = []
+    for name, module in unet.named_modules():
+        if not isinstance(module, Attention):
+            continue
+
+        for latent_size in latent_sizes:
+            query_length = unet_sequence_length(unet, name, latent_size)
+            key_length = text_length if module.is_cross_attention else None
+            shapes.append((module, batch_size, query_length, key_length))
+    return shapes
+
+
+def vae_attention_shapes(
+        vae: nn.Module,
+        latent_sizes: list[tuple[int, int]],
+        batch_size: int,
+) -> list[AttentionShape]:
+    """
+    Returns the shapes of all attention calls of a vae. Attention is only used in the mid blocks, at the latent
+    resolution.
+    """
+    return [
+        (module, batch_size, height * width, None)
+        for module in vae.modules() if isinstance(module, Attention)
+        for height, width in latent_sizes
+    ]
+
+
+def __synchronize(device: torch.device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def __time_attention(
+        processor,
+        shape: AttentionShape,
+        device: torch.device,
+        autocast_dtype: torch.dtype | None,
+        repeats: int,
+) -> float:
+    attention, batch_size, query_length, key_length = shape
+
+    parameters = list(attention.parameters())
+    orig_device = parameters[0].device
+    dtype = autocast_dtype if autocast_dtype is not None \
+        else next(p.dtype for p in parameters if p.is_floating_point())
+
+    attention.to(device)
+    try:
+        hidden_states = torch.randn(
+            (batch_size, query_length, attention.to_q.in_features), device=device, dtype=dtype, requires_grad=True
+        )
+        encoder_hidden_states = None if key_length is None else torch.randn(
+            (batch_size, key_length, attention.to_k.in_features), device=device, dtype=dtype, requires_grad=True
+        )
+        inputs = [hidden_states] if encoder_hidden_states is None else [hidden_states, encoder_hidden_states]
+
+        # the first call is a warm-up
+        start = 0.0
+        for i in range(repeats + 1):
+            if i == 1:
+                __synchronize(device)
+                start = time.perf_counter()
+
+            with torch.autocast(device.type, dtype=autocast_dtype) if autocast_dtype is not None else nullcontext():
+                output = processor(attention, hidden_states, encoder_hidden_states=encoder_hidden_states)
+            # only the gradients of the inputs, the gradients of trained weights are not changed
+            torch.autograd.grad(output.float().sum(), inputs)
+
+        __synchronize(device)
+        return (time.perf_counter() - start) / repeats
+    finally:
+        attention.to(orig_device)
+
+
+def benchmark_attention(
+        shapes: list[AttentionShape],
+        attention_mechanism: AttentionMechanism,
+        device: torch.device,
+        autocast_dtype: torch.dtype | None,
+        repeats: int = 3,
+) -> float:
+    """
+    Returns the time in seconds of one forward and backward pass through all attention calls. Calls with the same
+    configuration are only timed once.
+    """
+    processor = create_attention_processor(attention_mechanism)
+
+    groups = {}
+    for shape in shapes:
+        attention, batch_size, query_length, key_length = shape
+        key = (
+            attention.to_q.in_features, attention.to_k.in_features, attention.to_q.out_features, attention.heads,
+            attention.group_norm is not None, batch_size, query_length, key_length,
+        )
+        if key in groups:
+            groups[key][1] += 1
+        else:
+            groups[key] = [shape, 1]
+
+    total_time = 0.0
+    for shape, count in groups.values():
+        total_time += count * __time_attention(processor, shape, device, autocast_dtype, repeats)
+    return total_time
+
+
+def __device_name(device: torch.device) -> str:
+    if device.type == 'cuda':
+        return torch.cuda.get_device_name(device)
+    return device.type
+
+
+def select_attention_mechanism(
+        name: str,
+        shapes: list[AttentionShape],
+        device: torch.device,
+        autocast_dtype: torch.dtype | None,
+        cache_path: str,
+        cache_key: str,
+) -> AttentionMechanism:
+    """
+    Selects the fastest available attention mechanism for the attention calls of a module, by timing every
+    mechanism. The decision is cached in a json file, for each device, module and cache key.
+
+    Args:
+        name: the name of the module, for example "unet" or "vae"
+        shapes: the attention calls of the module
+        device: the device to run the benchmark on
+        autocast_dtype: the autocast dtype used during training, or None if autocast is disabled
+        cache_path: the path of the json cache file
+        cache_key: identifies the model type and settings that the shapes depend on
+    """
+    shapes_hash = hashlib.sha256(str(sorted(
+        (shape[1], shape[2], shape[3], shape[0].to_q.in_features, shape[0].heads) for shape in shapes
+    )).encode()).hexdigest()[:16]
+    key = f"{cache_key}|{name}|{__device_name(device)}|{autocast_dtype}|{shapes_hash}"
+
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, "r") as f:
+            cache = json.load(f)
+
+    available = available_attention_mechanisms(device)
+    if key in cache and AttentionMechanism(cache[key]) in available:
+        return AttentionMechanism(cache[key])
+
+    if not shapes:
+        return AttentionMechanism.SDP if AttentionMechanism.SDP in available else AttentionMechanism.DEFAULT
+
+    times = {}
+    for attention_mechanism in available:
+        try:
+            times[attention_mechanism] = benchmark_attention(shapes, attention_mechanism, device, autocast_dtype)
+        except Exception as e:
+            print(f"Could not benchmark the {attention_mechanism} attention of the {name}: {e}")
+        if device.type == 'cuda':
+            torch.cuda.empty_cache()
+
+    if not times:
+        return AttentionMechanism.DEFAULT
+
+    selected = min(times, key=times.get)
+    print(
+        f"Attention benchmark of the {name}: "
+        + ", ".join(f"{x} {t * 1000:.1f}ms" for x, t in times.items())
+        + f". Using {selected}"
+    )
+
+    cache[key] = str(selected)
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    with open(cache_path, "w") as f:
+        json.dump(cache, f, indent=4)
+
+    return selected
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+
+from modules.util.args.TrainArgs import TrainArgs
+
+# settings that change the content of the image cache
+__IMAGE_CACHE_SETTINGS = [
+    'model_type', 'base_model_name', 'effnet_encoder_model_name', 'train_dtype', 'resolution',
+    'aspect_ratio_bucketing', 'masked_training', 'circular_mask_generation', 'random_rotate_and_crop',
+    'batched_augmentation', 'latent_augmentation', 'latent_augmentation_crop_margin',
+]
+
+# settings that change the content of the text cache
+__TEXT_CACHE_SETTINGS = [
+    'model_type', 'base_model_name', 'train_dtype', 'train_text_encoder', 'train_text_encoder_2',
+    'text_encoder_layer_skip', 'text_encoder_2_layer_skip', 'tag_shuffling_variants',
+]
+
+
+# weight dtypes of the models that fill the image and text cache
+__IMAGE_CACHE_WEIGHT_DTYPES = ['vae', 'effnet_encoder']
+__TEXT_CACHE_WEIGHT_DTYPES = ['text_encoder', 'text_encoder_2']
+
+
+# files that hold the weights of a model directory
+__WEIGHT_EXTENSIONS = ['.safetensors', '.bin', '.ckpt', '.pt', '.pth']
+
+
+def __model_identity(name: str | None) -> str:
+    # local files can be replaced without changing their name
+    if name and os.path.isfile(name):
+        stat = os.stat(name)
+        return f"{os.path.abspath(name)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    # the same is true for the weight files inside a diffusers directory
+    if name and os.path.isdir(name):
+        files = []
+        for root, _, file_names in os.walk(name):
+            for file_name in file_names:
+                if os.path.splitext(file_name)[1] in __WEIGHT_EXTENSIONS:
+                    path = os.path.join(root, file_name)
+                    stat = os.stat(path)
+                    files.append(f"{os.path.relpath(path, name)}:{stat.st_size}:{stat.st_mtime_ns}")
+        files_hash = hashlib.sha256("\n".join(sorted(files)).encode('utf-8')).hexdigest()[:16]
+        return f"{os.path.abspath(name)}:{files_hash}"
+
+    return str(name)
+
+
+def shared_cache_key(args: TrainArgs, cache_name: str) -> str:
+    setting_names = __IMAGE_CACHE_SETTINGS if cache_name == 'image' else __TEXT_CACHE_SETTINGS
+    weight_dtype_names = __IMAGE_CACHE_WEIGHT_DTYPES if cache_name == 'image' else __TEXT_CACHE_WEIGHT_DTYPES
+
+    settings = {name: str(getattr(args, name, None)) for name in setting_names}
+
+    # unset weight dtypes fall back to weight_dtype, only the resolved values describe the models
+    weight_dtypes = args.weight_dtypes()
+    for name in weight_dtype_names:
+        settings[name + '_weight_dtype'] = str(getattr(weight_dtypes, name))
+
+    settings['base_model_name'] = __model_identity(args.base_model_name)
+    if 'effnet_encoder_model_name' in setting_names:
+        settings['effnet_encoder_model_name'] = __model_identity(getattr(args, 'effnet_encoder_model_name', None))
+
+    with open(args.concept_file_name, 'r') as f:
+        settings['concepts'] = json.load(f)
+
+    settings_json = json.dumps(settings, sort_keys=True)
+    return hashlib.sha256(settings_json.encode('utf-8')).hexdigest()[:16]
+
+
+def shared_cache_dir(args: TrainArgs, cache_name: str) -> str:
+    return os.path.join(args.cache_dir, "shared", cache_name + "-" + shared_cache_key(args, cache_name))
+
+
+def uses_shared_disk_cache(args: TrainArgs) -> bool:
+    return args.shared_cache or args.streaming_caching_enabled()
+
+
+def disk_cache_dir(args: TrainArgs, cache_name: str) -> str:
+    if args.shared_cache:
+        return shared_cache_dir(args, cache_name)
+    elif args.streaming_caching_enabled():
+        return os.path.join(args.cache_dir, cache_name + "-streaming")
+    else:
+        return os.path.join(args.cache_dir, cache_name)
@@ -51,7 +51,7 @@ from modules.modelSetup.StableDiffusionXLLoRASetup import StableDiffusionXLLoRAS
 from modules.modelSetup.WuerstchenEmbeddingSetup import WuerstchenEmbeddingSetup
 from modules.modelSetup.WuerstchenFineTuneSetup import WuerstchenFineTuneSetup
 from modules.modelSetup.WuerstchenLoRASetup import WuerstchenLoRASetup
-from modules.module.EMAModule import EMAModuleWrapper
+from modules.module.EMAModule import EMAModuleWrapper, AsyncCpuEMAModuleWrapper
 from modules.util.TrainProgress import TrainProgress
 from modules.util.args.TrainArgs import TrainArgs
 from modules.util.enum.EMAMode import EMAMode
@@ -61,6 +61,9 @@ from modules.util.enum.NoiseScheduler import NoiseScheduler
 from modules.util.enum.Optimizer import Optimizer
 from modules.util.enum.TrainingMethod import TrainingMethod
 from modules.util.lr_scheduler_util import *
+from modules.util.optimizer.Adam8bit import Adam8bit
+from modules.util.optimizer.Lion8bit import Lion8bit
+from modules.util.optimizer.SGD8bit import SGD8bit
 
 
 def create_model_loader(
@@ -229,6 +232,18 @@ def create_data_loader(
                 return WuerstchenEmbeddingDataLoader(train_device, temp_device, args, model, train_progress)
 
 
+def __use_bitsandbytes(args: TrainArgs) -> bool:
+    # bitsandbytes only supports cuda, the native 8 bit optimizers are used everywhere else
+    if torch.device(args.train_device).type != 'cuda':
+        return False
+
+    try:
+        import bitsandbytes
+        return True
+    except ImportError:
+        return False
+
+
 def create_optimizer(
         parameters: Iterable[Parameter] | list[dict],
         state_dict: dict | None,
@@ -254,15 +269,26 @@ def create_optimizer(
 
         # SGD_8BIT Optimizer
         case Optimizer.SGD_8BIT:
-            import bitsandbytes as bnb
-            optimizer = bnb.optim.SGD8bit(
-                params=parameters,
-                lr=args.learning_rate,
-                momentum=args.optimizer_momentum if args.optimizer_momentum is not None else 0,
-                dampening=args.optimizer_dampening if args.optimizer_dampening is not None else 0,
-                weight_decay=args.optimizer_weight_decay if args.optimizer_weight_decay is not None else 0,
-                nesterov=args.optimizer_nesterov if args.optimizer_nesterov is not None else False,
-            )
+            if __use_bitsandbytes(args):
+                import bitsandbytes as bnb
+                optimizer = bnb.optim.SGD8bit(
+                    params=parameters,
+                    lr=args.learning_rate,
+                    momentum=args.optimizer_momentum if args.optimizer_momentum is not None else 0,
+                    dampening=args.optimizer_dampening if args.optimizer_dampening is not None else 0,
+                    weight_decay=args.optimizer_weight_decay if args.optimizer_weight_decay is not None else 0,
+                    nesterov=args.optimizer_nesterov if args.optimizer_nesterov is not None else False,
+                )
+            else:
+                optimizer = SGD8bit(
+                    params=parameters,
+                    lr=args.learning_rate,
+                    momentum=args.optimizer_momentum if args.optimizer_momentum is not None else 0,
+                    dampening=args.optimizer_dampening if args.optimizer_dampening is not None else 0,
+                    weight_decay=args.optimizer_weight_decay if args.optimizer_weight_decay is not None else 0,
+                    nesterov=args.optimizer_nesterov if args.optimizer_nesterov is not None else False,
+                    min_8bit_size=args.optimizer_min_8bit_size if args.optimizer_min_8bit_size is not None else 4096,
+                )
 
         # ADAM Optimizer
         case Optimizer.ADAM:
@@ -300,31 +326,51 @@ def create_optimizer(
 
         # ADAM_8BIT Optimizer
         case Optimizer.ADAM_8BIT:
-            import bitsandbytes as bnb
-            optimizer = bnb.optim.Adam(
-                params=parameters,
-                lr=args.learning_rate,
-                weight_decay=args.optimizer_weight_decay if args.optimizer_weight_decay is not None else 0,
-                eps=args.optimizer_eps if args.optimizer_eps is not None else 1e-8,
-                min_8bit_size=args.optimizer_min_8bit_size if args.optimizer_min_8bit_size is not None else 4096,
-                percentile_clipping=args.optimizer_percentile_clipping if args.optimizer_percentile_clipping is not None else 100,
-                block_wise=args.optimizer_block_wise if args.optimizer_block_wise is not None else True,
-                is_paged=args.optimizer_is_paged if args.optimizer_is_paged is not None else False,
-            )
+            if __use_bitsandbytes(args):
+                import bitsandbytes as bnb
+                optimizer = bnb.optim.Adam(
+                    params=parameters,
+                    lr=args.learning_rate,
+                    weight_decay=args.optimizer_weight_decay if args.optimizer_weight_decay is not None else 0,
+                    eps=args.optimizer_eps if args.optimizer_eps is not None else 1e-8,
+                    min_8bit_size=args.optimizer_min_8bit_size if args.optimizer_min_8bit_size is not None else 4096,
+                    percentile_clipping=args.optimizer_percentile_clipping if args.optimizer_percentile_clipping is not None else 100,
+                    block_wise=args.optimizer_block_wise if args.optimizer_block_wise is not None else True,
+                    is_paged=args.optimizer_is_paged if args.optimizer_is_paged is not None else False,
+                )
+            else:
+                optimizer = Adam8bit(
+                    params=parameters,
+                    lr=args.learning_rate,
+                    weight_decay=args.optimizer_weight_decay if args.optimizer_weight_decay is not None else 0,
+                    eps=args.optimizer_eps if args.optimizer_eps is not None else 1e-8,
+                    decoupled_weight_decay=False,
+                    min_8bit_size=args.optimizer_min_8bit_size if args.optimizer_min_8bit_size is not None else 4096,
+                )
 
         # ADAMW_8BIT Optimizer
         case Optimizer.ADAMW_8BIT:
-            import bitsandbytes as bnb
-            optimizer = bnb.optim.AdamW8bit(
-                params=parameters,
-                lr=args.learning_rate,
-                weight_decay=args.optimizer_weight_decay if args.optimizer_weight_decay is not None else 1e-2,
-                eps=args.optimizer_eps if args.optimizer_eps is not None else 1e-8,
-                min_8bit_size=args.optimizer_min_8bit_size if args.optimizer_min_8bit_size is not None else 4096,
-                percentile_clipping=args.optimizer_percentile_clipping if args.optimizer_percentile_clipping is not None else 100,
-                block_wise=args.optimizer_block_wise if args.optimizer_block_wise is not None else True,
-                is_paged=args.optimizer_is_paged if args.optimizer_is_paged is not None else False,
-            )
+            if __use_bitsandbytes(args):
+                import bitsandbytes as bnb
+                optimizer = bnb.optim.AdamW8bit(
+                    params=parameters,
+                    lr=args.learning_rate,
+                    weight_decay=args.optimizer_weight_decay if args.optimizer_weight_decay is not None else 1e-2,
+                    eps=args.optimizer_eps if args.optimizer_eps is not None else 1e-8,
+                    min_8bit_size=args.optimizer_min_8bit_size if args.optimizer_min_8bit_size is not None else 4096,
+                    percentile_clipping=args.optimizer_percentile_clipping if args.optimizer_percentile_clipping is not None else 100,
+                    block_wise=args.optimizer_block_wise if args.optimizer_block_wise is not None else True,
+                    is_paged=args.optimizer_is_paged if args.optimizer_is_paged is not None else False,
+                )
+            else:
+                optimizer = Adam8bit(
+                    params=parameters,
+                    lr=args.learning_rate,
+                    weight_decay=args.optimizer_weight_decay if args.optimizer_weight_decay is not None else 1e-2,
+                    eps=args.optimizer_eps if args.optimizer_eps is not None else 1e-8,
+                    decoupled_weight_decay=True,
+                    min_8bit_size=args.optimizer_min_8bit_size if args.optimizer_min_8bit_size is not None else 4096,
+                )
 
         # ADAGRAD Optimizer
         case Optimizer.ADAGRAD:
@@ -459,18 +505,28 @@ def create_optimizer(
 
         # LION_8BIT Optimizer
         case Optimizer.LION_8BIT:
-            import bitsandbytes as bnb
-            optimizer = bnb.optim.Lion8bit(
-                params=parameters,
-                lr=args.learning_rate if args.learning_rate is not None else 0,
-                weight_decay=args.optimizer_weight_decay if args.optimizer_weight_decay is not None else 0,
-                betas=(args.optimizer_beta1 if args.optimizer_beta1 is not None else 0.9,
-                       args.optimizer_beta2 if args.optimizer_beta2 is not None else 0.999),
-                min_8bit_size=args.optimizer_min_8bit_size if args.optimizer_min_8bit_size is not None else 4096,
-                percentile_clipping=args.optimizer_percentile_clipping if args.optimizer_percentile_clipping is not None else 100,
-                block_wise=args.optimizer_block_wise if args.optimizer_block_wise is not None else True,
-                is_paged=args.optimizer_is_paged if args.optimizer_is_paged is not None else False,
-            )
+            if __use_bitsandbytes(args):
+                import bitsandbytes as bnb
+                optimizer = bnb.optim.Lion8bit(
+                    params=parameters,
+                    lr=args.learning_rate if args.learning_rate is not None else 0,
+                    weight_decay=args.optimizer_weight_decay if args.optimizer_weight_decay is not None else 0,
+                    betas=(args.optimizer_beta1 if args.optimizer_beta1 is not None else 0.9,
+                           args.optimizer_beta2 if args.optimizer_beta2 is not None else 0.999),
+                    min_8bit_size=args.optimizer_min_8bit_size if args.optimizer_min_8bit_size is not None else 4096,
+                    percentile_clipping=args.optimizer_percentile_clipping if args.optimizer_percentile_clipping is not None else 100,
+                    block_wise=args.optimizer_block_wise if args.optimizer_block_wise is not None else True,
+                    is_paged=args.optimizer_is_paged if args.optimizer_is_paged is not None else False,
+                )
+            else:
+                optimizer = Lion8bit(
+                    params=parameters,
+                    lr=args.learning_rate if args.learning_rate is not None else 0,
+                    weight_decay=args.optimizer_weight_decay if args.optimizer_weight_decay is not None else 0,
+                    betas=(args.optimizer_beta1 if args.optimizer_beta1 is not None else 0.9,
+                           args.optimizer_beta2 if args.optimizer_beta2 is not None else 0.999),
+                    min_8bit_size=args.optimizer_min_8bit_size if args.optimizer_min_8bit_size is not None else 4096,
+                )
 
         # DADAPT_SGD Optimizer
         case Optimizer.DADAPT_SGD:
@@ -618,12 +674,21 @@ def create_ema(
     else:
         return None
 
-    ema = EMAModuleWrapper(
-        parameters=parameters,
-        decay=args.ema_decay,
-        update_step_interval=args.ema_update_step_interval,
-        device=device,
-    )
+    if args.ema == EMAMode.CPU and torch.device(args.train_device).type == 'cuda':
+        ema = AsyncCpuEMAModuleWrapper(
+            parameters=parameters,
+            decay=args.ema_decay,
+            update_step_interval=args.ema_update_step_interval,
+            dtype=args.ema_weight_dtype.torch_dtype(),
+        )
+    else:
+        ema = EMAModuleWrapper(
+            parameters=parameters,
+            decay=args.ema_decay,
+            update_step_interval=args.ema_update_step_interval,
+            device=device,
+            dtype=args.ema_weight_dtype.torch_dtype(),
+        )
 
     if state_dict is not None:
         ema.load_state_dict(state_dict)
@@ -1,3 +1,6 @@
+import torch
+from torch import nn, Tensor
+
 from modules.util.args.TrainArgs import TrainArgs
 from modules.util.enum.DataType import DataType
 
@@ -8,3 +11,24 @@ def allow_mixed_precision(train_args: TrainArgs):
     all_dtypes = set(all_dtypes)
 
     return len(all_dtypes) != 1
+
+
+def enable_stochastic_rounding(module: nn.Module, data_type: DataType):
+    """
+    Marks the parameters of a module, so the optimizer step rounds them stochastically if they are trained
+    """
+    if data_type.stochastic_rounding():
+        for parameter in module.parameters():
+            parameter.stochastic_rounding = True
+
+
+def copy_stochastic_(target: Tensor, source: Tensor):
+    """
+    Copies a float32 tensor into a bfloat16 tensor with stochastic rounding. A value is rounded up with a probability
+    that grows with its distance to the next smaller bfloat16 value, so small updates are kept on average.
+    """
+    # a bfloat16 value is the upper half of a float32 value, random lower bits carry over before they are cut off
+    noise = torch.randint_like(source, low=0, high=1 << 16, dtype=torch.int32)
+    result = source.contiguous().view(dtype=torch.int32) + noise
+    result.bitwise_and_(-65536)
+    target.copy_(result.view(dtype=torch.float32))
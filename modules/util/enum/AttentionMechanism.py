@@ -5,6 +5,7 @@ class AttentionMechanism(Enum):
     DEFAULT = 'DEFAULT'
     XFORMERS = 'XFORMERS'
     SDP = 'SDP'
+    AUTO = 'AUTO'
 
     def __str__(self):
         return self.value
@@ -8,7 +8,10 @@ class DataType(Enum):
     FLOAT_16 = 'FLOAT_16'
     FLOAT_32 = 'FLOAT_32'
     BFLOAT_16 = 'BFLOAT_16'
+    BFLOAT_16_STOCHASTIC = 'BFLOAT_16_STOCHASTIC'
     TFLOAT_32 = 'TFLOAT_32'
+    INT_8 = 'INT_8'
+    NFLOAT_4 = 'NFLOAT_4'
 
     def __str__(self):
         return self.value
@@ -21,11 +24,24 @@ class DataType(Enum):
                 return torch.float32
             case DataType.BFLOAT_16:
                 return torch.bfloat16
+            case DataType.BFLOAT_16_STOCHASTIC:
+                return torch.bfloat16
             case DataType.TFLOAT_32:
                 return torch.float32
+            case DataType.INT_8:
+                # quantized weights are loaded in float16, and quantized after loading
+                return torch.float16
+            case DataType.NFLOAT_4:
+                return torch.float16
             case _:
                 return None
 
+    def stochastic_rounding(self):
+        return self == DataType.BFLOAT_16_STOCHASTIC
+
+    def is_quantized(self):
+        return self in [DataType.INT_8, DataType.NFLOAT_4]
+
     def enable_tf(self):
         return self == DataType.TFLOAT_32
 
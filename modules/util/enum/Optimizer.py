@@ -47,3 +47,14 @@ class Optimizer(Enum):
 
     def __str__(self):
         return self.value
+
+    def supports_fused_back_pass(self):
+        # these optimizers estimate their step size from all parameters at once
+        return self not in [
+            Optimizer.DADAPT_ADA_GRAD,
+            Optimizer.DADAPT_ADAM,
+            Optimizer.DADAPT_ADAN,
+            Optimizer.DADAPT_LION,
+            Optimizer.DADAPT_SGD,
+            Optimizer.PRODIGY,
+        ]
@@ -0,0 +1,286 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, Future
+from threading import BoundedSemaphore
+
+import torch
+from huggingface_hub import snapshot_download
+from safetensors import safe_open
+from safetensors.torch import save_file
+from torch import Tensor
+from tqdm import tqdm
+
+from modules.util.enum.ModelType import ModelType
+
+
+def lora_targets(model_type: ModelType) -> list[tuple[str, str, list[str]]]:
+    """
+    Returns the (subfolder, prefix, module_filter) of every module that is trained by a LoRA of this model type.
+    These match the LoRAModuleWrappers created by the LoRA model setups.
+    """
+    if model_type.is_stable_diffusion():
+        return [
+            ("text_encoder", "lora_te", []),
+            ("unet", "lora_unet", ["attentions"]),
+        ]
+    if model_type.is_stable_diffusion_xl():
+        return [
+            ("text_encoder", "lora_te1", []),
+            ("text_encoder_2", "lora_te2", []),
+            ("unet", "lora_unet", ["attentions"]),
+        ]
+    if model_type.is_wuerstchen():
+        return [
+            ("text_encoder", "lora_prior_te", []),
+            ("prior", "lora_prior_prior", ["attention"]),
+        ]
+    return []
+
+
+def factorize(
+        delta: Tensor,
+        rank: int,
+        exact: bool = False,
+        niter: int = 2,
+        oversample: int = 8,
+) -> tuple[Tensor, Tensor]:
+    """
+    Factors a 2d matrix into up @ down with the given rank, using a truncated svd.
+
+    Args:
+        delta: the matrix to factor
+        rank: the rank of the factors, it is reduced to the rank of the matrix if that is lower
+        exact: use a full svd instead of a randomized svd
+        niter: the number of power iterations of the randomized svd
+        oversample: the number of additional vectors used by the randomized svd
+
+    Returns:
+        up with shape (out, rank) and down with shape (rank, in)
+    """
+    delta = delta.to(dtype=torch.float32)
+    rank = min(rank, *delta.shape)
+
+    q = min(rank + oversample, *delta.shape)
+    if exact or q == min(delta.shape):
+        U, S, Vh = torch.linalg.svd(delta, full_matrices=False)
+    else:
+        U, S, V = torch.svd_lowrank(delta, q=q, niter=niter)
+        Vh = V.T
+
+    # split the singular values evenly, to keep both factors in the same range
+    S = S[:rank].sqrt()
+    up = U[:, :rank] * S.unsqueeze(0)
+    down = S.unsqueeze(1) * Vh[:rank]
+
+    return up, down
+
+
+def factorize_low_rank(up: Tensor, down: Tensor, rank: int) -> tuple[Tensor, Tensor]:
+    """
+    Reduces the rank of up @ down without building the full matrix. Both factors are decomposed with a qr
+    decomposition, only the small inner matrix needs an svd.
+    """
+    up = up.to(dtype=torch.float32)
+    down = down.to(dtype=torch.float32)
+
+    q_up, r_up = torch.linalg.qr(up)
+    q_down, r_down = torch.linalg.qr(down.T)
+
+    inner_up, inner_down = factorize(r_up @ r_down.T, rank, exact=True)
+
+    return q_up @ inner_up, inner_down @ q_down.T
+
+
+def __is_lora_target(name: str, tensor_shape: list[int], module_filter: list[str]) -> bool:
+    # Linear and Conv2d weights. Embeddings are 2d as well, but are never wrapped by a LoRA
+    if not name.endswith(".weight") or len(tensor_shape) not in [2, 4]:
+        return False
+
+    module_name = name.removesuffix(".weight")
+    if module_name.split('.')[-1].endswith(("embedding", "embeddings")):
+        return False
+
+    return len(module_filter) == 0 or any(x in module_name for x in module_filter)
+
+
+def __safetensors_files(model_name: str, subfolder: str) -> list[str]:
+    if not os.path.isdir(model_name):
+        model_name = snapshot_download(model_name, allow_patterns=[f"{subfolder}/*.safetensors"])
+
+    directory = os.path.join(model_name, subfolder)
+    if not os.path.isdir(directory):
+        return []
+
+    return [os.path.join(directory, x) for x in sorted(os.listdir(directory)) if x.endswith(".safetensors")]
+
+
+class _TensorReader:
+    # reads single tensors from memory mapped safetensors files, without loading the whole model
+    def __init__(self, files: list[str]):
+        self.handles = [safe_open(file, framework="pt", device="cpu") for file in files]
+        self.key_handles = {key: handle for handle in self.handles for key in handle.keys()}
+
+    def keys(self) -> list[str]:
+        return list(self.key_handles.keys())
+
+    def shape(self, key: str) -> list[int]:
+        return self.key_handles[key].get_slice(key).get_shape()
+
+    def get(self, key: str) -> Tensor:
+        return self.key_handles[key].get_tensor(key)
+
+
+def __to_module_shape(up: Tensor, down: Tensor, weight_shape: list[int]) -> tuple[Tensor, Tensor]:
+    if len(weight_shape) == 4:
+        up = up.reshape(up.shape[0], up.shape[1], 1, 1)
+        down = down.reshape(down.shape[0], down.shape[1], 1, 1)
+    return up, down
+
+
+def __conv_center(weight: Tensor) -> Tensor:
+    # LoRA convolutions are 1x1, they can only represent the center of bigger kernels
+    if weight.dim() == 4:
+        return weight[:, :, weight.shape[2] // 2, weight.shape[3] // 2]
+    return weight
+
+
+def __lora_state(prefix: str, up: Tensor, down: Tensor, rank: int, alpha: float, dtype: torch.dtype) -> dict:
+    # the factors are scaled to cancel the alpha / rank scale applied by the LoRA
+    scale = (rank / alpha) ** 0.5
+    return {
+        prefix + ".lora_down.weight": (down * scale).to(device="cpu", dtype=dtype).contiguous(),
+        prefix + ".lora_up.weight": (up * scale).to(device="cpu", dtype=dtype).contiguous(),
+        prefix + ".alpha": torch.tensor(alpha),
+    }
+
+
+def __run_in_pool(tasks, threads: int, description: str) -> dict[str, Tensor]:
+    # at most two tasks per thread are loaded at the same time, to limit the memory usage
+    state_dict = {}
+    semaphore = BoundedSemaphore(threads * 2)
+    futures: list[Future] = []
+
+    def run(task):
+        try:
+            return task()
+        finally:
+            semaphore.release()
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for task in tasks:
+            semaphore.acquire()
+            futures.append(executor.submit(run, task))
+
+        for future in tqdm(futures, desc=description):
+            state_dict |= future.result()
+
+    return state_dict
+
+
+def extract_lora(
+        model_type: ModelType,
+        base_model_name: str,
+        tuned_model_name: str,
+        rank: int,
+        alpha: float | None,
+        device: torch.device,
+        dtype: torch.dtype,
+        exact: bool = False,
+        threads: int = 4,
+) -> dict[str, Tensor]:
+    """
+    Extracts a LoRA from the difference between two diffusers models. The models are read tensor by tensor from
+    memory mapped safetensors files, and the differences are factored in a thread pool.
+
+    Args:
+        model_type: the model type of both models
+        base_model_name: the diffusers directory or hub name of the base model
+        tuned_model_name: the diffusers directory or hub name of the fine tuned model
+        rank: the rank of the LoRA
+        alpha: the alpha of the LoRA, defaults to the rank
+        device: the device used to calculate the svd
+        dtype: the data type of the LoRA weights
+        exact: use a full svd instead of a randomized svd
+        threads: the number of modules that are factored at the same time
+
+    Returns:
+        the LoRA state dict
+    """
+    alpha = float(rank) if alpha is None else alpha
+    state_dict = {}
+
+    for subfolder, prefix, module_filter in lora_targets(model_type):
+        base = _TensorReader(__safetensors_files(base_model_name, subfolder))
+        tuned = _TensorReader(__safetensors_files(tuned_model_name, subfolder))
+
+        def create_task(key: str):
+            # the tensors are read here, on the thread that submits the tasks
+            weight_shape = tuned.shape(key)
+            tuned_weight = tuned.get(key)
+            base_weight = base.get(key)
+
+            def task() -> dict[str, Tensor]:
+                delta = __conv_center(tuned_weight.to(device, dtype=torch.float32)) \
+                        - __conv_center(base_weight.to(device, dtype=torch.float32))
+                up, down = factorize(delta, rank, exact)
+                up, down = __to_module_shape(up, down, weight_shape)
+                module_prefix = prefix + "_" + key.removesuffix(".weight").replace('.', '_')
+                return __lora_state(module_prefix, up, down, up.shape[1], alpha, dtype)
+            return task
+
+        keys = [
+            key for key in tuned.keys()
+            if key in base.key_handles and __is_lora_target(key, tuned.shape(key), module_filter)
+        ]
+        state_dict |= __run_in_pool((create_task(key) for key in keys), threads, f"extracting {subfolder}")
+
+    return state_dict
+
+
+def resize_lora(
+        lora_name: str,
+        rank: int,
+        alpha: float | None,
+        device: torch.device,
+        dtype: torch.dtype,
+        threads: int = 4,
+) -> dict[str, Tensor]:
+    """
+    Reduces the rank of an existing LoRA. Modules with a rank lower than the new rank keep their rank.
+
+    Args:
+        lora_name: the safetensors file of the LoRA
+        rank: the new rank
+        alpha: the new alpha, defaults to the new rank
+        device: the device used to calculate the svd
+        dtype: the data type of the LoRA weights
+        threads: the number of modules that are factored at the same time
+
+    Returns:
+        the resized LoRA state dict
+    """
+    alpha = float(rank) if alpha is None else alpha
+    lora = _TensorReader([lora_name])
+
+    def create_task(module_prefix: str):
+        down = lora.get(module_prefix + ".lora_down.weight")
+        up = lora.get(module_prefix + ".lora_up.weight")
+        old_alpha = lora.get(module_prefix + ".alpha").item()
+
+        def task() -> dict[str, Tensor]:
+            old_rank = down.shape[0]
+            weight_shape = list(up.shape[:1]) + list(down.shape[1:])
+
+            old_up = up.to(device, dtype=torch.float32).flatten(start_dim=1) * (old_alpha / old_rank)
+            old_down = down.to(device, dtype=torch.float32).flatten(start_dim=1)
+            new_up, new_down = factorize_low_rank(old_up, old_down, rank)
+            new_up, new_down = __to_module_shape(new_up, new_down, weight_shape)
+            return __lora_state(module_prefix, new_up, new_down, new_up.shape[1], alpha, dtype)
+        return task
+
+    module_prefixes = [key.removesuffix(".alpha") for key in lora.keys() if key.endswith(".alpha")]
+    return __run_in_pool((create_task(x) for x in module_prefixes), threads, "resizing")
+
+
+def save_lora(state_dict: dict[str, Tensor], destination: str):
+    os.makedirs(os.path.dirname(os.path.abspath(destination)), exist_ok=True)
+    save_file(state_dict, destination)
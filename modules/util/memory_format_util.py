@@ -0,0 +1,36 @@
+import torch
+from torch import nn, Tensor
+
+
+def to_channels_last(module: nn.Module | None):
+    """
+    Stores the convolution weights of a module in the channels last (NHWC) memory format. Convolutions with channels
+    last weights also produce channels last outputs.
+    """
+    if module is not None:
+        module.to(memory_format=torch.channels_last)
+
+
+def module_memory_format(module: nn.Module | None) -> torch.memory_format:
+    """
+    Returns the memory format of the convolution weights of a module.
+    """
+    if module is not None:
+        for parameter in module.parameters():
+            # weights of 1x1 convolutions are contiguous in both formats
+            if parameter.ndim == 4 \
+                    and parameter.is_contiguous() != parameter.is_contiguous(memory_format=torch.channels_last):
+                return torch.contiguous_format if parameter.is_contiguous() else torch.channels_last
+    return torch.contiguous_format
+
+
+def to_memory_format(tensor: Tensor, memory_format: torch.memory_format) -> Tensor:
+    """
+    Converts an image tensor to a memory format. A tensor without batch dimension is converted as if it had one, so
+    a batch that is stacked from these tensors has the same memory format.
+    """
+    if tensor.ndim == 4:
+        return tensor.contiguous(memory_format=memory_format)
+    elif tensor.ndim == 3:
+        return tensor.unsqueeze(0).contiguous(memory_format=memory_format).squeeze(0)
+    return tensor
@@ -0,0 +1,87 @@
+import math
+
+import torch
+
+from modules.util.optimizer.Blockwise8bitOptimizer import Blockwise8bitOptimizer
+
+
+class Adam8bit(Blockwise8bitOptimizer):
+    def __init__(
+            self,
+            params,
+            lr: float = 1e-3,
+            betas: tuple[float, float] = (0.9, 0.999),
+            eps: float = 1e-8,
+            weight_decay: float = 0.0,
+            decoupled_weight_decay: bool = False,
+            min_8bit_size: int = 4096,
+    ):
+        """
+        Adam with 8 bit states. With decoupled_weight_decay, this is AdamW.
+
+        Args:
+            params: the parameters or parameter groups to optimize
+            lr: the learning rate
+            betas: the decay rates of the first and second moment
+            eps: added to the denominator for numerical stability
+            weight_decay: the weight decay
+            decoupled_weight_decay: apply the weight decay to the weights instead of the gradients
+            min_8bit_size: parameters with less values keep their states in float32
+        """
+        defaults = dict(
+            lr=lr,
+            betas=betas,
+            eps=eps,
+            weight_decay=weight_decay,
+            decoupled_weight_decay=decoupled_weight_decay,
+            min_8bit_size=min_8bit_size,
+        )
+        super(Adam8bit, self).__init__(params, defaults)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            beta1, beta2 = group['betas']
+            lr = group['lr']
+            weight_decay = group['weight_decay']
+
+            for parameter in group['params']:
+                if parameter.grad is None:
+                    continue
+
+                grad = parameter.grad.float()
+                state = self.state[parameter]
+                if not self._has_state(state, ["step", "exp_avg", "exp_avg_sq"]):
+                    state.clear()
+                    state["step"] = 0
+                    self._init_state(state, "exp_avg", parameter, True, group)
+                    self._init_state(state, "exp_avg_sq", parameter, False, group)
+
+                state["step"] += 1
+                exp_avg = self._read_state(state, "exp_avg", parameter, True)
+                exp_avg_sq = self._read_state(state, "exp_avg_sq", parameter, False)
+
+                if weight_decay != 0:
+                    if group['decoupled_weight_decay']:
+                        parameter.mul_(1 - lr * weight_decay)
+                    else:
+                        grad = grad.add(parameter.float(), alpha=weight_decay)
+
+                exp_avg.lerp_(grad, 1 - beta1)
+                exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+
+                bias_correction1 = 1 - beta1 ** state["step"]
+                bias_correction2 = 1 - beta2 ** state["step"]
+                denom = (exp_avg_sq.sqrt() / math.sqrt(bias_correction2)).add_(group['eps'])
+                update = (exp_avg / denom).mul_(lr / bias_correction1)
+                parameter.sub_(update.to(dtype=parameter.dtype))
+
+                self._write_state(state, "exp_avg", exp_avg, True)
+                self._write_state(state, "exp_avg_sq", exp_avg_sq, False)
+
+        return loss
@@ -0,0 +1,65 @@
+import torch
+from torch import Tensor
+from torch.nn import Parameter
+
+from modules.util.quantization_util import quantize_blockwise, dequantize_blockwise
+
+
+class Blockwise8bitOptimizer(torch.optim.Optimizer):
+    """
+    Base class of optimizers that store their states as 8 bit dynamic values, with one absmax per block of 256
+    values. The states are dequantized to float32 for every step, so the update itself is calculated in full
+    precision. States of parameters with less than min_8bit_size values are not quantized.
+
+    This works on every device, without bitsandbytes.
+    """
+
+    def __setstate__(self, state: dict):
+        super(Blockwise8bitOptimizer, self).__setstate__(state)
+        # param groups that were saved by a different optimizer don't have all options
+        for group in self.param_groups:
+            for key, value in self.defaults.items():
+                group.setdefault(key, value)
+
+    def load_state_dict(self, state_dict: dict):
+        super(Blockwise8bitOptimizer, self).load_state_dict(state_dict)
+
+        # the base class converts all states to the data type of their parameter. This would turn the quantized
+        # states into floats, and the absmax of small values can underflow to 0 in float16 or bfloat16
+        saved_ids = [saved_id for group in state_dict['param_groups'] for saved_id in group['params']]
+        parameters = [parameter for group in self.param_groups for parameter in group['params']]
+        for saved_id, parameter in zip(saved_ids, parameters):
+            saved_state = state_dict['state'].get(saved_id, None)
+            if saved_state is None:
+                continue
+
+            state = self.state[parameter]
+            for key, value in saved_state.items():
+                if key != "step" and isinstance(value, Tensor):
+                    state[key] = value.to(device=parameter.device, copy=True)
+
+    @staticmethod
+    def _init_state(state: dict, name: str, parameter: Parameter, signed: bool, group: dict):
+        zeros = torch.zeros_like(parameter, dtype=torch.float32)
+        if parameter.numel() >= group['min_8bit_size']:
+            state[name], state[name + "_absmax"] = quantize_blockwise(zeros, signed)
+        else:
+            state[name] = zeros
+
+    @staticmethod
+    def _read_state(state: dict, name: str, parameter: Parameter, signed: bool) -> Tensor:
+        if name + "_absmax" in state:
+            return dequantize_blockwise(state[name], state[name + "_absmax"], signed, parameter.shape)
+        return state[name].float()
+
+    @staticmethod
+    def _write_state(state: dict, name: str, value: Tensor, signed: bool):
+        if name + "_absmax" in state:
+            state[name], state[name + "_absmax"] = quantize_blockwise(value, signed)
+        else:
+            state[name] = value
+
+    @staticmethod
+    def _has_state(state: dict, names: list[str]) -> bool:
+        # states of other optimizers, like bitsandbytes, are not compatible and are created again
+        return all(name in state for name in names)
@@ -0,0 +1,63 @@
+import torch
+
+from modules.util.optimizer.Blockwise8bitOptimizer import Blockwise8bitOptimizer
+
+
+class Lion8bit(Blockwise8bitOptimizer):
+    def __init__(
+            self,
+            params,
+            lr: float = 1e-4,
+            betas: tuple[float, float] = (0.9, 0.99),
+            weight_decay: float = 0.0,
+            min_8bit_size: int = 4096,
+    ):
+        """
+        Lion with an 8 bit momentum.
+
+        Args:
+            params: the parameters or parameter groups to optimize
+            lr: the learning rate
+            betas: the interpolation factor of the update, and the decay rate of the momentum
+            weight_decay: the decoupled weight decay
+            min_8bit_size: parameters with less values keep their momentum in float32
+        """
+        defaults = dict(
+            lr=lr,
+            betas=betas,
+            weight_decay=weight_decay,
+            min_8bit_size=min_8bit_size,
+        )
+        super(Lion8bit, self).__init__(params, defaults)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            beta1, beta2 = group['betas']
+            lr = group['lr']
+
+            for parameter in group['params']:
+                if parameter.grad is None:
+                    continue
+
+                grad = parameter.grad.float()
+                state = self.state[parameter]
+                if not self._has_state(state, ["exp_avg"]):
+                    state.clear()
+                    self._init_state(state, "exp_avg", parameter, True, group)
+
+                exp_avg = self._read_state(state, "exp_avg", parameter, True)
+
+                parameter.mul_(1 - lr * group['weight_decay'])
+                update = exp_avg.lerp(grad, 1 - beta1).sign_()
+                parameter.sub_((update * lr).to(dtype=parameter.dtype))
+
+                exp_avg.lerp_(grad, 1 - beta2)
+                self._write_state(state, "exp_avg", exp_avg, True)
+
+        return loss
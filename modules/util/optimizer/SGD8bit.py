@@ -0,0 +1,76 @@
+import torch
+
+from modules.util.optimizer.Blockwise8bitOptimizer import Blockwise8bitOptimizer
+
+
+class SGD8bit(Blockwise8bitOptimizer):
+    def __init__(
+            self,
+            params,
+            lr: float = 1e-3,
+            momentum: float = 0.0,
+            dampening: float = 0.0,
+            weight_decay: float = 0.0,
+            nesterov: bool = False,
+            min_8bit_size: int = 4096,
+    ):
+        """
+        SGD with an 8 bit momentum buffer.
+
+        Args:
+            params: the parameters or parameter groups to optimize
+            lr: the learning rate
+            momentum: the momentum factor, no momentum buffer is stored if this is 0
+            dampening: the dampening of the momentum
+            weight_decay: the weight decay
+            nesterov: use nesterov momentum
+            min_8bit_size: parameters with less values keep their momentum buffer in float32
+        """
+        defaults = dict(
+            lr=lr,
+            momentum=momentum,
+            dampening=dampening,
+            weight_decay=weight_decay,
+            nesterov=nesterov,
+            min_8bit_size=min_8bit_size,
+        )
+        super(SGD8bit, self).__init__(params, defaults)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            momentum = group['momentum']
+
+            for parameter in group['params']:
+                if parameter.grad is None:
+                    continue
+
+                grad = parameter.grad.float()
+                if group['weight_decay'] != 0:
+                    grad = grad.add(parameter.float(), alpha=group['weight_decay'])
+
+                if momentum != 0:
+                    state = self.state[parameter]
+                    if not self._has_state(state, ["momentum_buffer"]):
+                        state.clear()
+                        self._init_state(state, "momentum_buffer", parameter, True, group)
+                        momentum_buffer = grad.clone()
+                    else:
+                        momentum_buffer = self._read_state(state, "momentum_buffer", parameter, True)
+                        momentum_buffer.mul_(momentum).add_(grad, alpha=1 - group['dampening'])
+
+                    if group['nesterov']:
+                        grad = grad.add(momentum_buffer, alpha=momentum)
+                    else:
+                        grad = momentum_buffer
+
+                    self._write_state(state, "momentum_buffer", momentum_buffer, True)
+
+                parameter.sub_((grad * group['lr']).to(dtype=parameter.dtype))
+
+        return loss
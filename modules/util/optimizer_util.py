@@ -2,6 +2,9 @@ from modules.util.enum.Optimizer import Optimizer
 import json
 import os
 
+import torch
+from torch.nn import Parameter
+
 class UserPreferenceUtility:
     def __init__(self, file_path="training_user_settings/optimizer_prefs.json"):
         self.file_path = file_path
@@ -286,4 +289,21 @@ OPTIMIZER_KEY_MAP = {
         "optimizer_weight_decay": 0.0,
         "optimizer_use_triton": False
     },
-}
\ No newline at end of file
+}
+
+
+def step_parameter(optimizer: torch.optim.Optimizer, parameter: Parameter, group: dict):
+    """
+    Runs the optimizer step of a single parameter
+
+    Args:
+        optimizer: the optimizer
+        parameter: the parameter to update, it needs a gradient
+        group: the param group of the parameter. It is copied, so the lr scheduler still updates the original group
+    """
+    param_groups = optimizer.param_groups
+    optimizer.param_groups = [group | {'params': [parameter]}]
+    try:
+        optimizer.step()
+    finally:
+        optimizer.param_groups = param_groups
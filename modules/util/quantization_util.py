@@ -0,0 +1,298 @@
+import torch
+import torch.nn.functional as F
+from torch import nn, Tensor
+
+from modules.util.enum.DataType import DataType
+
+# the 16 values of the 4 bit normal float format, from the QLoRA paper
+__NF4_VALUES = [
+    -1.0, -0.6961928009986877, -0.5250730514526367, -0.39491748809814453,
+    -0.28444138169288635, -0.18477343022823334, -0.09105003625154495, 0.0,
+    0.07958029955625534, 0.16093020141124725, 0.24611230194568634, 0.33791524171829224,
+    0.44070982933044434, 0.5626170039176941, 0.7229568362236023, 1.0,
+]
+__NF4_BLOCK_SIZE = 64
+
+
+def __nf4_values(device: torch.device) -> Tensor:
+    return torch.tensor(__NF4_VALUES, dtype=torch.float32, device=device)
+
+
+def __quantize_int8(weight: Tensor) -> tuple[Tensor, Tensor]:
+    # one scale per output channel
+    weight = weight.detach().float()
+    scale = weight.abs().amax(dim=tuple(range(1, weight.dim()))).clamp(min=1e-12) / 127
+    quantized = (weight / scale.view(-1, *[1] * (weight.dim() - 1))).round().clamp(-127, 127).to(torch.int8)
+    return quantized, scale
+
+
+def __quantize_nf4(weight: Tensor) -> tuple[Tensor, Tensor]:
+    # one absmax per block of 64 values, two 4 bit indices per byte
+    weight = weight.detach().float().flatten()
+    weight = F.pad(weight, (0, -weight.numel() % __NF4_BLOCK_SIZE))
+    blocks = weight.view(-1, __NF4_BLOCK_SIZE)
+
+    absmax = blocks.abs().amax(dim=1).clamp(min=1e-12)
+    values = __nf4_values(weight.device)
+    boundaries = (values[1:] + values[:-1]) / 2
+    indices = torch.bucketize(blocks / absmax.unsqueeze(1), boundaries).to(torch.uint8).flatten()
+
+    packed = (indices[0::2] << 4) | indices[1::2]
+    return packed, absmax
+
+
+def dequantize(
+        weight: Tensor,
+        scale: Tensor,
+        data_type: DataType,
+        shape: torch.Size,
+        dtype: torch.dtype,
+) -> Tensor:
+    if data_type == DataType.INT_8:
+        return weight.to(dtype) * scale.to(dtype).view(-1, *[1] * (weight.dim() - 1))
+
+    indices = torch.stack([weight >> 4, weight & 0xF], dim=1).flatten().long()
+    values = __nf4_values(weight.device)[indices].view(-1, __NF4_BLOCK_SIZE) * scale.float().unsqueeze(1)
+    return values.flatten()[:shape.numel()].view(shape).to(dtype)
+
+
+def __dynamic_values(signed: bool) -> list[float]:
+    # the dynamic map of 8 bit optimizers: the values of every decade from 1e-7 to 1 are spaced linearly, with more
+    # values in the bigger decades
+    values = [0.0, 1.0]
+    for decade in range(7):
+        count = 2 ** decade if signed else 2 ** (decade + 1)
+        boundaries = [0.1 + 0.9 * i / count for i in range(count + 1)]
+        means = [(a + b) / 2 for a, b in zip(boundaries[:-1], boundaries[1:])]
+        values += [10 ** (decade - 6) * mean for mean in means]
+        if signed:
+            values += [-10 ** (decade - 6) * mean for mean in means]
+    return sorted(values)
+
+
+__BLOCKWISE_BLOCK_SIZE = 256
+__dynamic_maps = {}
+
+
+def __dynamic_map(signed: bool, device: torch.device) -> Tensor:
+    key = (signed, device)
+    if key not in __dynamic_maps:
+        __dynamic_maps[key] = torch.tensor(__dynamic_values(signed), dtype=torch.float32, device=device)
+    return __dynamic_maps[key]
+
+
+def quantize_blockwise(tensor: Tensor, signed: bool) -> tuple[Tensor, Tensor]:
+    """
+    Quantizes a tensor to 8 bit dynamic values, with one absmax per block of 256 values.
+
+    Args:
+        tensor: the tensor to quantize
+        signed: if the tensor has negative values
+
+    Returns:
+        the quantized values as a flat uint8 tensor, and the absmax of every block
+    """
+    values = tensor.detach().float().flatten()
+    values = F.pad(values, (0, -values.numel() % __BLOCKWISE_BLOCK_SIZE))
+    blocks = values.view(-1, __BLOCKWISE_BLOCK_SIZE)
+
+    absmax = blocks.abs().amax(dim=1).clamp(min=1e-12)
+    code = __dynamic_map(signed, tensor.device)
+    boundaries = (code[1:] + code[:-1]) / 2
+    indices = torch.bucketize(blocks / absmax.unsqueeze(1), boundaries).to(torch.uint8)
+    return indices.flatten(), absmax
+
+
+def dequantize_blockwise(quantized: Tensor, absmax: Tensor, signed: bool, shape: torch.Size) -> Tensor:
+    """
+    Restores a float32 tensor of the given shape from the result of quantize_blockwise.
+    """
+    code = __dynamic_map(signed, quantized.device)
+    values = code[quantized.long()].view(-1, __BLOCKWISE_BLOCK_SIZE) * absmax.float().unsqueeze(1)
+    return values.flatten()[:shape.numel()].view(shape)
+
+
+def __compute_dtype(x: Tensor) -> torch.dtype:
+    # the weights are dequantized directly to the autocast dtype, to avoid a second copy
+    if x.device.type == 'cuda' and torch.is_autocast_enabled():
+        return torch.get_autocast_gpu_dtype()
+    if x.device.type == 'cpu' and torch.is_autocast_cpu_enabled():
+        return torch.get_autocast_cpu_dtype()
+    return x.dtype
+
+
+class _QuantizedLinearFunction(torch.autograd.Function):
+    # the dequantized weight is not saved for the backward pass, it is calculated again from the quantized weight
+
+    @staticmethod
+    def forward(ctx, x: Tensor, weight: Tensor, scale: Tensor, bias: Tensor | None, module: nn.Linear, dtype):
+        ctx.save_for_backward(weight, scale)
+        ctx.module = module
+        ctx.dtype = dtype
+        ctx.input_dtype = x.dtype
+
+        dequantized_weight = dequantize(weight, scale, module.quantized_data_type, module.quantized_shape, dtype)
+        return F.linear(x.to(dtype), dequantized_weight, bias.to(dtype) if bias is not None else None)
+
+    @staticmethod
+    def backward(ctx, grad_output: Tensor):
+        grad_input = None
+        if ctx.needs_input_grad[0]:
+            weight, scale = ctx.saved_tensors
+            module = ctx.module
+            dequantized_weight = dequantize(weight, scale, module.quantized_data_type, module.quantized_shape, ctx.dtype)
+            grad_input = grad_output.to(ctx.dtype).matmul(dequantized_weight).to(ctx.input_dtype)
+        return grad_input, None, None, None, None, None
+
+
+class _QuantizedConv2dFunction(torch.autograd.Function):
+    # the dequantized weight is not saved for the backward pass, it is calculated again from the quantized weight
+
+    @staticmethod
+    def forward(ctx, x: Tensor, weight: Tensor, scale: Tensor, bias: Tensor | None, module: nn.Conv2d, dtype):
+        ctx.save_for_backward(weight, scale)
+        ctx.module = module
+        ctx.dtype = dtype
+        ctx.input_dtype = x.dtype
+        ctx.input_shape = x.shape
+
+        dequantized_weight = dequantize(weight, scale, module.quantized_data_type, module.quantized_shape, dtype)
+        return F.conv2d(
+            x.to(dtype), dequantized_weight, bias.to(dtype) if bias is not None else None,
+            module.stride, module.padding, module.dilation, module.groups,
+        )
+
+    @staticmethod
+    def backward(ctx, grad_output: Tensor):
+        grad_input = None
+        if ctx.needs_input_grad[0]:
+            weight, scale = ctx.saved_tensors
+            module = ctx.module
+            dequantized_weight = dequantize(weight, scale, module.quantized_data_type, module.quantized_shape, ctx.dtype)
+            grad_input = torch.nn.grad.conv2d_input(
+                ctx.input_shape, dequantized_weight, grad_output.to(ctx.dtype),
+                module.stride, module.padding, module.dilation, module.groups,
+            ).to(ctx.input_dtype)
+        return grad_input, None, None, None, None, None
+
+
+def __quantized_linear_forward(self: nn.Linear, x: Tensor, *args, **kwargs) -> Tensor:
+    return _QuantizedLinearFunction.apply(x, self.weight, self.weight_scale, self.bias, self, __compute_dtype(x))
+
+
+def __quantized_conv2d_forward(self: nn.Conv2d, x: Tensor, *args, **kwargs) -> Tensor:
+    return _QuantizedConv2dFunction.apply(x, self.weight, self.weight_scale, self.bias, self, __compute_dtype(x))
+
+
+__quantized_classes = {}
+
+
+def __quantized_class(cls: type) -> type:
+    # a subclass of the original class, so isinstance checks and other methods keep working
+    if cls not in __quantized_classes:
+        forward = __quantized_linear_forward if issubclass(cls, nn.Linear) else __quantized_conv2d_forward
+        __quantized_classes[cls] = type("Quantized" + cls.__name__, (cls,), {
+            "forward": forward,
+            "original_class": cls,
+        })
+    return __quantized_classes[cls]
+
+
+def __is_quantizable(module: nn.Module) -> bool:
+    if is_quantized(module):
+        return False
+    if isinstance(module, nn.Linear):
+        return True
+    if isinstance(module, nn.Conv2d):
+        return module.padding_mode == 'zeros' and not isinstance(module.padding, str)
+    return False
+
+
+def is_quantized(module: nn.Module) -> bool:
+    return hasattr(module, "quantized_data_type")
+
+
+def quantize_module(module: nn.Module, data_type: DataType):
+    """
+    Stores the weights of all Linear and Conv2d layers of a module as int8 with one scale per output channel, or as
+    4 bit normal floats with one scale per block of 64 values. The weights are dequantized on the fly in the forward
+    and backward passes, so the quantized weights can only be used for frozen modules.
+
+    Args:
+        module: the module to quantize
+        data_type: DataType.INT_8 or DataType.NFLOAT_4, other data types are ignored
+    """
+    if not data_type.is_quantized():
+        return
+
+    # module.dtype is read from the first parameter, the layer it belongs to is not quantized
+    first_parameter = next(module.parameters(), None)
+
+    for child in list(module.modules()):
+        if not __is_quantizable(child) or child.weight is first_parameter:
+            continue
+
+        weight = child.weight
+        if data_type == DataType.INT_8:
+            quantized_weight, scale = __quantize_int8(weight)
+        else:
+            quantized_weight, scale = __quantize_nf4(weight)
+
+        child.quantized_data_type = data_type
+        child.quantized_shape = weight.shape
+        child.quantized_dtype = weight.dtype
+        child.weight = nn.Parameter(quantized_weight, requires_grad=False)
+        child.register_buffer("weight_scale", scale.to(device=weight.device))
+        child.__class__ = __quantized_class(type(child))
+
+
+def dequantized_weight(module: nn.Module, dtype: torch.dtype | None = None) -> Tensor:
+    """
+    Returns the weight of a layer, dequantized if the layer is quantized.
+
+    Args:
+        module: a Linear or Conv2d layer
+        dtype: the data type of the returned weight, defaults to the data type of the weight before quantization
+    """
+    if not is_quantized(module):
+        return module.weight if dtype is None else module.weight.to(dtype=dtype)
+
+    return dequantize(
+        module.weight,
+        module.weight_scale,
+        module.quantized_data_type,
+        module.quantized_shape,
+        module.quantized_dtype if dtype is None else dtype,
+    )
+
+
+def dequantize_module(module: nn.Module):
+    """
+    Restores the original Linear and Conv2d layers of a quantized module, with dequantized weights.
+    """
+    for child in list(module.modules()):
+        if not is_quantized(child):
+            continue
+
+        weight = dequantized_weight(child)
+        child.__class__ = child.original_class
+        child.weight = nn.Parameter(weight, requires_grad=False)
+        del child.weight_scale
+        del child.quantized_data_type
+        del child.quantized_shape
+        del child.quantized_dtype
+
+
+def dequantized_state_dict(module: nn.Module) -> dict[str, Tensor]:
+    """
+    Returns the state dict of a module, with the weights of quantized layers replaced by their dequantized weights.
+    """
+    state_dict = module.state_dict()
+    for name, child in module.named_modules():
+        if not is_quantized(child):
+            continue
+
+        prefix = name + "." if name else ""
+        state_dict[prefix + "weight"] = dequantized_weight(child)
+        state_dict.pop(prefix + "weight_scale", None)
+    return state_dict
@@ -0,0 +1,47 @@
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+import torch
+
+from modules.util import lora_util
+from modules.util.args.ExtractLoRAArgs import ExtractLoRAArgs
+
+
+def main():
+    args = ExtractLoRAArgs.parse_args()
+    device = torch.device(args.device)
+
+    if args.lora_model_name:
+        print("Resizing LoRA " + args.lora_model_name)
+        state_dict = lora_util.resize_lora(
+            lora_name=args.lora_model_name,
+            rank=args.lora_rank,
+            alpha=args.lora_alpha,
+            device=device,
+            dtype=args.output_dtype.torch_dtype(),
+            threads=args.threads,
+        )
+    elif args.base_model_name and args.tuned_model_name:
+        print("Extracting LoRA from " + args.tuned_model_name)
+        state_dict = lora_util.extract_lora(
+            model_type=args.model_type,
+            base_model_name=args.base_model_name,
+            tuned_model_name=args.tuned_model_name,
+            rank=args.lora_rank,
+            alpha=args.lora_alpha,
+            device=device,
+            dtype=args.output_dtype.torch_dtype(),
+            exact=args.exact_svd,
+            threads=args.threads,
+        )
+    else:
+        raise Exception("either a LoRA to resize or a base and a tuned model are needed")
+
+    print("Saving LoRA " + args.output_model_destination)
+    lora_util.save_lora(state_dict, args.output_model_destination)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import unittest
+
+import torch
+
+from modules.util.optimizer.Adam8bit import Adam8bit
+from modules.util.optimizer.Lion8bit import Lion8bit
+from modules.util.quantization_util import quantize_blockwise, dequantize_blockwise
+
+
+class TestBlockwise8bitOptimizer(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+
+    def test_quantize_blockwise(self):
+        # the dynamic map keeps the relative error small, even for values that are much smaller than the absmax
+        for signed in [True, False]:
+            values = torch.randn(1000) * torch.logspace(-4, 0, 1000)
+            if not signed:
+                values = values.abs()
+
+            quantized, absmax = quantize_blockwise(values, signed)
+            self.assertEqual(quantized.dtype, torch.uint8)
+            self.assertEqual(absmax.numel(), 4)
+
+            restored = dequantize_blockwise(quantized, absmax, signed, values.shape)
+            self.assertEqual(restored.shape, values.shape)
+            block_absmax = torch.repeat_interleave(absmax, 256)[:values.numel()]
+            self.assertTrue(torch.all((restored - values).abs() <= block_absmax * 0.05 + 1e-12))
+
+    def __train(self, optimizer: torch.optim.Optimizer, parameter: torch.nn.Parameter, steps: int):
+        for _ in range(steps):
+            parameter.grad = torch.randn_like(parameter) * 1e-3
+            optimizer.step()
+
+    def test_state_dict_round_trip(self):
+        for optimizer_class in [Adam8bit, Lion8bit]:
+            for dtype in [torch.float32, torch.bfloat16]:
+                parameter = torch.nn.Parameter(torch.randn((64, 128), dtype=dtype))
+                optimizer = optimizer_class([parameter], lr=1e-3)
+                self.__train(optimizer, parameter, 3)
+                state_dict = optimizer.state_dict()
+
+                loaded_parameter = torch.nn.Parameter(parameter.detach().clone())
+                loaded_optimizer = optimizer_class([loaded_parameter], lr=1e-3)
+                loaded_optimizer.load_state_dict(state_dict)
+
+                state = optimizer.state[parameter]
+                loaded_state = loaded_optimizer.state[loaded_parameter]
+                self.assertEqual(state.keys(), loaded_state.keys())
+                for key, value in state.items():
+                    if isinstance(value, torch.Tensor):
+                        self.assertEqual(value.dtype, loaded_state[key].dtype)
+                        self.assertTrue(torch.equal(value, loaded_state[key]))
+                    else:
+                        self.assertEqual(value, loaded_state[key])
+
+                # both optimizers continue with the same update
+                torch.manual_seed(1)
+                self.__train(optimizer, parameter, 1)
+                torch.manual_seed(1)
+                self.__train(loaded_optimizer, loaded_parameter, 1)
+                self.assertTrue(torch.equal(parameter, loaded_parameter))
+
+
+if __name__ == '__main__':
+    unittest.main()
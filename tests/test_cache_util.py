@@ -0,0 +1,53 @@
+import json
+import os
+import tempfile
+import unittest
+
+from modules.util.args.TrainArgs import TrainArgs
+from modules.util.cache_util import shared_cache_key
+from modules.util.enum.DataType import DataType
+
+
+class TestCacheUtil(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.concept_file_name = os.path.join(self.temp_dir.name, "concepts.json")
+        with open(self.concept_file_name, 'w') as f:
+            json.dump([{'name': 'concept', 'path': 'images'}], f)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def __create_args(self, **kwargs) -> TrainArgs:
+        args = TrainArgs.default_values()
+        args.concept_file_name = self.concept_file_name
+        args.weight_dtype = DataType.FLOAT_32
+        for name, value in kwargs.items():
+            setattr(args, name, value)
+        return args
+
+    def test_resolved_weight_dtypes(self):
+        for cache_name, weight_dtype_name in [('image', 'vae_weight_dtype'), ('text', 'text_encoder_weight_dtype')]:
+            key = shared_cache_key(self.__create_args(), cache_name)
+
+            # an unset encoder dtype falls back to weight_dtype
+            self.assertNotEqual(key, shared_cache_key(self.__create_args(weight_dtype=DataType.FLOAT_16), cache_name))
+            self.assertEqual(
+                key,
+                shared_cache_key(self.__create_args(**{weight_dtype_name: DataType.FLOAT_32}), cache_name),
+            )
+
+            # quantized encoders change the cached data
+            self.assertNotEqual(
+                key,
+                shared_cache_key(self.__create_args(**{weight_dtype_name: DataType.INT_8}), cache_name),
+            )
+
+    def test_unrelated_weight_dtypes(self):
+        # the unet is not used to fill the caches
+        key = shared_cache_key(self.__create_args(), 'image')
+        self.assertEqual(key, shared_cache_key(self.__create_args(unet_weight_dtype=DataType.FLOAT_16), 'image'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+
+import torch
+from diffusers.models.attention import BasicTransformerBlock
+from torch import nn
+from transformers import CLIPTextConfig, CLIPTextModel
+
+from modules.modelSetup.stableDiffusion.CheckpointingPlanner import CheckpointingPlanner
+
+
+class TinyUNet(nn.Module):
+    """
+    Holds transformer blocks at the positions of a unet with two resolution levels.
+    """
+
+    def __init__(self):
+        super(TinyUNet, self).__init__()
+        self.down_blocks = nn.ModuleList([
+            nn.ModuleList([BasicTransformerBlock(32, 2, 16, cross_attention_dim=24) for _ in range(2)]),
+            nn.ModuleList([BasicTransformerBlock(64, 2, 32, cross_attention_dim=24)]),
+        ])
+        self.mid_block = BasicTransformerBlock(64, 2, 32, cross_attention_dim=24)
+
+
+def create_text_encoder() -> CLIPTextModel:
+    return CLIPTextModel(CLIPTextConfig(
+        vocab_size=100,
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        max_position_embeddings=8,
+    ))
+
+
+class TestCheckpointingPlanner(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+
+    def __create_planner(self) -> tuple[CheckpointingPlanner, list[nn.Module]]:
+        unet = TinyUNet()
+        text_encoder = create_text_encoder()
+
+        planner = CheckpointingPlanner(torch.device('cpu'), autocast_dtype=None, batch_size=2)
+        planner.add_transformer_blocks('unet', unet, [(16, 16), (8, 24)], text_length=8)
+        planner.add_clip_encoder_layers('text_encoder', text_encoder)
+
+        blocks = [module for module in unet.modules() if isinstance(module, BasicTransformerBlock)] \
+            + list(text_encoder.text_model.encoder.layers)
+        return planner, blocks
+
+    def test_activation_sizes(self):
+        planner, blocks = self.__create_planner()
+        sizes = planner.activation_sizes()
+
+        self.assertEqual(len(sizes), len(blocks))
+        self.assertTrue(all(size > 0 for size in sizes.values()))
+        self.assertIn('text_encoder.text_model.encoder.layers.0', sizes)
+
+        # the first level has 4 times the sequence length of the second level
+        self.assertGreater(sizes['unet.down_blocks.0.0'], sizes['unet.down_blocks.1.0'])
+        # blocks with the same configuration are measured once
+        self.assertEqual(sizes['unet.down_blocks.0.0'], sizes['unet.down_blocks.0.1'])
+        self.assertEqual(sizes['unet.down_blocks.1.0'], sizes['unet.mid_block'])
+
+    def test_plan(self):
+        planner, blocks = self.__create_planner()
+        sizes = planner.activation_sizes()
+        total_bytes = sum(sizes.values())
+        module_sizes = dict(zip(blocks, sizes.values()))
+
+        self.assertEqual(planner.plan(0), set(blocks))
+        self.assertEqual(planner.plan(total_bytes), set())
+
+        # a smaller budget checkpoints more blocks, and the remaining activations fit into the budget
+        previous = set()
+        for budget in [total_bytes - 1, total_bytes // 2, total_bytes // 4, 1]:
+            checkpointed = planner.plan(budget)
+            self.assertTrue(checkpointed.issubset(set(blocks)))
+            self.assertTrue(previous.issubset(checkpointed))
+            self.assertLessEqual(
+                sum(size for module, size in module_sizes.items() if module not in checkpointed), budget
+            )
+            previous = checkpointed
+
+        self.assertGreater(len(planner.plan(total_bytes - 1)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+import torch
+
+from modules.module.EMAModule import EMAModuleWrapper
+
+
+def compensated_value(ema_parameter: torch.Tensor, compensation: torch.Tensor) -> torch.Tensor:
+    significand_bits = 8 if ema_parameter.dtype == torch.bfloat16 else 11
+    value = ema_parameter.float()
+    ulp = torch.ldexp(torch.ones_like(value), torch.frexp(value).exponent - significand_bits)
+    return value + compensation.float() * ulp / 256
+
+
+class TestEMAModule(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+
+    def __run(self, dtype: torch.dtype, steps: int) -> tuple[EMAModuleWrapper, torch.Tensor]:
+        parameter = torch.nn.Parameter(torch.ones(1000))
+        ema = EMAModuleWrapper([parameter], decay=0.999, dtype=dtype)
+        reference = parameter.detach().clone()
+
+        # every single update is much smaller than the precision of a 16 bit ema parameter
+        target = 1.0 + torch.rand(1000) * 0.02
+        with torch.no_grad():
+            parameter.copy_(target)
+
+        for step in range(steps):
+            optimization_step = 1000000 + step
+            ema.step([parameter], optimization_step)
+            reference.lerp_(target, 1 - ema.get_current_decay(optimization_step))
+
+        return ema, reference
+
+    def test_float32(self):
+        ema, reference = self.__run(torch.float32, 2000)
+        self.assertIsNone(ema.ema_compensation)
+        self.assertTrue(torch.allclose(ema.ema_parameters[0], reference, atol=1e-6))
+
+    def test_compensated_lerp(self):
+        for dtype, ulp in [(torch.bfloat16, 2 ** -7), (torch.float16, 2 ** -10)]:
+            ema, reference = self.__run(dtype, 2000)
+            ema_parameter = ema.ema_parameters[0]
+            compensation = ema.ema_compensation[0]
+
+            self.assertEqual(ema_parameter.dtype, dtype)
+            self.assertEqual(compensation.dtype, torch.int8)
+
+            # the ema parameter is the reference rounded to its precision. The compensation is rounded to 1/256 of
+            # an ulp in every step, these small errors decay together with the ema
+            self.assertTrue(torch.all((ema_parameter.float() - reference).abs() <= ulp))
+            error = (compensated_value(ema_parameter, compensation) - reference).abs()
+            self.assertTrue(torch.all(error <= ulp / 4))
+            self.assertLess(error.mean().item(), ulp / 16)
+
+            # without compensation, every update would be rounded away
+            self.assertGreater((reference - 1.0).abs().mean().item(), ulp / 2)
+
+    def test_compensation_moves_with_the_parameters(self):
+        parameter = torch.nn.Parameter(torch.ones(10))
+        ema = EMAModuleWrapper([parameter], dtype=torch.bfloat16)
+        ema.to(torch.device('cpu'))
+        self.assertEqual(len(ema.ema_compensation), 1)
+        self.assertEqual(ema.ema_compensation[0].device, ema.ema_parameters[0].device)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+import torch
+from transformers import CLIPTextConfig, CLIPTextModel
+
+from modules.model.StableDiffusionXLModel import StableDiffusionXLModel
+from modules.modelSetup.StableDiffusionXLEmbeddingSetup import StableDiffusionXLEmbeddingSetup
+from modules.module.AdditionalEmbeddingWrapper import AdditionalEmbeddingWrapper
+from modules.util.args.TrainArgs import TrainArgs
+from modules.util.enum.ModelType import ModelType
+
+
+def create_text_encoder(hidden_size: int) -> CLIPTextModel:
+    return CLIPTextModel(CLIPTextConfig(
+        vocab_size=100,
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 2,
+        num_hidden_layers=1,
+        num_attention_heads=2,
+        max_position_embeddings=8,
+    ))
+
+
+def create_wrapper(text_encoder: CLIPTextModel) -> AdditionalEmbeddingWrapper:
+    embeddings = text_encoder.get_input_embeddings()
+    return AdditionalEmbeddingWrapper(embeddings, [98, 99], embeddings.weight[[1, 2]], torch.float32)
+
+
+class TestEmbeddingSetup(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+
+    def test_sdxl_optimizer_parameters(self):
+        model = StableDiffusionXLModel(
+            model_type=ModelType.STABLE_DIFFUSION_XL_10_BASE,
+            text_encoder_1=create_text_encoder(16),
+            text_encoder_2=create_text_encoder(32),
+        )
+        model.text_encoder_1.requires_grad_(False)
+        model.text_encoder_2.requires_grad_(False)
+        model.embedding_wrapper_1 = create_wrapper(model.text_encoder_1)
+        model.embedding_wrapper_2 = create_wrapper(model.text_encoder_2)
+
+        args = TrainArgs.default_values()
+        setup = StableDiffusionXLEmbeddingSetup(torch.device('cpu'), torch.device('cpu'), False)
+
+        # only the vectors of the new tokens are trained, never the embedding tables of the text encoders
+        vectors = [model.embedding_wrapper_1.vector, model.embedding_wrapper_2.vector]
+        parameters = [
+            parameter
+            for group in setup.create_parameters_for_optimizer(model, args)
+            for parameter in group['params']
+        ]
+        self.assertEqual([id(parameter) for parameter in parameters], [id(vector) for vector in vectors])
+        self.assertEqual(
+            [id(parameter) for parameter in setup.create_parameters(model, args)],
+            [id(vector) for vector in vectors],
+        )
+
+        # both vectors are updated by a step of the optimizer
+        optimizer = torch.optim.SGD(setup.create_parameters_for_optimizer(model, args), lr=1.0)
+        initial_vectors = [vector.detach().clone() for vector in vectors]
+        for vector in vectors:
+            vector.grad = torch.ones_like(vector)
+        optimizer.step()
+        for vector, initial_vector in zip(vectors, initial_vectors):
+            self.assertFalse(torch.equal(vector, initial_vector))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import copy
+import unittest
+
+import torch
+import torch.utils.checkpoint
+from torch import nn
+
+from modules.module.LayerOffloadWrapper import LayerOffloadWrapper
+
+
+class CheckpointedBlock(nn.Module):
+    def __init__(self, dim: int):
+        super(CheckpointedBlock, self).__init__()
+        self.linear_1 = nn.Linear(dim, dim)
+        self.linear_2 = nn.Linear(dim, dim)
+        self.linear_3 = nn.Linear(dim, dim)
+
+    def __forward(self, x):
+        return self.linear_3(torch.relu(self.linear_2(torch.relu(self.linear_1(x)))))
+
+    def forward(self, x):
+        return x + torch.utils.checkpoint.checkpoint(self.__forward, x, use_reentrant=False)
+
+
+class TestLayerOffloadWrapper(unittest.TestCase):
+    def __run(self, device: torch.device):
+        torch.manual_seed(0)
+        dim = 16
+        model = nn.Sequential(
+            nn.Linear(dim, dim),
+            CheckpointedBlock(dim),
+            CheckpointedBlock(dim),
+            nn.Linear(dim, dim),
+        )
+        model.requires_grad_(False)
+        model[-1].bias.requires_grad_(True)
+        reference = copy.deepcopy(model).to(device)
+
+        # every linear layer is a separate block
+        wrapper = LayerOffloadWrapper(model, device, block_size=1)
+        wrapper.hook_to_module()
+
+        for _ in range(2):
+            x = torch.randn((4, dim), device=device, requires_grad=True)
+            reference_x = x.detach().clone().requires_grad_(True)
+
+            output = model(x)
+            output.square().sum().backward()
+            reference_output = reference(reference_x)
+            reference_output.square().sum().backward()
+
+            self.assertTrue(torch.allclose(output, reference_output))
+            self.assertTrue(torch.allclose(x.grad, reference_x.grad))
+            self.assertTrue(torch.allclose(model[-1].bias.grad, reference[-1].bias.grad))
+            self.assertEqual(len(wrapper.loaded_blocks), 0)
+
+            model[-1].bias.grad = None
+            reference[-1].bias.grad = None
+
+        wrapper.remove_hook_from_module()
+
+    def test_checkpointed_forward_backward_cpu(self):
+        self.__run(torch.device('cpu'))
+
+    @unittest.skipUnless(torch.cuda.is_available(), "requires cuda")
+    def test_checkpointed_forward_backward_cuda(self):
+        self.__run(torch.device('cuda'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import copy
+import unittest
+
+import torch
+from torch import nn
+
+from modules.module.LoRAModule import LoRAModuleWrapper
+
+
+def create_model(dtype: torch.dtype) -> nn.Sequential:
+    return nn.Sequential(
+        nn.Linear(32, 32),
+        nn.Conv2d(8, 8, (3, 3), padding=1),
+    ).to(dtype=dtype)
+
+
+def randomize_lora(lora: LoRAModuleWrapper):
+    # lora_up is initialized with zeros, the LoRA would have no effect
+    for module in lora.modules.values():
+        nn.init.normal_(module.lora_up.weight, std=0.1)
+
+
+class TestLoRAModule(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+
+    def test_merge_matches_hook(self):
+        model = create_model(torch.float32)
+        lora = LoRAModuleWrapper(model, 4, "lora", alpha=2.0)
+        randomize_lora(lora)
+        lora.hook_to_module()
+
+        x = torch.randn((2, 32))
+        image = torch.randn((2, 8, 6, 6))
+        with torch.no_grad():
+            hooked_output = model[0](x)
+            hooked_image = model[1](image)
+
+            lora.merge_into_module()
+            self.assertFalse(lora.modules["0"].is_applied)
+            merged_output = model[0](x)
+            merged_image = model[1](image)
+
+        self.assertTrue(torch.allclose(hooked_output, merged_output, atol=1e-5))
+        # the 1x1 LoRA convolution only changes the center of the 3x3 kernel
+        self.assertTrue(torch.allclose(hooked_image, merged_image, atol=1e-5))
+
+    def test_unmerge_is_exact(self):
+        for dtype in [torch.float32, torch.bfloat16, torch.float16]:
+            model = create_model(dtype)
+            original_state = copy.deepcopy(model.state_dict())
+            lora = LoRAModuleWrapper(model, 4, "lora")
+            randomize_lora(lora)
+            lora.hook_to_module()
+
+            for _ in range(3):
+                lora.merge_into_module()
+                self.assertFalse(torch.equal(model[0].weight, original_state["0.weight"]))
+                lora.unmerge_from_module()
+
+                for key, value in model.state_dict().items():
+                    self.assertEqual(value.dtype, original_state[key].dtype)
+                    self.assertTrue(torch.equal(value, original_state[key]))
+                self.assertTrue(lora.modules["0"].is_applied)
+                self.assertIsNone(lora.modules["0"].merge_backup)
+
+    def test_merge_backup_stays_on_device(self):
+        model = create_model(torch.bfloat16)
+        lora = LoRAModuleWrapper(model, 4, "lora")
+        lora.merge_into_module()
+
+        backup = lora.modules["0"].merge_backup
+        self.assertEqual(backup.device, model[0].weight.device)
+        self.assertEqual(backup.dtype, torch.bfloat16)
+        self.assertNotEqual(backup.data_ptr(), model[0].weight.data_ptr())
+        lora.unmerge_from_module()
+
+
+if __name__ == '__main__':
+    unittest.main()
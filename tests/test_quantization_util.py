@@ -0,0 +1,107 @@
+import unittest
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+from modules.module.LoRAModule import LoRAModuleWrapper
+from modules.util.enum.DataType import DataType
+from modules.util.quantization_util import quantize_module, dequantize_module, dequantized_weight, \
+    dequantized_state_dict, is_quantized
+
+
+def create_model() -> nn.Sequential:
+    # the first layer holds the first parameter, it is never quantized
+    return nn.Sequential(
+        nn.Linear(8, 8),
+        nn.Linear(128, 32),
+        nn.Conv2d(16, 8, (3, 3), padding=1),
+    )
+
+
+class TestQuantizationUtil(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+
+    def test_int8_round_trip(self):
+        model = create_model()
+        weights = [model[1].weight.detach().clone(), model[2].weight.detach().clone()]
+        quantize_module(model, DataType.INT_8)
+
+        self.assertFalse(is_quantized(model[0]))
+        for layer, weight in zip([model[1], model[2]], weights):
+            self.assertTrue(is_quantized(layer))
+            self.assertEqual(layer.weight.dtype, torch.int8)
+
+            # one scale per output channel, the error is at most half a quantization step
+            step = weight.abs().flatten(start_dim=1).amax(dim=1) / 127
+            error = (dequantized_weight(layer, torch.float32) - weight).abs().flatten(start_dim=1).amax(dim=1)
+            self.assertTrue(torch.all(error <= step / 2 + 1e-6))
+
+    def test_nf4_round_trip(self):
+        model = create_model()
+        weight = model[1].weight.detach().clone()
+        quantize_module(model, DataType.NFLOAT_4)
+
+        self.assertEqual(model[1].weight.dtype, torch.uint8)
+        self.assertEqual(model[1].weight.numel(), weight.numel() // 2)
+
+        # the largest gap between two nf4 values is 0.3038, the error is at most half of it times the block absmax
+        absmax = weight.flatten().view(-1, 64).abs().amax(dim=1, keepdim=True)
+        error = (dequantized_weight(model[1], torch.float32) - weight).flatten().view(-1, 64).abs()
+        self.assertTrue(torch.all(error <= absmax * 0.1520))
+
+    def test_forward_backward(self):
+        for data_type in [DataType.INT_8, DataType.NFLOAT_4]:
+            model = create_model()
+            quantize_module(model, data_type)
+
+            x = torch.randn((4, 128), requires_grad=True)
+            output = model[1](x)
+            output.sum().backward()
+
+            reference_x = x.detach().clone().requires_grad_(True)
+            reference_output = F.linear(reference_x, dequantized_weight(model[1], torch.float32), model[1].bias)
+            reference_output.sum().backward()
+
+            self.assertTrue(torch.allclose(output, reference_output, atol=1e-5))
+            self.assertTrue(torch.allclose(x.grad, reference_x.grad, atol=1e-5))
+
+            image = torch.randn((2, 16, 8, 8), requires_grad=True)
+            output = model[2](image)
+            reference_output = F.conv2d(image, dequantized_weight(model[2], torch.float32), model[2].bias, padding=1)
+            self.assertTrue(torch.allclose(output, reference_output, atol=1e-5))
+
+    def test_dequantize_module(self):
+        model = create_model()
+        quantize_module(model, DataType.INT_8)
+        weight = dequantized_weight(model[1])
+        state_dict = dequantized_state_dict(model)
+
+        self.assertNotIn("1.weight_scale", state_dict)
+        self.assertEqual(state_dict["1.weight"].shape, (32, 128))
+        self.assertTrue(torch.equal(state_dict["1.weight"], weight))
+
+        dequantize_module(model)
+        self.assertFalse(is_quantized(model[1]))
+        self.assertIs(type(model[1]), nn.Linear)
+        self.assertTrue(torch.equal(model[1].weight, weight))
+
+    def test_strict_lora_merge(self):
+        model = create_model()
+        quantize_module(model, DataType.INT_8)
+        lora = LoRAModuleWrapper(model, 4, "lora")
+        lora.hook_to_module()
+
+        # without strict, the LoRA of quantized layers stays hooked
+        lora.merge_into_module()
+        self.assertTrue(lora.modules["1"].is_applied)
+        lora.unmerge_from_module()
+
+        with self.assertRaises(Exception):
+            lora.merge_into_module(strict=True)
+        lora.unmerge_from_module()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+import torch
+
+from modules.util.StochasticRoundingStep import StochasticRoundingStep
+from modules.util.dtype_util import copy_stochastic_
+
+
+class TestStochasticRounding(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+
+    def test_representable_values_are_exact(self):
+        source = torch.randn(10000).to(torch.bfloat16).float()
+        target = torch.empty(10000, dtype=torch.bfloat16)
+        copy_stochastic_(target, source)
+        self.assertTrue(torch.equal(target.float(), source))
+
+    def test_rounds_to_neighbours(self):
+        source = torch.randn(10000)
+        target = torch.empty(10000, dtype=torch.bfloat16)
+        copy_stochastic_(target, source)
+
+        # bfloat16 truncates float32 to its upper 16 bits, the next value away from zero is one step further
+        lower = (source.view(dtype=torch.int32) & -65536).view(dtype=torch.float32)
+        upper = ((source.view(dtype=torch.int32) & -65536) + 65536).view(dtype=torch.float32)
+        self.assertTrue(torch.all((target.float() == lower) | (target.float() == upper)))
+
+    def test_unbiased(self):
+        # the spacing of bfloat16 values around 1 is 2^-7, this value is a quarter step above 1
+        value = 1.0 + 2 ** -9
+        source = torch.full((100000,), value)
+        target = torch.empty(100000, dtype=torch.bfloat16)
+        copy_stochastic_(target, source)
+
+        self.assertEqual(source.to(torch.bfloat16)[0].item(), 1.0)
+        self.assertAlmostEqual(target.float().mean().item(), value, delta=2 ** -12)
+
+        source = -source
+        copy_stochastic_(target, source)
+        self.assertAlmostEqual(target.float().mean().item(), -value, delta=2 ** -12)
+
+    def test_small_updates_are_kept(self):
+        parameter = torch.nn.Parameter(torch.ones(10000, dtype=torch.bfloat16))
+        optimizer = torch.optim.SGD([parameter], lr=1e-4)
+        step = StochasticRoundingStep(optimizer, [parameter])
+        self.assertTrue(step.is_rounded(parameter))
+
+        for _ in range(100):
+            parameter.grad = torch.ones_like(parameter)
+            step.step()
+
+        # every update is smaller than half a bfloat16 step, nearest rounding would keep all values at 1
+        self.assertEqual(parameter.dtype, torch.bfloat16)
+        self.assertIsNone(parameter.grad)
+        self.assertAlmostEqual(parameter.float().mean().item(), 1.0 - 100 * 1e-4, delta=1e-3)
+
+
+if __name__ == '__main__':
+    unittest.main()
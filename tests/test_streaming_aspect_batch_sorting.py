@@ -0,0 +1,108 @@
+import time
+import unittest
+
+from modules.dataLoader.cache.StreamingAspectBatchSorting import StreamingAspectBatchSorting
+
+# number of items per resolution
+BUCKET_SIZES = {
+    (512, 512): 7,
+    (512, 768): 5,
+    (768, 512): 4,
+}
+
+
+class ListBatchSorting(StreamingAspectBatchSorting):
+    """
+    Reads the items from a list instead of the previous modules of a pipeline.
+    """
+
+    def __init__(self, resolutions: list[tuple[int, int]], batch_size: int, lookahead: int):
+        super(ListBatchSorting, self).__init__(
+            resolution_in_name='resolution', names=['index'], batch_size=batch_size, lookahead=lookahead,
+        )
+        self.resolutions = resolutions
+        self.fail_at = None
+        self.loaded = 0
+
+    def get_previous_length(self, name: str) -> int:
+        return len(self.resolutions)
+
+    def get_previous_item(self, name: str, index: int):
+        if name == 'resolution':
+            return self.resolutions[index]
+        if index == self.fail_at:
+            raise RuntimeError("failed to load item " + str(index))
+        self.loaded += 1
+        return index
+
+
+def create_resolutions() -> list[tuple[int, int]]:
+    resolutions = []
+    for resolution, count in BUCKET_SIZES.items():
+        resolutions.extend([resolution] * count)
+    return resolutions
+
+
+class TestStreamingAspectBatchSorting(unittest.TestCase):
+    def __read_epoch(self, module: StreamingAspectBatchSorting, variation: int) -> list[int]:
+        module.start(variation)
+        return [module.get_item(index)['index'] for index in range(module.length())]
+
+    def test_batches(self):
+        resolutions = create_resolutions()
+        for batch_size in [1, 2, 3]:
+            # the lookahead is raised to the minimum that can't block the producer
+            module = ListBatchSorting(resolutions, batch_size, lookahead=1)
+            indices = self.__read_epoch(module, 0)
+
+            # incomplete batches are dropped
+            expected_length = sum(count - count % batch_size for count in BUCKET_SIZES.values())
+            self.assertEqual(module.length(), expected_length)
+            self.assertEqual(len(indices), expected_length)
+            self.assertEqual(len(set(indices)), expected_length)
+
+            for batch_start in range(0, len(indices), batch_size):
+                batch = indices[batch_start:batch_start + batch_size]
+                self.assertEqual(len({resolutions[index] for index in batch}), 1)
+
+            with self.assertRaises(IndexError):
+                module.get_item(expected_length)
+
+    def test_order(self):
+        module = ListBatchSorting(create_resolutions(), batch_size=2, lookahead=4)
+        first_epoch = self.__read_epoch(module, 0)
+
+        # the epoch order only depends on the variation, not on the timing of the producer thread
+        self.assertEqual(self.__read_epoch(module, 0), first_epoch)
+        self.assertNotEqual(self.__read_epoch(module, 1), first_epoch)
+
+    def test_restart_during_epoch(self):
+        module = ListBatchSorting(create_resolutions(), batch_size=2, lookahead=4)
+        module.start(0)
+        module.get_item(0)
+
+        self.assertEqual(len(self.__read_epoch(module, 1)), module.length())
+
+    def test_pause(self):
+        module = ListBatchSorting(create_resolutions(), batch_size=2, lookahead=4)
+        module.pause()
+        module.start(0)
+        time.sleep(0.1)
+        self.assertEqual(module.loaded, 0)
+        module.resume()
+
+        self.assertEqual(len(self.__read_epoch(module, 0)), module.length())
+
+    def test_error(self):
+        module = ListBatchSorting(create_resolutions(), batch_size=2, lookahead=4)
+        module.fail_at = 3
+        module.start(0)
+
+        # the error of the producer thread is raised in the consumer
+        with self.assertRaises(RuntimeError):
+            for index in range(module.length()):
+                module.get_item(index)
+
+
+if __name__ == '__main__':
+    unittest.main()